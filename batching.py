@@ -0,0 +1,109 @@
+"""
+Async micro-batching helpers.
+Collects concurrent requests over a short window and processes them in a
+single batched call, resolving each caller with its own result.
+"""
+
+import asyncio
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent submissions into batches.
+
+    A batch is flushed when it reaches max_batch_size items or when max_wait
+    seconds have passed since its first item, whichever comes first.
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait=0.005):
+        """
+        Args:
+            process_batch: Async callable taking a list of items and returning a
+                list of results in the same order. A result that is an exception
+                instance is raised to that item's caller only.
+            max_batch_size: Maximum number of items per batch
+            max_wait: Maximum seconds an item waits for others to join its batch
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        self._running = set()
+        self.batches_processed = 0
+        self.items_processed = 0
+
+    async def submit(self, item):
+        """
+        Submit one item and wait for its result.
+
+        Args:
+            item: The item to process
+
+        Returns:
+            The result for this item
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.ensure_future(self._run(batch))
+        # Keep a reference so the task isn't garbage collected mid-flight
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        items = [item for item, _ in batch]
+        error = RuntimeError("Batch processing was cancelled")
+        try:
+            results = await self.process_batch(items)
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch of {len(batch)} items returned {len(results)} results")
+
+            self.batches_processed += 1
+            self.items_processed += len(batch)
+
+            for (_, future), result in zip(batch, results):
+                # Callers that were cancelled while waiting are skipped
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            error = e
+        finally:
+            # Whatever went wrong, including cancellation, no caller is left waiting
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    def stats(self):
+        """
+        Get batching statistics.
+
+        Returns:
+            Dictionary with batches, items and the average batch size
+        """
+        return {
+            "batches": self.batches_processed,
+            "items": self.items_processed,
+            "avg_batch_size": self.items_processed / self.batches_processed if self.batches_processed else 0.0,
+        }
@@ -1,27 +1,147 @@
+import sys
+import startup_profile
+
+# Must run before the imports below so they can be timed
+if "--startup-profile" in sys.argv:
+    startup_profile.enable()
+
+import argparse
+import asyncio
+import random
+import time
 import discord
 from discord.ext import commands
-from collections import deque
 from colorama import Fore
 
 import config
 from utils import log, replace_with_mentions
-from llm import should_bot_reply, get_llm_response
+from llm import should_bot_reply, get_llm_response, decide_and_respond, retrieve_memories, message_namespace
+from message_tracker import ProcessedMessageTracker
+from metrics import LoopLagMonitor, ReplyModeStats, DeadlineStats
+from deadline import ReplyDeadline, RetrievalCache, retrieve_within_budget
+from speculation import reply_likelihood, SpeculationBudget
+from user_management import UserProfile
+from memory_writer import WriteBehindBuffer
+import search_worker
+import profiler
 
 # -------- Discord Bot Setup --------
-intents = discord.Intents.default()
-intents.message_content = True
-intents.guilds = True
-intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+# The bot and the state that opens files are built by init_bot(), not on
+# import: spawned search workers re-import this script as __mp_main__
+bot = None
+processed_messages = None   # track processed message IDs to prevent duplicates, including replays after restarts
+memory_writer = None        # background write-behind ingestion of new messages into memory
+loop_lag_monitor = None
 
 conversation_history = {}   # short memory per channel
-processed_messages = deque(maxlen=1000)  # track processed message IDs to prevent duplicates
+
+search_backend = (
+    "memory-service" if config.MEMORY_SERVICE_ADDRESS
+    else "worker" if config.SEARCH_WORKER_PROCESSES > 0
+    else "thread"
+)
+
+reply_mode_stats = ReplyModeStats()
+deadline_stats = DeadlineStats()
+retrieval_cache = RetrievalCache(ttl_seconds=config.RETRIEVAL_CACHE_SECONDS)
+speculation_budget = SpeculationBudget(
+    threshold=config.SPECULATIVE_THRESHOLD,
+    max_wasted=config.SPECULATIVE_WASTE_BUDGET,
+    window_seconds=config.SPECULATIVE_BUDGET_WINDOW_SECONDS
+)
+
+def create_bot():
+    """Build the Discord bot, sharded when sharding is configured."""
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.guilds = True
+    intents.members = True
+    if config.AUTO_SHARD or config.SHARD_COUNT or config.SHARD_IDS:
+        # Each shard process only receives events for its own guilds, so the
+        # per-channel state below is naturally owned by the shard
+        return commands.AutoShardedBot(
+            command_prefix="!",
+            intents=intents,
+            shard_count=config.SHARD_COUNT,
+            shard_ids=config.SHARD_IDS
+        )
+    return commands.Bot(command_prefix="!", intents=intents)
+
+def build_prompt(history, content):
+    """Build the generation prompt from the channel history and the new message."""
+    return (
+        f"Recent chat history:\n{history}\n\n"
+        f"User: {content}"
+    )
+
+def choose_reply_mode():
+    """Pick the reply mode for a message, splitting traffic in A/B mode."""
+    if config.REPLY_MODE == "ab":
+        return random.choice(("two_call", "combined"))
+    if config.REPLY_MODE == "combined":
+        return "combined"
+    return "two_call"
+
+async def background_init():
+    """
+    Load heavy state while the gateway connects instead of before login.
+    ChromaDB is only opened in this process when searches run on the thread
+    pool; otherwise the search workers (or the shared service) own it.
+    """
+    loop = asyncio.get_running_loop()
+
+    def load_local_state():
+        with startup_profile.init_step("user profiles"):
+            UserProfile()
+            config.get_user_ids()
+        if search_backend == "thread" and config.MEMORY_SNAPSHOT:
+            from memory_snapshot import get_snapshot
+            with startup_profile.init_step("memory snapshot"):
+                count = len(get_snapshot())
+            log(f"[STARTUP] Memory snapshot {config.MEMORY_SNAPSHOT} ready ({count} messages)", Fore.GREEN)
+        elif search_backend == "thread":
+            from chromadb_storage import get_collection_count
+            with startup_profile.init_step("vector store"):
+                count = get_collection_count()
+            log(f"[STARTUP] Vector store ready ({count} messages)", Fore.GREEN)
+        if config.RETRIEVAL_FUSION == "hybrid" and config.LEXICAL_INDEX_DB:
+            from lexical_index import get_lexical_index
+            with startup_profile.init_step("lexical index"):
+                count = get_lexical_index().count()
+            if count:
+                log(f"[STARTUP] Lexical index ready ({count} messages)", Fore.GREEN)
+            else:
+                log("[STARTUP] Lexical index is empty; run `python lexical_index.py build`", Fore.YELLOW)
+
+    try:
+        await loop.run_in_executor(None, load_local_state)
+        if search_backend == "worker":
+            with startup_profile.init_step("search workers"):
+                await search_worker.warm_up()
+            log("[STARTUP] Search workers ready", Fore.GREEN)
+    except Exception as e:
+        log(f"[STARTUP] Background init failed, will initialize on first use: {e}", Fore.YELLOW)
+
+    startup_profile.milestone("background init done")
+
+_background_tasks = set()
 
 # -------- Discord Events --------
-@bot.event
+async def setup_hook():
+    # Runs after login, before the gateway connects
+    task = asyncio.create_task(background_init())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
 async def on_ready():
+    startup_profile.milestone("gateway ready")
+    loop_lag_monitor.start()
+    if memory_writer:
+        memory_writer.start()
     if bot.user:
         log(f"[READY] Logged in as {bot.user} (ID: {bot.user.id})", Fore.GREEN)
+        if bot.shard_count:
+            log(f"[READY] Running shards {getattr(bot, 'shard_ids', None) or 'all'} of {bot.shard_count}", Fore.GREEN)
         try:
             await bot.load_extension("commands")
             synced = await bot.tree.sync()
@@ -29,20 +149,27 @@ async def on_ready():
         except Exception as e:
             log(f"Failed to sync commands: {e}", Fore.RED)
 
-@bot.event
 async def on_message(message):
     sleep_cog = bot.get_cog("SleepCog")
     if sleep_cog and sleep_cog.is_sleeping:
         return
 
+    handled = False
     try:
         if message.author == bot.user:
             return
 
         # Prevent processing the same message twice
-        if message.id in processed_messages:
+        if not processed_messages.mark(message.id):
             return
-        processed_messages.append(message.id)
+
+        # The reply SLO runs from here; each stage below gets a slice of it
+        deadline = ReplyDeadline(
+            config.REPLY_SLO_SECONDS,
+            {"retrieval": config.RETRIEVAL_BUDGET_SHARE, "decision": config.DECISION_BUDGET_SHARE},
+            min_generation=config.MIN_GENERATION_SECONDS,
+            stats=deadline_stats
+        )
 
         log(f"[INCOMING][#{message.channel}] {message.author}: {message.content}", Fore.CYAN)
 
@@ -50,6 +177,14 @@ async def on_message(message):
         if not message.guild:
             log(f"[DM] Ignoring DM from {message.author}", Fore.YELLOW)
             return
+        handled = True
+
+        # Spool for background ingestion into memory (flushed off the reply path)
+        if memory_writer:
+            try:
+                memory_writer.enqueue(message)
+            except Exception as e:
+                log(f"[INGEST] Failed to spool message: {e}", Fore.YELLOW)
 
         perms = message.channel.permissions_for(message.guild.me)
         if not (perms.send_messages and perms.read_messages):
@@ -65,25 +200,112 @@ async def on_message(message):
         is_direct_reply = message.reference and message.reference.resolved and message.reference.resolved.author == bot.user
         is_bot_mentioned = bot.user in message.mentions or "botlivia blevitron" in message.content.lower()
 
+        prompt = build_prompt(history, message.content)
+
+        # Retrieve memories once for both the decision and the reply
+        memories = await retrieve_within_budget(
+            lambda: retrieve_memories(message.content, history, message_namespace(message)),
+            message.channel.id,
+            deadline,
+            retrieval_cache
+        )
+
+        speculative_task = None
+        combined_response = None
+        reply_mode = None   # the A/B arm the message's stats are recorded under
+        two_calls = False
+        decision_started = time.perf_counter()
+        usage = {}
+
         # Auto-reply if directly mentioned or replied to
         if is_direct_reply or is_bot_mentioned:
             should_reply = True
         else:
-            # Use AI to decide if bot should reply
-            try:
-                should_reply = await should_bot_reply(message, history)
-            except Exception as e:
-                log(f"[ERROR] Failed to determine if bot should reply: {e}", Fore.RED)
-                should_reply = False
+            reply_mode = choose_reply_mode()
+            two_calls = reply_mode == "two_call"
+
+            # Decide and generate in one structured call, falling back to two
+            # calls. A fallback stays under "combined" with the failed call's
+            # usage, so the comparison charges combined mode for it.
+            if reply_mode == "combined":
+                with deadline.stage("generation") as budget:
+                    result = await decide_and_respond(
+                        message, history, prompt, user_id=message.author.id, usage=usage,
+                        memories=memories, deadline_seconds=budget
+                    )
+                if result is None:
+                    reply_mode_stats.record_fallback()
+                    two_calls = True
+                else:
+                    should_reply, combined_response = result
+
+            if two_calls:
+                # Start generating alongside the decision when a reply looks likely
+                if config.SPECULATIVE_GENERATION:
+                    likelihood = reply_likelihood(message, history, str(bot.user))
+                    if speculation_budget.should_speculate(message.channel.id, likelihood):
+                        log(f"[SPECULATIVE] Generating ahead of decision (likelihood {likelihood:.2f})", Fore.LIGHTBLACK_EX)
+                        speculative_task = asyncio.create_task(
+                            get_llm_response(
+                                prompt, history=history, user_id=message.author.id, usage=usage,
+                                memories=memories, deadline_seconds=deadline.budget("generation"),
+                                namespace=message_namespace(message)
+                            )
+                        )
+
+                # Use AI to decide if bot should reply
+                try:
+                    with deadline.stage("decision") as budget:
+                        should_reply = await should_bot_reply(
+                            message, history, usage=usage, memories=memories, deadline_seconds=budget
+                        )
+                except Exception as e:
+                    log(f"[ERROR] Failed to determine if bot should reply: {e}", Fore.RED)
+                    should_reply = False
+                if should_reply is None:
+                    # A late decision shouldn't drop the reply; generation
+                    # degrades to a short prompt if little time is left
+                    deadline_stats.record_degradation("decision_timeout")
+                    log("[DEADLINE] Decision ran out of time, replying anyway", Fore.YELLOW)
+                    should_reply = True
+
+        if speculative_task and not (should_reply and perms.send_messages):
+            speculative_task.cancel()
+            speculation_budget.record_wasted(message.channel.id)
+            log("[SPECULATIVE] Decision was NO, discarded speculative generation", Fore.LIGHTBLACK_EX)
+            speculative_task = None
+
+        if reply_mode and not should_reply:
+            reply_mode_stats.record(reply_mode, time.perf_counter() - decision_started, usage, False)
 
         if should_reply and perms.send_messages:
             async with message.channel.typing():
                 try:
-                    prompt = (
-                        f"Recent chat history:\n{history}\n\n"
-                        f"User: {message.content}"
-                    )
-                    response = await get_llm_response(prompt, history=history, user_id=message.author.id)
+                    if combined_response is not None:
+                        response = combined_response
+                    elif speculative_task:
+                        with deadline.stage("generation"):
+                            response = await speculative_task
+                        speculation_budget.record_used(message.channel.id)
+                    else:
+                        # Running late: a shorter prompt generates faster
+                        if deadline.enabled and deadline.remaining() < config.SHORT_PROMPT_SECONDS:
+                            deadline_stats.record_degradation("short_prompt")
+                            log(f"[DEADLINE] {deadline.remaining():.1f}s left, generating with a short prompt", Fore.YELLOW)
+                            history_for_reply = history[-config.SHORT_PROMPT_HISTORY:]
+                            prompt = build_prompt(history_for_reply, message.content)
+                            memories_for_reply = []
+                        else:
+                            history_for_reply = history
+                            memories_for_reply = memories
+                        with deadline.stage("generation") as budget:
+                            response = await get_llm_response(
+                                prompt, history=history_for_reply, user_id=message.author.id, usage=usage,
+                                memories=memories_for_reply, deadline_seconds=budget,
+                                namespace=message_namespace(message)
+                            )
+                    if reply_mode:
+                        reply_mode_stats.record(reply_mode, time.perf_counter() - decision_started, usage, True)
                     response = replace_with_mentions(response)
                     log(f"[OUTGOING][#{message.channel}] {bot.user}: {response}", Fore.GREEN)
                     await message.channel.send(response)
@@ -93,16 +315,65 @@ async def on_message(message):
                     conversation_history[message.channel.id] = history
                 except Exception as e:
                     log(f"[ERROR] Failed to generate or send response: {e}", Fore.RED)
+
+        if deadline.enabled:
+            deadline_stats.record_message(deadline.elapsed(), deadline.slo_seconds)
     except Exception as e:
         log(f"[ERROR] Unexpected error in on_message: {e}", Fore.RED)
+    finally:
+        # Guild messages that got this far count toward the message limit of
+        # a /profile session, if one is running
+        if handled and profiler.active_session is not None:
+            profiler.active_session.record_message()
+
+def init_bot():
+    """
+    Build the bot and the state that opens files (processed-message DB, ingest
+    spool) and register the event handlers. The entry point and load_test.py
+    call this; importing the module alone sets nothing up.
+
+    Returns:
+        The bot
+    """
+    global bot, processed_messages, memory_writer, loop_lag_monitor
+    bot = create_bot()
+    processed_messages = ProcessedMessageTracker(
+        retention_seconds=config.PROCESSED_MESSAGE_RETENTION_SECONDS,
+        db_path=config.PROCESSED_MESSAGES_DB or None
+    )
+    memory_writer = WriteBehindBuffer(
+        config.LIVE_INGEST_SPOOL,
+        max_batch_size=config.LIVE_INGEST_BATCH_SIZE,
+        flush_interval=config.LIVE_INGEST_FLUSH_SECONDS
+    ) if config.LIVE_INGEST else None
+    loop_lag_monitor = LoopLagMonitor(
+        report_interval=config.LOOP_LAG_REPORT_SECONDS,
+        label=f"(search backend: {search_backend})"
+    )
+    for handler in (setup_hook, on_ready, on_message):
+        bot.event(handler)
+    return bot
 
 # -------- Run Bot --------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Blevitron Discord bot")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="Print an import-time and init-time breakdown once the bot is ready")
+    parser.parse_args()
+
     if not config.DISCORD_BOT_TOKEN:
         log("[ERROR] DISCORD_BOT_TOKEN environment variable is not set!", Fore.RED)
         exit(1)
     if not config.LLM_API_KEY:
         log("[ERROR] LLM_API_KEY environment variable is not set!", Fore.RED)
         exit(1)
+    if config.LIVE_INGEST and config.SEARCH_WORKER_PROCESSES > 1 and not config.MEMORY_SERVICE_ADDRESS:
+        log("[WARNING] With several search workers, live-ingested memories reach only one worker until restart", Fore.YELLOW)
+    if config.LIVE_INGEST and config.MEMORY_SNAPSHOT:
+        log("[WARNING] Searches are served from MEMORY_SNAPSHOT; live-ingested memories go to ChromaDB "
+            "and aren't searched until a new snapshot is exported and loaded", Fore.YELLOW)
+    if config.SHARD_IDS and not config.SHARD_COUNT:
+        log("[ERROR] SHARD_IDS requires SHARD_COUNT to be set!", Fore.RED)
+        exit(1)
 
-    bot.run(config.DISCORD_BOT_TOKEN)
\ No newline at end of file
+    init_bot().run(config.DISCORD_BOT_TOKEN)
\ No newline at end of file
@@ -0,0 +1,511 @@
+"""
+Maintenance commands for the local ChromaDB store in chroma_data/.
+Reports collection stats, strips the message text that older versions also
+copied into metadata, rebuilds the HNSW index, vacuums the SQLite file and
+checks the store's integrity, and moves messages stored before memory
+namespaces were enabled into their guild's (or channel's) collection. Every
+command covers the shared collection and all namespace collections, and
+rebuild-index also their reduced (PCA-projected) collections. Stop
+the bot before running anything that writes to the store.
+
+Usage:
+    python chroma_maintenance.py stats
+    python chroma_maintenance.py strip-metadata
+    python chroma_maintenance.py rebuild-index
+    python chroma_maintenance.py vacuum [--dry-run]
+    python chroma_maintenance.py verify [--sample 50]
+    python chroma_maintenance.py split-namespaces
+    python chroma_maintenance.py compact      # all of the above, in order
+"""
+
+import argparse
+import hashlib
+import math
+import os
+import random
+import re
+import shutil
+import sqlite3
+import numpy as np
+
+import chromadb_storage
+from chromadb_storage import (
+    BACKUP_SUFFIX, CHROMA_DATA_DIR, COLLECTION_NAME, REBUILD_SUFFIX, collection_name, get_chromadb_client,
+    get_or_create_collection, list_namespaces, namespace_for, namespace_stats
+)
+
+SQLITE_FILE = os.path.join(CHROMA_DATA_DIR, "chroma.sqlite3")
+SEGMENT_DIR_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+# Key older versions of add_messages wrote alongside the identical document
+REDUNDANT_METADATA_KEY = "text"
+
+
+def directory_size(path):
+    """Total size in bytes of all files under a directory."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def all_collections():
+    """
+    Get the shared collection and every namespace collection.
+
+    Returns:
+        List of (namespace, collection) tuples, the shared collection (None) first
+    """
+    return [(namespace, get_or_create_collection(namespace)) for namespace in [None] + list_namespaces()]
+
+
+def iter_pages(collection, include, page_size=1000):
+    """
+    Page through every record in a collection.
+
+    Args:
+        collection: ChromaDB collection
+        include: Fields to fetch (e.g. ["documents", "metadatas"])
+        page_size: Records fetched per request
+
+    Yields:
+        ChromaDB get() results, one page at a time
+    """
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=include)
+        if not page['ids']:
+            return
+        yield page
+        offset += len(page['ids'])
+
+
+def collection_stats(page_size=1000):
+    """
+    Gather size and redundancy statistics across all collections.
+
+    Returns:
+        Dictionary with count, dimension, disk and vector sizes, duplicate
+        document ratio and the number of records with redundant metadata
+    """
+    count = 0
+    dimension = None
+    document_hashes = set()
+    redundant_metadata = 0
+
+    for _, collection in all_collections():
+        count += collection.count()
+        for page in iter_pages(collection, ["documents", "metadatas", "embeddings"], page_size):
+            if dimension is None and len(page['embeddings']):
+                dimension = len(page['embeddings'][0])
+            for document, metadata in zip(page['documents'], page['metadatas']):
+                document_hashes.add(hashlib.sha256((document or "").encode('utf-8')).hexdigest())
+                if metadata and REDUNDANT_METADATA_KEY in metadata:
+                    redundant_metadata += 1
+
+    disk_bytes = directory_size(CHROMA_DATA_DIR)
+    return {
+        "count": count,
+        "dimension": dimension or 0,
+        "disk_bytes": disk_bytes,
+        "sqlite_bytes": os.path.getsize(SQLITE_FILE) if os.path.exists(SQLITE_FILE) else 0,
+        "bytes_per_vector": disk_bytes / count if count else 0.0,
+        "raw_vector_bytes": count * (dimension or 0) * 4,
+        "duplicate_ratio": 1 - len(document_hashes) / count if count else 0.0,
+        "redundant_metadata": redundant_metadata,
+        "orphan_segments": len(find_orphan_segments()),
+        "namespaces": namespace_stats(),
+    }
+
+
+def strip_redundant_metadata(page_size=1000):
+    """
+    Remove the metadata copy of each message's text in every collection; the
+    document keeps it.
+
+    Returns:
+        int: Number of records updated
+    """
+    updated = 0
+    for _, collection in all_collections():
+        for page in iter_pages(collection, ["metadatas"], page_size):
+            ids = [
+                msg_id for msg_id, metadata in zip(page['ids'], page['metadatas'])
+                if metadata and REDUNDANT_METADATA_KEY in metadata
+            ]
+            if ids:
+                # Setting a key to None deletes it on update
+                collection.update(ids=ids, metadatas=[{REDUNDANT_METADATA_KEY: None} for _ in ids])
+                updated += len(ids)
+    return updated
+
+
+def rebuild_index(page_size=1000, metadata=None, namespace=None):
+    """
+    Rebuild the HNSW index by copying every record into a fresh collection.
+    Deleted and updated vectors leave tombstones in the old index; the copy
+    starts without them. The new collection takes over the old one's name and
+    keeps its settings (including cosine distance) unless metadata is given.
+    The old collection is renamed to a backup before the copy takes its name
+    and dropped afterwards, so get_chromadb_client can finish a swap that was
+    interrupted at any point.
+
+    Args:
+        page_size: Records copied per request
+        metadata: Collection metadata for the new index (e.g. different HNSW
+            parameters); defaults to the current collection's metadata
+        namespace: Namespace whose collection to rebuild (None for the shared collection)
+
+    Returns:
+        int: Number of records copied
+    """
+    if metadata and namespace:
+        metadata = {**metadata, "namespace": namespace}
+    copied = _rebuild_collection(get_or_create_collection(namespace), page_size, metadata)
+    if namespace:
+        chromadb_storage._namespace_collections.pop(namespace, None)
+    else:
+        chromadb_storage._collection = None
+    return copied
+
+
+def rebuild_reduced_index(projection_version, page_size=1000, metadata=None, namespace=None):
+    """
+    Rebuild the HNSW index of a reduced collection (see embedding_projection.py)
+    the same way as rebuild_index.
+
+    Args:
+        projection_version: Projection version of the reduced collection
+        page_size: Records copied per request
+        metadata: Collection metadata for the new index; the projection
+            version and namespace are kept
+        namespace: Namespace the reduced collection mirrors (None for the shared collection)
+
+    Returns:
+        int: Number of records copied
+    """
+    if metadata:
+        metadata = {**metadata, "projection_version": projection_version}
+        if namespace:
+            metadata["namespace"] = namespace
+    copied = _rebuild_collection(
+        chromadb_storage.get_reduced_collection(projection_version, namespace), page_size, metadata
+    )
+    chromadb_storage._reduced_collections.pop((projection_version, namespace), None)
+    return copied
+
+
+def _rebuild_collection(collection, page_size, metadata):
+    """Copy a collection into a fresh one and swap it in under the same name (see rebuild_index)."""
+    client = get_chromadb_client()
+    name = collection.name
+    rebuild_name, backup_name = f"{name}{REBUILD_SUFFIX}", f"{name}{BACKUP_SUFFIX}"
+
+    # A rebuild interrupted while copying leaves a partial copy behind
+    if rebuild_name in [c.name if hasattr(c, 'name') else c for c in client.list_collections()]:
+        client.delete_collection(name=rebuild_name)
+
+    rebuilt = client.create_collection(name=rebuild_name, metadata=metadata or collection.metadata)
+    copied = 0
+    for page in iter_pages(collection, ["embeddings", "documents", "metadatas"], page_size):
+        metadatas = [metadata or None for metadata in page['metadatas']]
+        rebuilt.add(
+            ids=page['ids'],
+            embeddings=page['embeddings'],
+            documents=page['documents'],
+            metadatas=metadatas if any(metadatas) else None
+        )
+        copied += len(page['ids'])
+
+    if rebuilt.count() != collection.count():
+        client.delete_collection(name=rebuild_name)
+        raise RuntimeError(f"Rebuild of {name} copied {rebuilt.count()} of {collection.count()} records; original kept")
+
+    collection.modify(name=backup_name)
+    rebuilt.modify(name=name)
+    client.delete_collection(name=backup_name)
+    return copied
+
+
+def reduced_collections():
+    """
+    Find the reduced collections embedding_projection.py keeps alongside the
+    shared and namespace collections.
+
+    Returns:
+        List of (projection_version, namespace) tuples
+    """
+    found = []
+    for collection in get_chromadb_client().list_collections():
+        metadata = collection.metadata or {}
+        if metadata.get("projection_version") and not collection.name.endswith((REBUILD_SUFFIX, BACKUP_SUFFIX)):
+            found.append((metadata["projection_version"], metadata.get("namespace")))
+    return found
+
+
+def rebuild_all_indexes(page_size=1000, metadata=None):
+    """
+    Rebuild the HNSW index of the shared collection, every namespace
+    collection and their reduced collections (see rebuild_index).
+
+    Returns:
+        Dictionary mapping collection name to records copied
+    """
+    copied = {
+        collection_name(namespace): rebuild_index(page_size, metadata, namespace)
+        for namespace in [None] + list_namespaces()
+    }
+    for projection_version, namespace in reduced_collections():
+        copied[f"{collection_name(namespace)}_{projection_version}"] = rebuild_reduced_index(
+            projection_version, page_size, metadata, namespace
+        )
+    return copied
+
+
+def split_namespaces(page_size=1000):
+    """
+    Move shared-collection records whose metadata names a guild into the
+    collection of their namespace (per MEMORY_NAMESPACES). Records without a
+    guild (DMs, older exports) stay in the shared collection.
+
+    Returns:
+        Dictionary mapping namespace to the number of records moved
+    """
+    from lexical_index import get_lexical_index
+    from near_duplicates import get_near_duplicate_index
+
+    shared = get_or_create_collection()
+    moves = {}
+    # Deleting while paging would shift the offsets, so delete afterwards
+    for page in iter_pages(shared, ["embeddings", "documents", "metadatas"], page_size):
+        groups = {}
+        for i, metadata in enumerate(page['metadatas']):
+            namespace = namespace_for(metadata.get("guild_id"), metadata.get("channel_id")) if metadata else None
+            if namespace:
+                groups.setdefault(namespace, []).append(i)
+        for namespace, indices in groups.items():
+            get_or_create_collection(namespace).upsert(
+                ids=[page['ids'][i] for i in indices],
+                embeddings=np.asarray(page['embeddings'])[indices],
+                documents=[page['documents'][i] for i in indices],
+                metadatas=[page['metadatas'][i] for i in indices]
+            )
+            moves.setdefault(namespace, []).extend(page['ids'][i] for i in indices)
+
+    # The shared collection's reduced copies (see embedding_projection.py) lose the moved records too
+    client = get_chromadb_client()
+    reduced = [
+        client.get_collection(name=collection.name) for collection in client.list_collections()
+        if collection.name.startswith(f"{COLLECTION_NAME}_") and (collection.metadata or {}).get("projection_version")
+        and not (collection.metadata or {}).get("namespace")
+    ]
+
+    index = get_lexical_index()
+    near_duplicates = get_near_duplicate_index()
+    for namespace, ids in moves.items():
+        for start in range(0, len(ids), page_size):
+            for collection in [shared] + reduced:
+                collection.delete(ids=ids[start:start + page_size])
+        if index is not None:
+            index.set_namespace(ids, namespace)
+        if near_duplicates is not None:
+            near_duplicates.set_namespace(ids, namespace)
+    return {namespace: len(ids) for namespace, ids in moves.items()}
+
+
+def find_orphan_segments():
+    """
+    Find segment directories in chroma_data/ that no collection references.
+    Deleting or resetting a collection leaves its HNSW files on disk.
+
+    Returns:
+        List of directory paths
+    """
+    if not os.path.exists(SQLITE_FILE):
+        return []
+    with sqlite3.connect(SQLITE_FILE) as db:
+        live_segments = {row[0] for row in db.execute("SELECT id FROM segments")}
+    return sorted(
+        os.path.join(CHROMA_DATA_DIR, name)
+        for name in os.listdir(CHROMA_DATA_DIR)
+        if SEGMENT_DIR_PATTERN.match(name) and name not in live_segments
+        and os.path.isdir(os.path.join(CHROMA_DATA_DIR, name))
+    )
+
+
+def vacuum_store(dry_run=False):
+    """
+    Remove orphaned segment directories and compact the SQLite file.
+
+    Args:
+        dry_run: Only report what would be removed
+
+    Returns:
+        int: Bytes freed (estimated when dry_run is set)
+    """
+    before = directory_size(CHROMA_DATA_DIR)
+    orphans = find_orphan_segments()
+    for path in orphans:
+        print(f"   {'Would remove' if dry_run else 'Removing'} orphaned segment {os.path.basename(path)}")
+        if not dry_run:
+            shutil.rmtree(path)
+
+    if dry_run:
+        return sum(directory_size(path) for path in orphans)
+
+    db = sqlite3.connect(SQLITE_FILE)
+    try:
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    return before - directory_size(CHROMA_DATA_DIR)
+
+
+def verify_store(sample=50, page_size=1000):
+    """
+    Check the store for corruption.
+
+    Runs SQLite's integrity check, then for every collection confirms each
+    record has a finite embedding of the same dimension and a document, and
+    checks that a sample of stored vectors find themselves as their own
+    nearest neighbour. The sample is split across collections by size.
+
+    Returns:
+        List of problem descriptions (empty if the store is healthy)
+    """
+    problems = []
+
+    with sqlite3.connect(SQLITE_FILE) as db:
+        result = db.execute("PRAGMA integrity_check").fetchone()[0]
+    if result != "ok":
+        problems.append(f"SQLite integrity check failed: {result}")
+
+    collections = all_collections()
+    total = sum(collection.count() for _, collection in collections)
+    for namespace, collection in collections:
+        share = math.ceil(sample * collection.count() / total) if total else 0
+        prefix = f"{namespace}: " if namespace else ""
+        problems.extend(prefix + problem for problem in verify_collection(collection, share, page_size))
+    return problems
+
+
+def verify_collection(collection, sample=50, page_size=1000):
+    """
+    Check one collection's records and index (see verify_store).
+
+    Returns:
+        List of problem descriptions
+    """
+    problems = []
+    count = collection.count()
+    seen = 0
+    dimension = None
+    candidates = []
+
+    for page in iter_pages(collection, ["embeddings", "documents"], page_size):
+        embeddings = np.asarray(page['embeddings'], dtype=np.float32)
+        if dimension is None:
+            dimension = embeddings.shape[1]
+        if embeddings.ndim != 2 or embeddings.shape[1] != dimension:
+            problems.append(f"Embedding dimension mismatch near offset {seen}")
+        elif not np.isfinite(embeddings).all():
+            problems.append(f"Non-finite embedding values near offset {seen}")
+        problems.extend(
+            f"Record {msg_id} has no document"
+            for msg_id, document in zip(page['ids'], page['documents']) if not document
+        )
+        candidates.extend(zip(page['ids'], embeddings))
+        seen += len(page['ids'])
+
+    if seen != count:
+        problems.append(f"count() reports {count} records but {seen} were read")
+
+    # Several messages (e.g. single emoji) can share an identical embedding and
+    # tie with each other, so a sampled vector passes if it comes back itself
+    # or if the nearest hit is an exact match
+    for msg_id, embedding in random.sample(candidates, min(sample, len(candidates))):
+        results = collection.query(query_embeddings=[embedding.tolist()], n_results=5, include=["distances"])
+        ids, distances = results['ids'][0], results['distances'][0]
+        if msg_id not in ids and not (distances and distances[0] <= 1e-4):
+            problems.append(f"Record {msg_id} is not its own nearest neighbour (index may be stale)")
+
+    return problems
+
+
+def print_stats(stats):
+    print(f"   Records:              {stats['count']}")
+    print(f"   Dimension:            {stats['dimension']}")
+    print(f"   On disk:              {stats['disk_bytes'] / 1024 / 1024:.1f} MB "
+          f"(SQLite {stats['sqlite_bytes'] / 1024 / 1024:.1f} MB)")
+    print(f"   Bytes per vector:     {stats['bytes_per_vector']:.0f} "
+          f"(raw float32 vector: {stats['dimension'] * 4})")
+    print(f"   Duplicate documents:  {stats['duplicate_ratio']:.1%}")
+    print(f"   Redundant text meta:  {stats['redundant_metadata']}")
+    print(f"   Orphaned segments:    {stats['orphan_segments']}")
+    namespaces = {name: count for name, count in stats['namespaces'].items() if name}
+    if namespaces:
+        print(f"   Namespaces:           {len(namespaces)} "
+              f"({sum(namespaces.values())} records; shared collection {stats['namespaces'][None]})")
+        for name, count in sorted(namespaces.items(), key=lambda item: -item[1])[:10]:
+            print(f"      {name}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compact the local ChromaDB store")
+    parser.add_argument('command', choices=['stats', 'strip-metadata', 'rebuild-index', 'vacuum', 'verify',
+                                            'split-namespaces', 'compact'])
+    parser.add_argument('--page-size', type=int, default=1000, help="Records read per request")
+    parser.add_argument('--sample', type=int, default=50, help="Vectors self-queried by verify (across all collections)")
+    parser.add_argument('--dry-run', action='store_true', help="vacuum: only report orphaned segments")
+    args = parser.parse_args()
+
+    if not os.path.exists(SQLITE_FILE):
+        print(f"ERROR: no ChromaDB store found at {CHROMA_DATA_DIR}")
+        return 1
+
+    if args.command in ('stats', 'compact'):
+        print("Collection stats:")
+        print_stats(collection_stats(args.page_size))
+
+    if args.command in ('strip-metadata', 'compact'):
+        print("\nStripping redundant metadata...")
+        print(f"   Updated {strip_redundant_metadata(args.page_size)} records")
+
+    if args.command in ('rebuild-index', 'compact'):
+        print("\nRebuilding HNSW indexes...")
+        copied = rebuild_all_indexes(args.page_size)
+        print(f"   Copied {sum(copied.values())} records into {len(copied)} fresh indexes")
+
+    if args.command == 'split-namespaces':
+        print("Moving shared-collection records into their namespaces...")
+        moved = split_namespaces(args.page_size)
+        for namespace, count in sorted(moved.items()):
+            print(f"   {namespace}: {count}")
+        print(f"   Moved {sum(moved.values())} records into {len(moved)} namespaces")
+        if moved:
+            print("   Run 'python embedding_projection.py build' to fill the namespaces' reduced collections, if enabled")
+
+    if args.command in ('vacuum', 'compact'):
+        print("\nVacuuming store...")
+        freed = vacuum_store(dry_run=args.dry_run)
+        print(f"   {'Would free' if args.dry_run else 'Freed'} {freed / 1024 / 1024:.1f} MB")
+
+    if args.command in ('verify', 'compact'):
+        print("\nVerifying store...")
+        problems = verify_store(args.sample, args.page_size)
+        for problem in problems:
+            print(f"   ✗ {problem}")
+        if problems:
+            return 1
+        print("   ✓ No problems found")
+
+    if args.command == 'compact':
+        print("\nAfter compaction:")
+        print_stats(collection_stats(args.page_size))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
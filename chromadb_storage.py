@@ -1,15 +1,36 @@
 """
 ChromaDB storage module for local vector database.
 Stores message embeddings in the project directory instead of PostgreSQL.
+Messages from a known guild can be kept in per-guild or per-channel
+namespace collections (see MEMORY_NAMESPACES) next to the shared collection.
 """
 
-import chromadb
-from chromadb.config import Settings
 import os
+import time
+
+from config import (
+    EMBEDDING_PROJECTION, HNSW_CONSTRUCTION_EF, HNSW_M, HNSW_SEARCH_EF, LEXICAL_INDEX_DB, MEMORY_NAMESPACES,
+    MEMORY_SNAPSHOT, NEAR_DUP_INDEX_DB
+)
 
 CHROMA_DATA_DIR = "./chroma_data"
 COLLECTION_NAME = "discord_messages"
 
+# Namespace collections are named f"{NAMESPACE_PREFIX}{namespace}"
+NAMESPACE_PREFIX = f"{COLLECTION_NAME}_ns_"
+
+# Suffixes of the collections an index rebuild (chroma_maintenance.py) copies
+# into and moves the old collection to while it swaps them
+REBUILD_SUFFIX = "_rebuild"
+BACKUP_SUFFIX = "_backup"
+
+# chromadb is a heavy import, so it is loaded on first use and the client and
+# collection handles are cached for the lifetime of the process
+_client = None
+_collection = None
+_namespace_collections = {}
+_reduced_collections = {}
+
 
 def get_chromadb_client():
     """
@@ -18,47 +39,250 @@ def get_chromadb_client():
     Returns:
         chromadb.Client: ChromaDB client instance
     """
-    client = chromadb.PersistentClient(
-        path=CHROMA_DATA_DIR,
-        settings=Settings(
-            anonymized_telemetry=False,
-            allow_reset=True
+    global _client
+    if _client is None:
+        import chromadb
+        from chromadb.config import Settings
+        
+        _client = chromadb.PersistentClient(
+            path=CHROMA_DATA_DIR,
+            settings=Settings(
+                anonymized_telemetry=False,
+                allow_reset=True
+            )
         )
-    )
-    return client
+        recover_interrupted_rebuilds(_client)
+    return _client
 
 
-def get_or_create_collection():
+def recover_interrupted_rebuilds(client):
+    """
+    Finish collection swaps that an index rebuild started but didn't complete,
+    before anything opens (or creates) a collection under the swapped name.
+    
+    A rebuild only swaps once the copy holds every record: it renames the old
+    collection to f"{name}{BACKUP_SUFFIX}", renames the copy to name and then
+    drops the backup. Older versions deleted the old collection before the
+    rename, leaving only the copy if interrupted; an empty collection created
+    under the name since then is replaced by the copy.
+    
+    Returns:
+        List of collection names that were recovered
+    """
+    names = {collection.name if hasattr(collection, 'name') else collection for collection in client.list_collections()}
+    bases = {
+        name[:-len(suffix)] for name in names for suffix in (REBUILD_SUFFIX, BACKUP_SUFFIX) if name.endswith(suffix)
+    }
+    recovered = []
+    for name in sorted(bases):
+        rebuild_name, backup_name = f"{name}{REBUILD_SUFFIX}", f"{name}{BACKUP_SUFFIX}"
+        try:
+            count = client.get_collection(name=name).count() if name in names else 0
+            if rebuild_name in names and count == 0:
+                # The copy holds the records: finish the rename
+                if name in names:
+                    client.delete_collection(name=name)
+                client.get_collection(name=rebuild_name).modify(name=name)
+                if backup_name in names:
+                    client.delete_collection(name=backup_name)
+            elif backup_name in names and name not in names:
+                client.get_collection(name=backup_name).modify(name=name)
+            elif backup_name in names and rebuild_name not in names:
+                # The swap finished; only the old collection was left to drop
+                client.delete_collection(name=backup_name)
+            else:
+                # A partial copy next to the intact collection; the next rebuild replaces it
+                continue
+            recovered.append(name)
+        except Exception as e:
+            print(f"Error recovering interrupted rebuild of {name}: {e}")
+    for name in recovered:
+        print(f"Recovered {name} from an interrupted index rebuild")
+    return recovered
+
+
+def collection_metadata(hnsw_m=HNSW_M, construction_ef=HNSW_CONSTRUCTION_EF, search_ef=HNSW_SEARCH_EF):
+    """
+    Build the collection metadata: cosine distance plus any HNSW parameters
+    that are set. These only take effect when a collection is created.
+    
+    Returns:
+        dict: ChromaDB collection metadata
+    """
+    metadata = {"hnsw:space": "cosine"}  # Use cosine similarity
+    if hnsw_m:
+        metadata["hnsw:M"] = hnsw_m
+    if construction_ef:
+        metadata["hnsw:construction_ef"] = construction_ef
+    if search_ef:
+        metadata["hnsw:search_ef"] = search_ef
+    return metadata
+
+
+def namespace_for(guild_id=None, channel_id=None, mode=MEMORY_NAMESPACES):
+    """
+    Get the namespace a message is stored and searched in.
+    
+    Args:
+        guild_id: Discord guild ID, or None for DMs and exports without one
+            (DiscordChatExporter writes guild ID 0 for DMs, which counts as none)
+        channel_id: Discord channel ID (used in "channel" mode)
+        mode: "guild", "channel" or "off"
+        
+    Returns:
+        str such as "g123" or "g123-c456", or None for the shared collection
+    """
+    if mode not in ("guild", "channel") or not guild_id or str(guild_id) == "0":
+        return None
+    if mode == "channel" and channel_id:
+        return f"g{guild_id}-c{channel_id}"
+    return f"g{guild_id}"
+
+
+def record_namespace(metadata):
+    """Namespace a record belongs to, from the guild_id and channel_id in its metadata."""
+    if not metadata:
+        return None
+    return namespace_for(metadata.get("guild_id"), metadata.get("channel_id"))
+
+
+def collection_name(namespace=None):
+    """Name of the collection holding a namespace (None is the shared collection)."""
+    return f"{NAMESPACE_PREFIX}{namespace}" if namespace else COLLECTION_NAME
+
+
+def get_or_create_collection(namespace=None):
     """
     Get or create the collection for storing message embeddings.
     Uses cosine similarity for vector search.
     
+    Args:
+        namespace: Namespace to get the collection of (None for the shared collection)
+        
     Returns:
         chromadb.Collection: ChromaDB collection instance
     """
-    client = get_chromadb_client()
-    collection = client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        metadata={"hnsw:space": "cosine"}  # Use cosine similarity
-    )
-    return collection
+    global _collection
+    if namespace:
+        if namespace not in _namespace_collections:
+            metadata = collection_metadata()
+            metadata["namespace"] = namespace
+            _namespace_collections[namespace] = get_chromadb_client().get_or_create_collection(
+                name=collection_name(namespace),
+                metadata=metadata
+            )
+        return _namespace_collections[namespace]
+
+    if _collection is None:
+        client = get_chromadb_client()
+        _collection = client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            metadata=collection_metadata()
+        )
+    return _collection
 
 
-def add_messages(messages, embeddings, message_ids=None, authors=None):
+def get_existing_collection(namespace=None):
+    """
+    Get a collection without creating it, so searches in namespaces that
+    have no messages yet don't leave empty collections behind.
+    
+    Returns:
+        chromadb.Collection, or None if the namespace has no collection
+    """
+    if not namespace:
+        return get_or_create_collection()
+    if namespace not in _namespace_collections:
+        try:
+            _namespace_collections[namespace] = get_chromadb_client().get_collection(name=collection_name(namespace))
+        except Exception:
+            # Not cached: another process may create it later
+            return None
+    return _namespace_collections[namespace]
+
+
+def list_namespaces():
+    """
+    Get every namespace that has a collection.
+    
+    Returns:
+        Sorted list of namespace strings
+    """
+    namespaces = []
+    for collection in get_chromadb_client().list_collections():
+        name = collection.name if hasattr(collection, 'name') else collection
+        rest = name[len(NAMESPACE_PREFIX):] if name.startswith(NAMESPACE_PREFIX) else ""
+        # Reduced collections of a namespace carry a "_<projection>" suffix
+        if rest and "_" not in rest:
+            namespaces.append(rest)
+    return sorted(namespaces)
+
+
+def namespace_stats():
+    """
+    Count the messages in the shared collection and in each namespace.
+    
+    Returns:
+        Dictionary mapping namespace (None for the shared collection) to message count
+    """
+    stats = {None: get_or_create_collection().count()}
+    for namespace in list_namespaces():
+        collection = get_existing_collection(namespace)
+        stats[namespace] = collection.count() if collection is not None else 0
+    return stats
+
+
+def get_reduced_collection(projection_version, namespace=None):
+    """
+    Get or create the parallel collection holding vectors reduced by a
+    projection (see embedding_projection.py). Each projection version has its
+    own collection, so vectors from different projections never mix.
+    
+    Args:
+        projection_version: Version string of the projection
+        namespace: Namespace the collection mirrors (None for the shared collection)
+        
+    Returns:
+        chromadb.Collection: ChromaDB collection instance
+    """
+    key = (projection_version, namespace)
+    if key not in _reduced_collections:
+        client = get_chromadb_client()
+        metadata = collection_metadata()
+        metadata["projection_version"] = projection_version
+        if namespace:
+            metadata["namespace"] = namespace
+        _reduced_collections[key] = client.get_or_create_collection(
+            name=f"{collection_name(namespace)}_{projection_version}",
+            metadata=metadata
+        )
+    return _reduced_collections[key]
+
+
+def add_messages(messages, embeddings, message_ids=None, authors=None, metadatas=None):
     """
     Add messages and their embeddings to ChromaDB with proper deduplication.
-    Filters out duplicates and only adds new messages.
+    Filters out duplicates and only adds new messages. Each message goes to
+    the collection of its namespace, worked out from the guild_id and
+    channel_id in its metadata.
     
     Args:
         messages: List of message text content
         embeddings: List of embedding vectors (must match length of messages)
         message_ids: Optional list of IDs (will auto-generate if not provided)
         authors: Optional list of author names (must match length of messages if provided)
+        metadatas: Optional list of extra metadata dicts (e.g. timestamp, channel);
+            None values are dropped since ChromaDB can't store them
         
     Returns:
         int: Number of messages added (excludes duplicates)
+        
+    Raises:
+        Exception: If ChromaDB fails to store a batch. Callers keep the batch
+            to retry it; namespaces stored before the failure are skipped as
+            duplicates on the retry.
     """
-    if not messages or not embeddings:
+    if not messages or len(embeddings) == 0:
         return 0
     
     if len(messages) != len(embeddings):
@@ -67,7 +291,8 @@ def add_messages(messages, embeddings, message_ids=None, authors=None):
     if authors and len(authors) != len(messages):
         raise ValueError("Authors must have same length as messages")
     
-    collection = get_or_create_collection()
+    if metadatas and len(metadatas) != len(messages):
+        raise ValueError("Metadatas must have same length as messages")
     
     # Generate IDs if not provided
     if message_ids is None:
@@ -77,16 +302,36 @@ def add_messages(messages, embeddings, message_ids=None, authors=None):
             for msg in messages
         ]
     
-    # First pass: deduplicate within batch and build mapping
+    # First pass: deduplicate within batch and group by namespace
     id_to_first_occurrence = {}
     for i, msg_id in enumerate(message_ids):
         if msg_id not in id_to_first_occurrence:
             id_to_first_occurrence[msg_id] = i
     
+    namespace_indices = {}
+    for index in id_to_first_occurrence.values():
+        namespace = record_namespace(metadatas[index] if metadatas else None)
+        namespace_indices.setdefault(namespace, []).append(index)
+    
+    return sum(
+        _add_to_namespace(namespace, indices, messages, embeddings, message_ids, authors, metadatas)
+        for namespace, indices in namespace_indices.items()
+    )
+
+
+def _add_to_namespace(namespace, indices, messages, embeddings, message_ids, authors, metadatas):
+    """
+    Add the given records (indices into the add_messages arguments) to one
+    namespace's collection, skipping IDs it already holds.
+    
+    Returns:
+        int: Number of messages added
+    """
+    collection = get_or_create_collection(namespace)
+    
     # Query ChromaDB with deduplicated IDs to check which exist
-    unique_ids = list(id_to_first_occurrence.keys())
     try:
-        existing_data = collection.get(ids=unique_ids, include=[])
+        existing_data = collection.get(ids=[message_ids[index] for index in indices], include=[])
         existing_ids = set(existing_data['ids']) if existing_data and 'ids' in existing_data else set()
     except Exception:
         existing_ids = set()
@@ -96,89 +341,355 @@ def add_messages(messages, embeddings, message_ids=None, authors=None):
     new_embeddings = []
     new_ids = []
     new_authors = []
+    new_extra_metadatas = []
     
-    for msg_id, index in id_to_first_occurrence.items():
+    for index in indices:
         # Only add if not already in database
-        if msg_id not in existing_ids:
+        if message_ids[index] not in existing_ids:
             new_messages.append(messages[index])
             new_embeddings.append(embeddings[index])
-            new_ids.append(msg_id)
+            new_ids.append(message_ids[index])
             if authors:
                 new_authors.append(authors[index])
+            if metadatas:
+                new_extra_metadatas.append(metadatas[index])
     
     # If no new messages, return early
     if not new_messages:
         return 0
     
-    # ChromaDB expects embeddings as list of lists
-    if new_embeddings and isinstance(new_embeddings[0], list):
+    # ChromaDB accepts lists or NumPy arrays; arrays (e.g. rows of a matrix
+    # built during migration) are passed through without converting to lists
+    if new_embeddings and (isinstance(new_embeddings[0], list) or hasattr(new_embeddings[0], 'dtype')):
         embedding_list = new_embeddings
     else:
-        embedding_list = [emb.tolist() if hasattr(emb, 'tolist') else list(emb) for emb in new_embeddings]
+        embedding_list = [list(emb) for emb in new_embeddings]
     
     try:
-        # Build metadata with author information if available
+        # Build metadata with author information if available. The message
+        # text is only stored as the document, not duplicated into metadata.
         if new_authors:
-            metadatas = [{"text": msg, "author": author} for msg, author in zip(new_messages, new_authors)]
+            new_metadatas = [{"author": author} for author in new_authors]
         else:
-            metadatas = [{"text": msg} for msg in new_messages]
-        
+            new_metadatas = [{} for _ in new_messages]
+
+        for metadata, extra in zip(new_metadatas, new_extra_metadatas):
+            metadata.update({key: value for key, value in (extra or {}).items() if value is not None})
+
+        # ChromaDB rejects empty metadata dicts, but accepts None per record
+        new_metadatas = [metadata or None for metadata in new_metadatas]
+
         # Add only new messages to collection
         collection.add(
             ids=new_ids,
             embeddings=embedding_list,
             documents=new_messages,
-            metadatas=metadatas
+            metadatas=new_metadatas if any(new_metadatas) else None
         )
-        return len(new_messages)
     except Exception as e:
         print(f"Error adding messages to ChromaDB: {e}")
-        return 0
+        raise
+    
+    # Keep the reduced collection in step, projected with the same version
+    # that queries use. The full vectors are already stored (a retry would
+    # skip them), so a failure here only leaves the reduced collection short
+    # until `python embedding_projection.py build` tops it up.
+    if EMBEDDING_PROJECTION:
+        try:
+            from embedding_projection import get_projection
+            projection = get_projection()
+            get_reduced_collection(projection.version, namespace).add(
+                ids=new_ids,
+                embeddings=projection.project(embedding_list),
+                documents=new_messages,
+                metadatas=new_metadatas if any(new_metadatas) else None
+            )
+        except Exception as e:
+            print(f"Error adding messages to the reduced collection: {e}")
+    
+    # Index the same documents for lexical search. The vectors are already
+    # stored, so a failure here only costs lexical recall until the next build.
+    if LEXICAL_INDEX_DB:
+        try:
+            from lexical_index import get_lexical_index
+            get_lexical_index().add(new_ids, new_messages, new_authors or None, namespace)
+        except Exception as e:
+            print(f"Error adding messages to the lexical index: {e}")
+    
+    # Record signatures so later near-duplicates of these messages are skipped before embedding
+    if NEAR_DUP_INDEX_DB:
+        try:
+            from near_duplicates import get_near_duplicate_index
+            get_near_duplicate_index().add(new_ids, new_messages, namespace)
+        except Exception as e:
+            print(f"Error adding messages to the near-duplicate index: {e}")
+    
+    return len(new_messages)
 
 
-def search_similar_messages(query_embedding, limit=8):
+def _to_list(embedding):
+    """Convert an embedding vector to a plain list of floats."""
+    if hasattr(embedding, 'tolist'):
+        return embedding.tolist()
+    if not isinstance(embedding, list):
+        return list(embedding)
+    return embedding
+
+
+def get_existing_ids(message_ids, namespaces=None):
     """
-    Search for messages similar to the query embedding.
+    Find which of the given IDs are already stored.
+    Lets ingestion skip known messages before paying for their embeddings.
     
     Args:
-        query_embedding: The embedding vector to search for
-        limit: Maximum number of results to return
+        message_ids: List of message IDs
+        namespaces: Optional list with the namespace of each ID (default: all
+            in the shared collection)
         
     Returns:
-        List of tuples (message_content, similarity_score, author)
+        set: The IDs that already exist in their collection, or in the shared
+            collection (where guild messages stored before split-namespaces are)
     """
-    collection = get_or_create_collection()
+    if not message_ids:
+        return set()
     
-    # Convert embedding to list if needed
-    if hasattr(query_embedding, 'tolist'):
-        query_embedding = query_embedding.tolist()
-    elif not isinstance(query_embedding, list):
-        query_embedding = list(query_embedding)
+    ids_by_namespace = {}
+    for msg_id, namespace in zip(message_ids, namespaces or [None] * len(message_ids)):
+        ids_by_namespace.setdefault(namespace, []).append(msg_id)
     
+    existing_ids = set()
+    for namespace, ids in ids_by_namespace.items():
+        existing_ids.update(_existing_in(get_existing_collection(namespace), ids))
+    
+    # Guild messages stored before namespaces were enabled are still in the
+    # shared collection until split-namespaces moves them
+    unmatched = [
+        msg_id for namespace, ids in ids_by_namespace.items() if namespace
+        for msg_id in ids if msg_id not in existing_ids
+    ]
+    if unmatched:
+        existing_ids.update(_existing_in(get_existing_collection(None), unmatched))
+    return existing_ids
+
+
+def _existing_in(collection, ids):
+    """IDs among ids that a collection (possibly None) holds."""
+    if collection is None:
+        return []
     try:
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=limit,
-            include=["documents", "distances", "metadatas"]
-        )
+        existing_data = collection.get(ids=ids, include=[])
+        return existing_data['ids'] if existing_data and 'ids' in existing_data else []
+    except Exception:
+        return []
+
+
+def _query_collection(collection, query_embeddings, limit, where=None):
+    """
+    Run one batched ChromaDB query and unpack the results.
+    
+    Returns:
+        List with one entry per query, each a list of tuples
+        (message_id, message_content, similarity_score, metadata)
+    """
+    results = collection.query(
+        query_embeddings=query_embeddings,
+        n_results=limit,
+        where=where,
+        include=["documents", "distances", "metadatas"]
+    )
+    
+    all_ids = results.get('ids') or []
+    all_documents = results.get('documents') or []
+    all_distances = results.get('distances') or []
+    all_metadatas = results.get('metadatas') or []
+    
+    # ChromaDB returns distances, we convert to similarity (1 - distance)
+    batch_results = []
+    for query_index in range(len(query_embeddings)):
+        ids = all_ids[query_index] if query_index < len(all_ids) else []
+        messages = all_documents[query_index] if query_index < len(all_documents) else []
+        distances = all_distances[query_index] if query_index < len(all_distances) else []
+        metadatas = all_metadatas[query_index] if query_index < len(all_metadatas) else []
         
-        # Convert results to list of tuples (message, similarity, author)
-        # ChromaDB returns distances, we convert to similarity (1 - distance)
-        messages = results['documents'][0] if results.get('documents') else []
-        distances = results['distances'][0] if results.get('distances') else []
-        metadatas = results.get('metadatas', [[]])[0] if results.get('metadatas') else []
+        rows = []
+        for i, (msg_id, msg, dist) in enumerate(zip(ids, messages, distances)):
+            metadata = metadatas[i] if i < len(metadatas) and metadatas[i] else {}
+            rows.append((msg_id, msg, 1 - dist, metadata))
+        batch_results.append(rows)
+    
+    return batch_results
+
+
+def recency_factor(timestamp, now, half_life_days, recency_weight):
+    """
+    Time-decay multiplier applied to a message's similarity.
+    
+    Args:
+        timestamp: Message time in epoch seconds, or None if unknown
+        now: Current time in epoch seconds
+        half_life_days: Age at which the decayed part of the score halves
+        recency_weight: Share of the score (0-1) that decays with age
         
-        # Extract author from metadata, default to None if not present
-        similarities = []
-        for i, (msg, dist) in enumerate(zip(messages, distances)):
-            author = metadatas[i].get('author') if i < len(metadatas) and metadatas[i] else None
-            similarities.append((msg, 1 - dist, author))
+    Returns:
+        float between 1 - recency_weight (very old or undated) and 1 (brand new)
+    """
+    if timestamp is None:
+        return 1 - recency_weight
+    age_days = max(0.0, now - timestamp) / 86400
+    return (1 - recency_weight) + recency_weight * 0.5 ** (age_days / half_life_days)
+
+
+def _search_recency_weighted(collection, query_embeddings, limit, half_life_days=90,
+                             recency_weight=0.5, windows_days=(7, 30, 180, 365), keep=None):
+    """
+    Recency-weighted search that only reaches into older messages when needed.
+    
+    Queries expanding time windows (a `where` on the timestamp metadata) and
+    stops for a query once its top results can't be beaten: a message older
+    than the window scores at most its similarity (<= 1) times the window's
+    recency factor. The final pass searches the whole collection, including
+    messages without a timestamp.
+    
+    The result is approximate: each window returns its `limit` most similar
+    messages, not its `limit` best recency-weighted ones, so a newer but less
+    similar message in the same window can be missed, on top of the HNSW
+    index itself being approximate.
+    
+    Returns:
+        List with one entry per query, each a list of tuples
+        (score, message_content, similarity_score, author), best first
+    """
+    now = time.time()
+    candidates = [{} for _ in query_embeddings]
+    pending = list(range(len(query_embeddings)))
+    
+    for window_days in list(windows_days) + [None]:
+        if not pending:
+            break
+        
+        where = {"timestamp": {"$gte": now - window_days * 86400}} if window_days else None
+        batch_rows = _query_collection(collection, [query_embeddings[i] for i in pending], limit, where)
+        
+        still_pending = []
+        for query_index, rows in zip(pending, batch_rows):
+            for msg_id, msg, similarity, metadata in rows:
+                if keep and not keep(metadata):
+                    continue
+                score = similarity * recency_factor(metadata.get('timestamp'), now, half_life_days, recency_weight)
+                candidates[query_index][msg_id] = (score, msg, similarity, metadata.get('author'))
+            
+            if window_days is None:
+                continue
+            scores = sorted((entry[0] for entry in candidates[query_index].values()), reverse=True)
+            best_older_score = recency_factor(now - window_days * 86400, now, half_life_days, recency_weight)
+            if len(scores) < limit or scores[limit - 1] < best_older_score:
+                still_pending.append(query_index)
+        pending = still_pending
+    
+    return [
+        sorted(query_candidates.values(), key=lambda entry: entry[0], reverse=True)[:limit]
+        for query_candidates in candidates
+    ]
+
+
+def _search_collection(namespace, query_embeddings, limit, recency, projection_version, keep=None):
+    """
+    Search one namespace's collection (or its reduced copy).
+    
+    Args:
+        keep: Optional predicate on a record's metadata; records it rejects
+            are dropped from the results
+    
+    Returns:
+        List with one entry per query, each a list of tuples
+        (score, message_content, similarity_score, author), best first; the
+        score is the similarity, time-decayed in recency mode
+    """
+    collection = get_existing_collection(namespace)
+    if collection is None:
+        # Nothing has been stored in this namespace yet
+        return [[] for _ in query_embeddings]
+    if projection_version:
+        collection = get_reduced_collection(projection_version, namespace)
+    
+    try:
+        if recency:
+            return _search_recency_weighted(collection, query_embeddings, limit, keep=keep, **recency)
         
-        return similarities
+        return [
+            [
+                (similarity, msg, similarity, metadata.get('author'))
+                for _, msg, similarity, metadata in rows if not keep or keep(metadata)
+            ]
+            for rows in _query_collection(collection, query_embeddings, limit)
+        ]
     
     except Exception as e:
         print(f"Error in search_similar_messages: {e}")
+        return [[] for _ in query_embeddings]
+
+
+def search_similar_messages_batch(query_embeddings, limit=8, recency=None, projection_version=None,
+                                  namespace=None, global_fallback=False):
+    """
+    Search for messages similar to several query embeddings in one query.
+    
+    Args:
+        query_embeddings: List of embedding vectors to search for
+        limit: Maximum number of results to return per query
+        recency: Optional dict of recency settings (half_life_days,
+            recency_weight, windows_days). When given, results are ranked by
+            similarity combined with time decay instead of similarity alone.
+        projection_version: Search the reduced collection of this projection
+            version; the query embeddings must already be projected with it
+        namespace: Search this namespace together with the shared-collection
+            records that have no guild or belong to it (None searches the
+            whole shared collection)
+        global_fallback: Search the whole shared collection alongside the
+            namespace, including other guilds' messages stored there before
+            split-namespaces
+        
+    Returns:
+        List with one entry per query, each a list of tuples
+        (message_content, similarity_score, author), best first
+    """
+    if not query_embeddings:
         return []
+    
+    if MEMORY_SNAPSHOT:
+        # The snapshot only holds full-size vectors, so projection_version doesn't apply
+        from memory_snapshot import get_snapshot
+        return get_snapshot().search(query_embeddings, limit, recency, namespace, global_fallback)
+    
+    query_embeddings = [_to_list(embedding) for embedding in query_embeddings]
+    batch_results = _search_collection(namespace, query_embeddings, limit, recency, projection_version)
+    
+    if namespace:
+        # Messages without a guild (DMs, text exports) live in the shared
+        # collection and belong to every namespace
+        keep = None if global_fallback else (lambda metadata: record_namespace(metadata) in (None, namespace))
+        shared = _search_collection(None, query_embeddings, limit, recency, projection_version, keep)
+        batch_results = [
+            sorted(rows + shared_rows, key=lambda row: row[0], reverse=True)[:limit]
+            for rows, shared_rows in zip(batch_results, shared)
+        ]
+    
+    return [[(msg, similarity, author) for _, msg, similarity, author in rows] for rows in batch_results]
+
+
+def search_similar_messages(query_embedding, limit=8, recency=None):
+    """
+    Search for messages similar to the query embedding.
+    
+    Args:
+        query_embedding: The embedding vector to search for
+        limit: Maximum number of results to return
+        recency: Optional recency settings, see search_similar_messages_batch
+        
+    Returns:
+        List of tuples (message_content, similarity_score, author)
+    """
+    return search_similar_messages_batch([query_embedding], limit, recency)[0]
 
 
 def get_collection_count():
@@ -200,6 +711,8 @@ def reset_collection():
     """
     Reset (delete) the collection. Use with caution!
     """
+    global _collection
+    _collection = None
     client = get_chromadb_client()
     try:
         client.delete_collection(name=COLLECTION_NAME)
@@ -1,6 +1,13 @@
 import discord
 from discord.ext import commands
 import asyncio
+from typing import Literal, Optional
+from colorama import Fore
+
+import profiler
+from config import PROFILE_MAX_SECONDS
+from resilience import breaker_states
+from utils import log
 
 class SleepCog(commands.Cog):
     def __init__(self, bot):
@@ -51,5 +58,117 @@ class SleepCog(commands.Cog):
             self.wake_up_task.cancel()
             self.wake_up_task = None
 
+class ProfilingCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @staticmethod
+    def is_admin(interaction: discord.Interaction):
+        permissions = getattr(interaction.user, "guild_permissions", None)
+        return bool(permissions and permissions.administrator)
+
+    @discord.app_commands.command(name="profile", description="Profile Blevitron for a while and save the results (admins only).")
+    @discord.app_commands.default_permissions(administrator=True)
+    @discord.app_commands.guild_only()
+    @discord.app_commands.describe(
+        seconds="How long to profile (default 30, or the maximum when a message count is given)",
+        messages="Stop after this many messages have been handled",
+        mode="sampler: low overhead, all threads. cprofile: exact call counts on the event loop thread"
+    )
+    async def profile(
+        self,
+        interaction: discord.Interaction,
+        seconds: Optional[int] = None,
+        messages: int = 0,
+        mode: Literal["sampler", "cprofile"] = "sampler"
+    ):
+        """
+        Profile the bot for a number of seconds or messages.
+        Results are written to disk and summarised in a follow-up message.
+        """
+        # default_permissions can be overridden per server, so check again here
+        if not self.is_admin(interaction):
+            await interaction.response.send_message("Only admins can profile me.", ephemeral=True)
+            return
+
+        if seconds is None:
+            seconds = PROFILE_MAX_SECONDS if messages else 30
+        if seconds <= 0 or messages < 0:
+            await interaction.response.send_message("Seconds must be positive and messages can't be negative.", ephemeral=True)
+            return
+
+        if profiler.active_session is not None:
+            await interaction.response.send_message("A profile is already running. Use /profile_stop to end it.", ephemeral=True)
+            return
+
+        # Respond before starting, so a failed response can't leave a session running
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+        limit = f"{seconds}s" + (f" or {messages} messages" if messages else "")
+        await interaction.response.send_message(f"Profiling ({mode}) for {limit}.", ephemeral=True)
+
+        try:
+            session = profiler.start_session(mode, seconds, messages)
+        except RuntimeError:
+            # Another /profile started while this one was responding
+            await interaction.followup.send("A profile is already running. Use /profile_stop to end it.", ephemeral=True)
+            return
+
+        log(f"[PROFILE] {interaction.user} started a {mode} profile ({limit})", Fore.MAGENTA)
+        try:
+            result = await session.run()
+        except Exception as e:
+            log(f"[PROFILE] Failed to write profile: {e}", Fore.RED)
+            await interaction.followup.send(f"Profiling failed: {e}", ephemeral=True)
+            return
+        finally:
+            # Also covers cancellation: never leave the profiler installed
+            session.close()
+
+        log(f"[PROFILE] Wrote {', '.join(result['files'])}", Fore.MAGENTA)
+        # Keep the follow-up within Discord's message limit; the full summary is on disk
+        summary = "\n".join(result['summary'])[:1500]
+        files = "\n".join(result['files'])
+        await interaction.followup.send(f"```\n{summary}\n```\nSaved:\n{files}", ephemeral=True)
+
+    @discord.app_commands.command(name="profile_stop", description="End the running profile early (admins only).")
+    @discord.app_commands.default_permissions(administrator=True)
+    @discord.app_commands.guild_only()
+    async def profile_stop(self, interaction: discord.Interaction):
+        """End the running profile early; its results are sent by /profile."""
+        if not self.is_admin(interaction):
+            await interaction.response.send_message("Only admins can profile me.", ephemeral=True)
+            return
+
+        if profiler.active_session is None:
+            await interaction.response.send_message("No profile is running.", ephemeral=True)
+            return
+
+        profiler.active_session.stop()
+        await interaction.response.send_message("Stopping the profile.", ephemeral=True)
+
+class StatusCog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @discord.app_commands.command(name="breakers", description="Show the state of Blevitron's API circuit breakers (admins only).")
+    @discord.app_commands.default_permissions(administrator=True)
+    @discord.app_commands.guild_only()
+    async def breakers(self, interaction: discord.Interaction):
+        """List each API endpoint's circuit breaker with its failure counts."""
+        if not ProfilingCog.is_admin(interaction):
+            await interaction.response.send_message("Only admins can see my breakers.", ephemeral=True)
+            return
+
+        lines = []
+        for endpoint, state in sorted(breaker_states().items()):
+            line = (f"{endpoint}: {state['state']}, {state['consecutive_failures']} failing in a row, "
+                    f"{state['total_failures']} failures and {state['total_rejections']} rejected calls in total")
+            if state['retry_in_seconds'] is not None:
+                line += f", retrying in {state['retry_in_seconds']:.0f}s"
+            lines.append(line)
+        await interaction.response.send_message("\n".join(lines) or "No API calls made yet.", ephemeral=True)
+
 async def setup(bot: commands.Bot):
-    await bot.add_cog(SleepCog(bot))
\ No newline at end of file
+    await bot.add_cog(SleepCog(bot))
+    await bot.add_cog(ProfilingCog(bot))
+    await bot.add_cog(StatusCog(bot))
\ No newline at end of file
@@ -5,6 +5,225 @@ import json
 # -------- BOT CONFIG --------
 DISCORD_BOT_TOKEN = os.environ.get("DISCORD_BOT_TOKEN")
 LLM_API_KEY = os.environ.get("LLM_API_KEY")
+# Where Gemini requests go; the replay load test points this at a local stub
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+
+# -------- MESSAGE IDEMPOTENCY --------
+# How long processed message IDs are remembered, and where they are persisted
+# so gateway replays after a restart or reconnect don't trigger duplicate replies.
+# Set PROCESSED_MESSAGES_DB to an empty string to keep the tracker in memory only.
+PROCESSED_MESSAGE_RETENTION_SECONDS = int(os.environ.get("PROCESSED_MESSAGE_RETENTION_SECONDS", "21600"))
+PROCESSED_MESSAGES_DB = os.environ.get("PROCESSED_MESSAGES_DB", "processed_messages.db")
+
+# -------- OUTBOUND API RESILIENCE --------
+# Deadlines (seconds, across all retries) for each kind of Gemini call, the
+# number of attempts per call, and the circuit breaker shared per endpoint:
+# after BREAKER_FAILURE_THRESHOLD consecutive failed calls (each counted once,
+# however many attempts it made) calls fail fast for
+# BREAKER_RESET_SECONDS before a single probe call is let through.
+DECISION_DEADLINE_SECONDS = float(os.environ.get("DECISION_DEADLINE_SECONDS", "10"))
+GENERATION_DEADLINE_SECONDS = float(os.environ.get("GENERATION_DEADLINE_SECONDS", "20"))
+EMBED_DEADLINE_SECONDS = float(os.environ.get("EMBED_DEADLINE_SECONDS", "5"))
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+EMBED_MAX_ATTEMPTS = int(os.environ.get("EMBED_MAX_ATTEMPTS", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+
+# -------- CONTEXT CACHING --------
+# Keep each distinct persona system instruction in a Gemini cachedContents
+# entry and reference it instead of resending it. Entries live for
+# CONTEXT_CACHE_TTL_SECONDS and are extended when used with less than
+# CONTEXT_CACHE_REFRESH_SECONDS left. Instructions shorter than the API's
+# minimum cacheable size (estimated at 4 characters per token) are always sent
+# inline, and an instruction that failed to cache isn't retried for
+# CONTEXT_CACHE_RETRY_SECONDS. The default persona instructions are far below
+# the minimum, so this only helps with long users.json descriptions.
+CONTEXT_CACHE = os.environ.get("CONTEXT_CACHE", "").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+CONTEXT_CACHE_REFRESH_SECONDS = int(os.environ.get("CONTEXT_CACHE_REFRESH_SECONDS", "600"))
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+CONTEXT_CACHE_RETRY_SECONDS = float(os.environ.get("CONTEXT_CACHE_RETRY_SECONDS", "3600"))
+
+# -------- SHARDING --------
+# Setting SHARD_COUNT (or AUTO_SHARD=1) runs the bot as an AutoShardedBot.
+# SHARD_IDS restricts this process to a subset of shards, so several processes
+# can split guilds between them; each process then owns its channels' state.
+AUTO_SHARD = os.environ.get("AUTO_SHARD", "").lower() in ("1", "true", "yes")
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None
+SHARD_IDS = [int(shard_id) for shard_id in os.environ.get("SHARD_IDS", "").split(",") if shard_id.strip()] or None
+
+# Address of the shared memory retrieval service ("unix:/path.sock" or "host:port").
+# When empty, each process queries its own local ChromaDB store.
+MEMORY_SERVICE_ADDRESS = os.environ.get("MEMORY_SERVICE_ADDRESS", "")
+
+# -------- RETRIEVAL --------
+# "similarity" ranks memories by cosine similarity alone. "recency" multiplies
+# similarity by a time decay: RECENCY_WEIGHT of the score halves every
+# RECENCY_HALF_LIFE_DAYS, and messages without a timestamp keep only the
+# undecayed part. Recency mode searches the RECENCY_WINDOWS_DAYS windows from
+# newest to oldest and skips older messages once they can no longer make the top
+# results; the windowed top-k is approximate (see _search_recency_weighted).
+# Structured exports and legacy "[date time] author" text exports store timestamps.
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "similarity").lower()
+RECENCY_HALF_LIFE_DAYS = float(os.environ.get("RECENCY_HALF_LIFE_DAYS", "90"))
+RECENCY_WEIGHT = float(os.environ.get("RECENCY_WEIGHT", "0.5"))
+RECENCY_WINDOWS_DAYS = [float(days) for days in os.environ.get("RECENCY_WINDOWS_DAYS", "7,30,180,365").split(",") if days.strip()]
+
+# -------- MEMORY NAMESPACES --------
+# Messages from a known guild are stored in a collection per guild ("guild")
+# or per channel ("channel") rather than the shared collection, and memory
+# searches only look in the namespace of the message being answered, so one
+# server's messages never surface in another. Messages without a guild (DM
+# and legacy text exports) stay in the shared collection, and every namespace
+# search also ranks them alongside its own results. "off" stores and searches
+# everything in the shared collection. Until
+# `python chroma_maintenance.py split-namespaces` has run, the shared
+# collection also holds every guild's older messages; a namespace search only
+# takes the ones of its own guild unless MEMORY_GLOBAL_FALLBACK is set.
+MEMORY_NAMESPACES = os.environ.get("MEMORY_NAMESPACES", "guild").lower()
+MEMORY_GLOBAL_FALLBACK = os.environ.get("MEMORY_GLOBAL_FALLBACK", "0").lower() in ("1", "true", "yes")
+
+# -------- HNSW INDEX --------
+# HNSW parameters applied when the vector collection is created or rebuilt
+# (python hnsw_tuning.py --apply). Empty values keep ChromaDB's defaults
+# (M=16, construction_ef=100, search_ef=100).
+HNSW_M = int(os.environ["HNSW_M"]) if os.environ.get("HNSW_M") else None
+HNSW_CONSTRUCTION_EF = int(os.environ["HNSW_CONSTRUCTION_EF"]) if os.environ.get("HNSW_CONSTRUCTION_EF") else None
+HNSW_SEARCH_EF = int(os.environ["HNSW_SEARCH_EF"]) if os.environ.get("HNSW_SEARCH_EF") else None
+
+# -------- REDUCED EMBEDDINGS --------
+# Path to a PCA projection fitted with `python embedding_projection.py fit`.
+# When set, query vectors are projected and searched against that projection's
+# parallel reduced collection, and new messages are stored in both collections.
+EMBEDDING_PROJECTION = os.environ.get("EMBEDDING_PROJECTION", "")
+
+# -------- MEMORY SNAPSHOT --------
+# Directory written by `python memory_snapshot.py export`. When set, memory
+# searches run against the snapshot's memory-mapped vectors instead of
+# ChromaDB, so startup doesn't load the SQLite store or HNSW index. Messages
+# added while serving from a snapshot are still stored in chroma_data/ and are
+# searchable after the next export. EMBEDDING_PROJECTION is ignored for
+# searches. MEMORY_SNAPSHOT_VERIFY checks the files' SHA-256 checksums on
+# load (file sizes are always checked).
+MEMORY_SNAPSHOT = os.environ.get("MEMORY_SNAPSHOT", "")
+MEMORY_SNAPSHOT_VERIFY = os.environ.get("MEMORY_SNAPSHOT_VERIFY", "").lower() in ("1", "true", "yes")
+
+# -------- LEXICAL SEARCH --------
+# BM25 index of stored messages, updated at ingest time (run
+# `python lexical_index.py build` once to index messages already stored).
+# An empty LEXICAL_INDEX_DB disables it. RETRIEVAL_FUSION "hybrid" merges
+# lexical and vector results with reciprocal rank fusion (RRF_K damps the
+# weight of top ranks); "vector" (the default, until the build has been run)
+# uses vector search alone. In hybrid mode a query embedding that fails or
+# takes longer than LEXICAL_FALLBACK_SECONDS is abandoned and the lexical
+# results are used alone. Lexical hits scoring below LEXICAL_MIN_SCORE (BM25;
+# a single common word scores ~2-3) are dropped, playing the role of the
+# similarity cut-off for messages only lexical search found.
+LEXICAL_INDEX_DB = os.environ.get("LEXICAL_INDEX_DB", "lexical_index.db")
+RETRIEVAL_FUSION = os.environ.get("RETRIEVAL_FUSION", "vector").lower()
+LEXICAL_FALLBACK_SECONDS = float(os.environ.get("LEXICAL_FALLBACK_SECONDS", "2"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+LEXICAL_MIN_SCORE = float(os.environ.get("LEXICAL_MIN_SCORE", "3"))
+
+# -------- NEAR-DUPLICATE FILTER --------
+# MinHash/LSH index of stored messages (run `python near_duplicates.py build`
+# once to index messages already stored). Ingestion skips messages whose
+# estimated Jaccard similarity (over character 3-grams) to a stored message in
+# the same namespace is at least NEAR_DUP_THRESHOLD, before embedding them.
+# NEAR_DUP_NUM_PERM is the signature length; changing it requires rebuilding
+# the index. An empty NEAR_DUP_INDEX_DB disables the filter.
+NEAR_DUP_INDEX_DB = os.environ.get("NEAR_DUP_INDEX_DB", "near_duplicates.db")
+NEAR_DUP_THRESHOLD = float(os.environ.get("NEAR_DUP_THRESHOLD", "0.8"))
+NEAR_DUP_NUM_PERM = int(os.environ.get("NEAR_DUP_NUM_PERM", "64"))
+
+# -------- LIVE INGESTION --------
+# When enabled, eligible incoming messages are spooled to LIVE_INGEST_SPOOL and
+# added to memory in the background, in batches of LIVE_INGEST_BATCH_SIZE or
+# every LIVE_INGEST_FLUSH_SECONDS, whichever comes first.
+LIVE_INGEST = os.environ.get("LIVE_INGEST", "").lower() in ("1", "true", "yes")
+LIVE_INGEST_SPOOL = os.environ.get("LIVE_INGEST_SPOOL", "ingest_spool.db")
+LIVE_INGEST_BATCH_SIZE = int(os.environ.get("LIVE_INGEST_BATCH_SIZE", "50"))
+LIVE_INGEST_FLUSH_SECONDS = float(os.environ.get("LIVE_INGEST_FLUSH_SECONDS", "60"))
+
+# -------- VECTOR SEARCH WORKERS --------
+# Number of dedicated search worker processes (0 runs searches on the default
+# thread pool instead) and how long a single search may take before the
+# worker is considered hung and replaced.
+SEARCH_WORKER_PROCESSES = int(os.environ.get("SEARCH_WORKER_PROCESSES", "1"))
+SEARCH_WORKER_TIMEOUT_SECONDS = float(os.environ.get("SEARCH_WORKER_TIMEOUT_SECONDS", "5"))
+
+# Concurrent searches arriving within this window (milliseconds) are coalesced
+# into one batched ChromaDB query of at most SEARCH_BATCH_MAX_SIZE embeddings.
+# A window of 0 disables coalescing.
+SEARCH_BATCH_WINDOW_MS = float(os.environ.get("SEARCH_BATCH_WINDOW_MS", "5"))
+SEARCH_BATCH_MAX_SIZE = int(os.environ.get("SEARCH_BATCH_MAX_SIZE", "16"))
+
+# Query texts waiting to be embedded are grouped over this window (milliseconds)
+# into one batchEmbedContents request of at most EMBED_BATCH_MAX_SIZE texts
+# (the API accepts up to 100). A window of 0 sends one request per query.
+EMBED_BATCH_WINDOW_MS = float(os.environ.get("EMBED_BATCH_WINDOW_MS", "10"))
+EMBED_BATCH_MAX_SIZE = int(os.environ.get("EMBED_BATCH_MAX_SIZE", "32"))
+
+# Seconds between event loop lag reports (0 disables them)
+LOOP_LAG_REPORT_SECONDS = float(os.environ.get("LOOP_LAG_REPORT_SECONDS", "300"))
+
+# -------- PROFILING --------
+# On-demand profiles started by admins with /profile are written here. The
+# stack sampler interval trades detail for overhead while a profile runs;
+# nothing runs when no profile is active.
+PROFILE_OUTPUT_DIR = os.environ.get("PROFILE_OUTPUT_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = int(os.environ.get("PROFILE_MAX_SECONDS", "600"))
+
+# -------- REPLY MODE --------
+# "two_call" asks Gemini whether to reply and then generates the reply separately.
+# "combined" asks once for structured {"reply": bool, "text": ...} output and falls
+# back to two calls when parsing fails. "ab" splits messages between the two modes
+# so their latency, token usage and reply rate can be compared.
+REPLY_MODE = os.environ.get("REPLY_MODE", "two_call").lower()
+
+# -------- REPLY DEADLINE --------
+# End-to-end latency SLO for each message, from arrival to reply (0 disables
+# budgets). Retrieval and the reply decision get RETRIEVAL_BUDGET_SHARE and
+# DECISION_BUDGET_SHARE of it; generation gets whatever is left, but at least
+# MIN_GENERATION_SECONDS. Retrieval that overruns falls back to the channel's
+# memories from the last RETRIEVAL_CACHE_SECONDS, or none; a decision that
+# overruns counts as a YES, so the message still gets a reply. When fewer than
+# SHORT_PROMPT_SECONDS remain before generation, memories are dropped and only
+# the last SHORT_PROMPT_HISTORY messages of history are sent.
+REPLY_SLO_SECONDS = float(os.environ.get("REPLY_SLO_SECONDS", "12"))
+RETRIEVAL_BUDGET_SHARE = float(os.environ.get("RETRIEVAL_BUDGET_SHARE", "0.2"))
+DECISION_BUDGET_SHARE = float(os.environ.get("DECISION_BUDGET_SHARE", "0.3"))
+MIN_GENERATION_SECONDS = float(os.environ.get("MIN_GENERATION_SECONDS", "3"))
+RETRIEVAL_CACHE_SECONDS = float(os.environ.get("RETRIEVAL_CACHE_SECONDS", "300"))
+SHORT_PROMPT_SECONDS = float(os.environ.get("SHORT_PROMPT_SECONDS", "5"))
+SHORT_PROMPT_HISTORY = int(os.environ.get("SHORT_PROMPT_HISTORY", "3"))
+
+# -------- SPECULATIVE GENERATION --------
+# When enabled, messages whose local reply-likelihood score reaches the threshold
+# start generating a response while the reply decision is still running. Each
+# channel may waste at most SPECULATIVE_WASTE_BUDGET speculative generations per
+# SPECULATIVE_BUDGET_WINDOW_SECONDS before speculation pauses there.
+SPECULATIVE_GENERATION = os.environ.get("SPECULATIVE_GENERATION", "").lower() in ("1", "true", "yes")
+SPECULATIVE_THRESHOLD = float(os.environ.get("SPECULATIVE_THRESHOLD", "0.5"))
+SPECULATIVE_WASTE_BUDGET = int(os.environ.get("SPECULATIVE_WASTE_BUDGET", "5"))
+SPECULATIVE_BUDGET_WINDOW_SECONDS = float(os.environ.get("SPECULATIVE_BUDGET_WINDOW_SECONDS", "600"))
+
+# -------- LOGGING --------
+# Log lines are queued and written by a background thread, so slow stdout
+# never blocks the event loop. LOG_CONSOLE keeps the colored console output;
+# LOG_JSON_FILE additionally writes one JSON object per line ("-" for stdout).
+# LOG_SAMPLE_RATES keeps only a share of some categories (the [TAG] a message
+# starts with), e.g. "INCOMING=0.01,LLM RESPONSE=0.1"; warnings and errors are
+# never sampled out.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_CONSOLE = os.environ.get("LOG_CONSOLE", "1").lower() in ("1", "true", "yes")
+LOG_JSON_FILE = os.environ.get("LOG_JSON_FILE", "")
+LOG_SAMPLE_RATES = {
+    category.strip().upper(): float(rate)
+    for category, _, rate in (item.partition("=") for item in os.environ.get("LOG_SAMPLE_RATES", "").split(","))
+    if category.strip() and rate.strip()
+}
 
 # -------- USER IDS --------
 def load_user_ids():
@@ -24,17 +243,32 @@ def load_user_ids():
         print(f"Error loading users.json: {e}")
         return {}
 
-# Load user IDs from users.json
-_user_ids = load_user_ids()
-
-# Map usernames to their Discord IDs
-BAGGINS_ID = _user_ids.get('bagginscord', '')
-SNAZZYDADDY_ID = _user_ids.get('snazzydaddy', '')
-PHROGSLEG_ID = _user_ids.get('phrogsleg', '')
-CORN_ID = _user_ids.get('corn', '')
-PUGMONKEY_ID = _user_ids.get('pugmonkey', '')
-MEATBRO_ID = _user_ids.get('meatbro', '')  # Not in users.json, will be empty
-RESTORT_ID = _user_ids.get('restort', '')
-TBL_ID = _user_ids.get('tbl', '')
-EVAN_ID = _user_ids.get('even', '')  # Username is "Even" in users.json
-DROID_ID = _user_ids.get('droid', '')
+# Usernames in users.json for each ID constant. users.json is read on first
+# access to one of these constants rather than at import time.
+_USER_ID_USERNAMES = {
+    "BAGGINS_ID": "bagginscord",
+    "SNAZZYDADDY_ID": "snazzydaddy",
+    "PHROGSLEG_ID": "phrogsleg",
+    "CORN_ID": "corn",
+    "PUGMONKEY_ID": "pugmonkey",
+    "MEATBRO_ID": "meatbro",  # Not in users.json, will be empty
+    "RESTORT_ID": "restort",
+    "TBL_ID": "tbl",
+    "EVAN_ID": "even",  # Username is "Even" in users.json
+    "DROID_ID": "droid",
+}
+
+_user_ids = None
+
+def get_user_ids():
+    """Load the username to Discord ID map on first use"""
+    global _user_ids
+    if _user_ids is None:
+        _user_ids = load_user_ids()
+    return _user_ids
+
+def __getattr__(name):
+    # Map usernames to their Discord IDs lazily (PEP 562 module attributes)
+    if name in _USER_ID_USERNAMES:
+        return get_user_ids().get(_USER_ID_USERNAMES[name], '')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,178 @@
+"""
+Gemini explicit context caching for static system instructions.
+Each persona instruction (base persona plus the user's description from
+users.json) is stored once as a cachedContents entry and referenced by name on
+later calls, so its tokens aren't resent and reprocessed with every message.
+
+Caching never blocks a reply: the first call for an instruction is sent inline
+while the entry is created in the background, and calls fall back to inline
+instructions whenever no live entry exists (instruction too short to cache,
+creation failed, entry expired or deleted).
+
+The API only caches content of at least CONTEXT_CACHE_MIN_TOKENS (1024 for
+Flash, roughly 4k characters). The persona instructions are currently a few
+hundred characters, so nothing is cached unless users.json descriptions grow
+past that; lookup() then costs one length check, and a warning is logged once.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import Counter
+import aiohttp
+from colorama import Fore
+
+from config import (
+    LLM_API_KEY, GEMINI_API_BASE, CONTEXT_CACHE_TTL_SECONDS, CONTEXT_CACHE_REFRESH_SECONDS,
+    CONTEXT_CACHE_MIN_TOKENS, CONTEXT_CACHE_RETRY_SECONDS
+)
+from resilience import call_with_retries, request_json, HTTPStatusError
+from utils import log
+
+# Circuit breaker name for cachedContents management calls
+CACHE_ENDPOINT = "gemini-cache"
+
+# Entries this close to expiry are treated as gone, so a request never
+# references an entry that expires while it is in flight
+EXPIRY_MARGIN_SECONDS = 30
+
+# Rough characters per token, used to skip instructions below the API minimum
+CHARS_PER_TOKEN = 4
+
+
+class ContextCache:
+    """
+    Local index of cachedContents entries, keyed by model and instruction text.
+    A changed instruction (e.g. an edited users.json description) hashes to a
+    new key, and the old entry simply expires on the server.
+    """
+
+    def __init__(self, model, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS, refresh_seconds=CONTEXT_CACHE_REFRESH_SECONDS,
+                 min_tokens=CONTEXT_CACHE_MIN_TOKENS, retry_seconds=CONTEXT_CACHE_RETRY_SECONDS, max_entries=500):
+        """
+        Args:
+            model: Gemini model the entries are created for (they only work with that model)
+            ttl_seconds: Lifetime of an entry after creation or refresh
+            refresh_seconds: Extend an entry when it is used with less than this left
+            min_tokens: Minimum instruction size worth caching (the API rejects smaller content)
+            retry_seconds: How long to send an instruction inline after caching it failed
+            max_entries: Maximum number of entries tracked locally
+        """
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self.refresh_seconds = refresh_seconds
+        self.min_chars = min_tokens * CHARS_PER_TOKEN
+        self.retry_seconds = retry_seconds
+        self.max_entries = max_entries
+        self.stats = Counter()
+        self._entries = {}
+        self._failed_until = {}
+        self._pending = {}
+        self._warned_small = False
+
+    def _key(self, system_instruction):
+        return hashlib.sha256(f"{self.model}\n{system_instruction}".encode("utf-8")).hexdigest()
+
+    def lookup(self, system_instruction):
+        """
+        Get the cached entry for an instruction, creating or refreshing it in the background as needed.
+
+        Returns:
+            The entry's name ("cachedContents/..."), or None to send the instruction inline
+        """
+        if len(system_instruction) < self.min_chars:
+            self.stats["too_small"] += 1
+            if not self._warned_small:
+                self._warned_small = True
+                log(f"[CONTEXT CACHE] A {len(system_instruction)}-char instruction is below the "
+                    f"~{self.min_chars}-char caching minimum; such instructions are sent inline", Fore.YELLOW)
+            return None
+
+        key = self._key(system_instruction)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            name, expires_at = entry
+            if expires_at - now > EXPIRY_MARGIN_SECONDS:
+                if expires_at - now < self.refresh_seconds:
+                    self._schedule(key, lambda: self._refresh(key, name))
+                self.stats["hits"] += 1
+                return name
+            del self._entries[key]
+
+        self.stats["misses"] += 1
+        if self._failed_until.get(key, 0) <= now:
+            self._schedule(key, lambda: self._create(key, system_instruction))
+        return None
+
+    def invalidate(self, system_instruction):
+        """Forget an instruction's entry, e.g. after the API reported it missing."""
+        if self._entries.pop(self._key(system_instruction), None) is not None:
+            self.stats["invalidated"] += 1
+
+    def _schedule(self, key, make_coro):
+        # One create or refresh per instruction at a time
+        if key in self._pending:
+            return
+        task = asyncio.create_task(make_coro())
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def _call(self, method, path, payload):
+        separator = "&" if "?" in path else "?"
+        url = f"{GEMINI_API_BASE}/v1beta/{path}{separator}key={LLM_API_KEY}"
+
+        async def attempt():
+            async with aiohttp.ClientSession() as session:
+                return await request_json(session, method, url, payload)
+
+        return await call_with_retries(CACHE_ENDPOINT, attempt, max_attempts=2, deadline=15)
+
+    async def _create(self, key, system_instruction):
+        try:
+            response = await self._call("POST", "cachedContents", {
+                "model": f"models/{self.model}",
+                "displayName": f"persona-{key[:12]}",
+                "systemInstruction": {"parts": [{"text": system_instruction}]},
+                "ttl": f"{self.ttl_seconds}s",
+            })
+        except Exception as e:
+            self._failed_until[key] = time.monotonic() + self.retry_seconds
+            self.stats["failed"] += 1
+            log(f"[CONTEXT CACHE] Caching failed, sending inline for {self.retry_seconds:.0f}s: {type(e).__name__}: {e}", Fore.YELLOW)
+            return
+
+        self._entries[key] = (response["name"], time.monotonic() + self.ttl_seconds)
+        self._failed_until.pop(key, None)
+        self.stats["created"] += 1
+        # Dicts keep insertion order; dropped entries expire on the server by themselves
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        log(f"[CONTEXT CACHE] Cached a {len(system_instruction)}-char instruction as {response['name']}", Fore.LIGHTBLACK_EX)
+
+    async def _refresh(self, key, name):
+        try:
+            await self._call("PATCH", f"{name}?updateMask=ttl", {"ttl": f"{self.ttl_seconds}s"})
+        except Exception as e:
+            if isinstance(e, HTTPStatusError) and e.status == 404:
+                # Already gone on the server
+                if self._entries.pop(key, None) is not None:
+                    self.stats["invalidated"] += 1
+                return
+            # Keep using the entry until it expires; the next lookup tries again
+            self.stats["refresh_failed"] += 1
+            log(f"[CONTEXT CACHE] Failed to extend {name}: {type(e).__name__}: {e}", Fore.YELLOW)
+            return
+
+        if key in self._entries:
+            self._entries[key] = (name, time.monotonic() + self.ttl_seconds)
+            self.stats["refreshed"] += 1
+
+    def snapshot(self):
+        """
+        Get cache counters.
+
+        Returns:
+            Dictionary with live entries and hit/miss/create/refresh/failure counts
+        """
+        return {"entries": len(self._entries), **self.stats}
@@ -0,0 +1,142 @@
+"""
+End-to-end latency budget for replying to a message.
+Each message gets REPLY_SLO_SECONDS from the moment it arrives, and each stage
+of the reply pipeline (retrieval, decision, generation) gets a slice of it.
+Stages that run out of time degrade instead of stalling the reply: retrieval
+falls back to the channel's cached memories or none, a late decision counts
+as a reply, and generation runs with a shortened prompt when little time is
+left.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from colorama import Fore
+
+from utils import log
+
+
+class ReplyDeadline:
+    """
+    Time budget for one message.
+
+    Retrieval and decision get a fixed share of the SLO (never more than is
+    left); generation gets whatever remains, but at least min_generation
+    seconds so a reply that is already late can still be produced.
+    """
+
+    def __init__(self, slo_seconds, shares, min_generation=2.0, stats=None):
+        """
+        Args:
+            slo_seconds: End-to-end budget in seconds (0 disables budgets)
+            shares: Dict mapping stage name to its share of the SLO
+            min_generation: Minimum seconds given to generation
+            stats: Optional DeadlineStats that stage misses are recorded in
+        """
+        self.slo_seconds = slo_seconds
+        self.shares = shares
+        self.min_generation = min_generation
+        self.stats = stats
+        self.started = time.monotonic()
+
+    @property
+    def enabled(self):
+        return self.slo_seconds > 0
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        """Seconds left before the SLO is missed (None when budgets are disabled)."""
+        if not self.enabled:
+            return None
+        return max(0.0, self.slo_seconds - self.elapsed())
+
+    def budget(self, stage):
+        """
+        Seconds the given stage may take (None when budgets are disabled).
+        """
+        if not self.enabled:
+            return None
+        if stage == "generation":
+            return max(self.min_generation, self.remaining())
+        # Never zero: a zero deadline means "no deadline" to call_with_retries
+        return max(0.01, min(self.slo_seconds * self.shares.get(stage, 0.0), self.remaining()))
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Run a pipeline stage against its budget, recording a miss if it overran.
+
+        Yields:
+            The stage's budget in seconds (None when budgets are disabled)
+        """
+        budget = self.budget(name)
+        start = time.monotonic()
+        try:
+            yield budget
+        finally:
+            if self.stats is not None and budget is not None:
+                self.stats.record_stage(name, time.monotonic() - start, budget)
+
+
+class RetrievalCache:
+    """
+    Most recent memories retrieved per channel.
+    Conversation topics drift slowly, so the previous message's memories are a
+    reasonable stand-in when retrieval for the current one runs out of time.
+    """
+
+    def __init__(self, ttl_seconds=300, max_channels=1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_channels = max_channels
+        self._entries = {}
+
+    def get(self, channel_id):
+        entry = self._entries.get(channel_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            return None
+        return entry[1]
+
+    def put(self, channel_id, memories):
+        self._entries.pop(channel_id, None)
+        self._entries[channel_id] = (time.monotonic(), memories)
+        # Dicts keep insertion order, so the first key is the least recently stored
+        while len(self._entries) > self.max_channels:
+            del self._entries[next(iter(self._entries))]
+
+
+async def retrieve_within_budget(retrieve, channel_id, deadline, cache):
+    """
+    Retrieve memories within the retrieval stage's budget.
+
+    Args:
+        retrieve: Async callable with no arguments returning a list of memories
+        channel_id: Channel the message came from, used as the cache key
+        deadline: ReplyDeadline for the message
+        cache: RetrievalCache shared across messages
+
+    Returns:
+        List of memory strings: fresh, cached, or empty if neither was available
+    """
+    with deadline.stage("retrieval") as budget:
+        try:
+            memories = await asyncio.wait_for(retrieve(), budget)
+        except Exception as e:
+            log(f"[DEADLINE] Retrieval gave up after {deadline.elapsed():.2f}s ({type(e).__name__})", Fore.YELLOW)
+            memories = None
+
+    if memories is not None:
+        cache.put(channel_id, memories)
+        return memories
+
+    cached = cache.get(channel_id)
+    if cached is not None:
+        if deadline.stats is not None:
+            deadline.stats.record_degradation("cached_memories")
+        log(f"[DEADLINE] Using {len(cached)} cached memories for this channel", Fore.YELLOW)
+        return cached
+
+    if deadline.stats is not None:
+        deadline.stats.record_degradation("memories_skipped")
+    return []
@@ -3,8 +3,11 @@ import json
 import time
 import aiohttp
 import asyncio
-from message_parser import parse_all_files_in_folder, parse_discord_export
-from chromadb_storage import add_messages, get_collection_count
+from message_parser import parse_all_files_in_folder, parse_discord_export, iter_export_records
+from chromadb_storage import add_messages, get_collection_count, get_existing_ids, namespace_for
+from near_duplicates import get_near_duplicate_index
+from resilience import call_with_retries, post_json
+from config import GEMINI_API_BASE
 import hashlib
 
 LLM_API_KEY = os.getenv('LLM_API_KEY')
@@ -19,7 +22,7 @@ async def generate_embedding(text):
     Returns:
         List of floats representing the embedding vector
     """
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/text-embedding-004:embedContent?key={LLM_API_KEY}"
+    url = f"{GEMINI_API_BASE}/v1beta/models/text-embedding-004:embedContent?key={LLM_API_KEY}"
     
     payload = {
         "model": "models/text-embedding-004",
@@ -30,17 +33,15 @@ async def generate_embedding(text):
         }
     }
     
-    try:
+    async def request():
         async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload)) as resp:
-                if resp.status != 200:
-                    error_text = await resp.text()
-                    print(f"[ERROR] Embedding API error: {error_text}")
-                    raise Exception(f"Embedding API error: {error_text}")
-                
-                response_data = await resp.json()
-                embedding = response_data['embedding']['values']
-                return embedding
+            return await post_json(session, url, payload)
+    
+    try:
+        # Offline ingestion can afford to wait out rate limits
+        response_data = await call_with_retries("gemini-embed", request, max_attempts=6, max_delay=60)
+        embedding = response_data['embedding']['values']
+        return embedding
     except Exception as e:
         print(f"[ERROR] Failed to generate embedding: {e}")
         raise
@@ -51,7 +52,7 @@ async def generate_embeddings_batch(messages, batch_size=20):
     Generate embeddings for multiple messages with rate limiting.
     
     Args:
-        messages: List of tuples (author, text) or list of text strings (for backward compatibility)
+        messages: List of (author, text, ...) tuples or list of text strings (for backward compatibility)
         batch_size: Number of concurrent requests
         
     Returns:
@@ -59,7 +60,7 @@ async def generate_embeddings_batch(messages, batch_size=20):
     """
     # Handle both formats: tuples and strings
     if messages and isinstance(messages[0], tuple):
-        texts = [msg[1] for msg in messages]  # Extract text from (author, text) tuples
+        texts = [msg[1] for msg in messages]  # Extract text from (author, text, ...) tuples
     else:
         texts = messages
     
@@ -81,20 +82,45 @@ async def generate_embeddings_batch(messages, batch_size=20):
     return embeddings
 
 
+def filter_near_duplicates(message_ids, texts, namespaces=None):
+    """
+    Find the messages worth embedding: those the near-duplicate filter
+    doesn't match to a stored message or an earlier message of the batch.
+    
+    Args:
+        message_ids: List of message IDs
+        texts: List of message texts
+        namespaces: Optional list with the namespace of each message
+        
+    Returns:
+        List of indices of the messages to keep
+    """
+    index = get_near_duplicate_index()
+    if index is None:
+        return list(range(len(message_ids)))
+    matches = index.find_duplicates(message_ids, texts, namespaces)
+    return [i for i, match in enumerate(matches) if match is None]
+
+
 def store_embeddings_in_chromadb(messages, embeddings, source_file):
     """
     Store messages and their embeddings in ChromaDB with deduplication.
     Uses content hash as ID to prevent duplicate messages.
     
     Args:
-        messages: List of tuples (author, message_text) or list of message strings (for backward compatibility)
+        messages: List of tuples (author, message_text, timestamp) or (author, message_text),
+            or list of message strings (for backward compatibility)
         embeddings: List of embedding vectors
         source_file: Name of the source file
     """
-    # Handle both formats: tuples (author, text) and plain strings
+    # Handle both formats: tuples (author, text[, timestamp]) and plain strings
+    metadatas = None
     if messages and isinstance(messages[0], tuple):
         authors = [msg[0] for msg in messages]
         message_texts = [msg[1] for msg in messages]
+        if len(messages[0]) > 2:
+            # Timestamps let recency-weighted retrieval decay legacy messages too
+            metadatas = [{"timestamp": msg[2]} for msg in messages]
     else:
         authors = None
         message_texts = messages
@@ -110,7 +136,7 @@ def store_embeddings_in_chromadb(messages, embeddings, source_file):
     
     try:
         # Add messages to ChromaDB (will skip duplicates by ID)
-        add_messages(message_texts, embeddings, message_ids, authors)
+        add_messages(message_texts, embeddings, message_ids, authors, metadatas)
         
         # Get count after adding
         count_after = get_collection_count()
@@ -122,8 +148,7 @@ def store_embeddings_in_chromadb(messages, embeddings, source_file):
     
     except Exception as e:
         print(f"Error storing messages: {e}")
-        print("Assuming all messages were duplicates")
-        print(f"Stored 0 new messages, skipped {len(messages)} duplicates")
+        print(f"Stored 0 of {len(messages)} messages; run the pipeline again to retry them")
 
 
 async def process_file(file_path):
@@ -145,6 +170,16 @@ async def process_file(file_path):
         print("No messages to process")
         return
     
+    keep = filter_near_duplicates(
+        [hashlib.sha256(text.encode('utf-8')).hexdigest() for _, text, _ in messages],
+        [text for _, text, _ in messages]
+    )
+    if len(keep) < len(messages):
+        print(f"Skipping {len(messages) - len(keep)} near-duplicates before embedding")
+        messages = [messages[i] for i in keep]
+    if not messages:
+        return
+    
     # Generate embeddings
     print("Generating embeddings...")
     embeddings = await generate_embeddings_batch(messages)
@@ -156,32 +191,131 @@ async def process_file(file_path):
     print(f"✓ Successfully processed {file_path}")
 
 
+def export_record_metadata(record):
+    """Build the ChromaDB metadata stored alongside a structured export record."""
+    return {
+        "message_id": record.id,
+        "timestamp": record.timestamp,
+        "guild_id": record.guild_id,
+        "channel_id": record.channel_id,
+        "channel": record.channel,
+        "author_id": record.author_id,
+    }
+
+
+async def store_export_chunk(records):
+    """
+    Embed and store one chunk of export records, deduplicated by message ID.
+    Messages already in ChromaDB (in their namespace, or still in the shared
+    collection from before split-namespaces) and near-duplicates of stored
+    messages are skipped before they are embedded.
+    
+    Args:
+        records: List of ExportMessage records
+        
+    Returns:
+        Tuple (inserted_count, skipped_count)
+    """
+    # Deduplicate within the chunk, then against what is already stored
+    unique_records = list({record.id: record for record in records}.values())
+    existing_ids = get_existing_ids(
+        [record.id for record in unique_records],
+        [namespace_for(record.guild_id, record.channel_id) for record in unique_records]
+    )
+    new_records = [record for record in unique_records if record.id not in existing_ids]
+    keep = filter_near_duplicates(
+        [record.id for record in new_records],
+        [record.content for record in new_records],
+        [namespace_for(record.guild_id, record.channel_id) for record in new_records]
+    )
+    new_records = [new_records[i] for i in keep]
+    
+    if not new_records:
+        return 0, len(records)
+    
+    embeddings = await generate_embeddings_batch([record.content for record in new_records])
+    inserted = add_messages(
+        [record.content for record in new_records],
+        embeddings,
+        message_ids=[record.id for record in new_records],
+        authors=[record.author for record in new_records],
+        metadatas=[export_record_metadata(record) for record in new_records]
+    )
+    return inserted, len(records) - inserted
+
+
+async def process_export_file(file_path, chunk_size=500):
+    """
+    Process a DiscordChatExporter JSON or CSV export: stream, embed, and store.
+    The file is read incrementally and handled in chunks, so large exports are
+    ingested without loading the whole file. Message IDs, timestamps, channel
+    and author IDs are kept as metadata.
+    
+    Args:
+        file_path: Path to the .json or .csv export
+        chunk_size: Number of records embedded and stored at a time
+    """
+    print(f"\n{'='*60}")
+    print(f"Processing: {file_path}")
+    print(f"{'='*60}")
+    
+    total_inserted = 0
+    total_skipped = 0
+    chunk = []
+    
+    for record in iter_export_records(file_path):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            inserted, skipped = await store_export_chunk(chunk)
+            total_inserted += inserted
+            total_skipped += skipped
+            print(f"  Stored {total_inserted} new messages so far, skipped {total_skipped} duplicates")
+            chunk = []
+    
+    if chunk:
+        inserted, skipped = await store_export_chunk(chunk)
+        total_inserted += inserted
+        total_skipped += skipped
+    
+    print(f"Stored {total_inserted} new messages, skipped {total_skipped} duplicates")
+    print(f"✓ Successfully processed {file_path}")
+
+
 async def process_all_files(folder_path='attached_assets'):
     """
     Process all Discord export files in a folder.
+    Legacy .txt exports are parsed in full; .json and .csv exports are streamed.
     
     Args:
-        folder_path: Path to folder containing .txt files
+        folder_path: Path to folder containing export files
     """
     from pathlib import Path
     
     folder = Path(folder_path)
-    txt_files = list(folder.glob('*.txt'))
+    export_files = sorted(
+        path for path in folder.iterdir()
+        if path.suffix.lower() in ('.txt', '.json', '.csv')
+    )
     
-    if not txt_files:
-        print(f"No .txt files found in {folder_path}")
+    if not export_files:
+        print(f"No .txt, .json or .csv files found in {folder_path}")
         return
     
-    print(f"Found {len(txt_files)} files to process")
+    print(f"Found {len(export_files)} files to process")
     
-    for file_path in txt_files:
-        await process_file(str(file_path))
+    for file_path in export_files:
+        if file_path.suffix.lower() == '.txt':
+            await process_file(str(file_path))
+        else:
+            await process_export_file(str(file_path))
     
     # Print summary
     total_messages = get_collection_count()
     
     print(f"\n{'='*60}")
     print(f"COMPLETE! Total messages in ChromaDB: {total_messages}")
+    if get_near_duplicate_index() is not None:
+        print(f"Near-duplicate filter: {get_near_duplicate_index().savings_summary()}")
     print(f"{'='*60}")
 
 
@@ -0,0 +1,260 @@
+"""
+PCA dimensionality reduction for stored embeddings.
+A projection (truncated SVD of the stored vectors) is fitted offline on the
+existing collection and saved as a versioned .npz file. Reduced vectors live in a parallel collection named after
+the projection version, so a refitted projection never mixes with vectors
+projected by an older one. When EMBEDDING_PROJECTION points at a projection
+file, query vectors are projected before searching and new messages are added
+to both collections.
+
+Usage:
+    python embedding_projection.py fit --dims 256 [--output embedding_projection.npz]
+    python embedding_projection.py build [--projection embedding_projection.npz]
+    python embedding_projection.py benchmark [--dims 64,128,256] [--k 8]
+"""
+
+import argparse
+import hashlib
+import time
+import numpy as np
+
+from config import EMBEDDING_PROJECTION
+
+DEFAULT_PROJECTION_FILE = "embedding_projection.npz"
+
+_projection = None
+_projection_loaded = False
+
+
+class EmbeddingProjection:
+    """
+    A fitted projection: vectors are multiplied by the top singular vectors
+    of the training set.
+
+    Vectors are not mean-centred. Cosine similarity is measured from the
+    origin, and centring shifts that origin, which cost far more recall on
+    our corpus than the variance it explains.
+    """
+
+    def __init__(self, components, explained_variance=0.0, fitted_on=0):
+        """
+        Args:
+            components: Top right singular vectors, shape (dims, source_dims)
+            explained_variance: Share of the training energy the components keep
+            fitted_on: Number of vectors the projection was fitted on
+        """
+        self.components = np.asarray(components, dtype=np.float32)
+        self.explained_variance = float(explained_variance)
+        self.fitted_on = int(fitted_on)
+        digest = hashlib.sha256(self.components.tobytes()).hexdigest()[:10]
+        self.version = f"pca{self.dimensions}-{digest}"
+
+    @property
+    def dimensions(self):
+        return self.components.shape[0]
+
+    @property
+    def source_dimensions(self):
+        return self.components.shape[1]
+
+    def project(self, vectors):
+        """
+        Project full-size embeddings.
+
+        Args:
+            vectors: Sequence of embeddings or a matrix, shape (n, source_dims)
+
+        Returns:
+            float32 matrix of shape (n, dims)
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[-1] != self.source_dimensions:
+            raise ValueError(f"Projection {self.version} expects {self.source_dimensions}-dim vectors, got {vectors.shape[-1]}")
+        return vectors @ self.components.T
+
+    def save(self, path):
+        """Write the projection to an .npz file."""
+        np.savez(
+            path,
+            components=self.components,
+            explained_variance=self.explained_variance,
+            fitted_on=self.fitted_on,
+            version=self.version
+        )
+
+
+def fit_projection(vectors, dimensions):
+    """
+    Fit a projection with a truncated SVD of the stored vectors.
+
+    Args:
+        vectors: float32 matrix of training embeddings
+        dimensions: Number of components to keep
+
+    Returns:
+        EmbeddingProjection
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dimensions >= min(vectors.shape):
+        raise ValueError(f"Can't fit {dimensions} components on {vectors.shape[0]} vectors of {vectors.shape[1]} dims")
+    _, singular_values, components = np.linalg.svd(vectors, full_matrices=False)
+    variance = singular_values ** 2
+    return EmbeddingProjection(
+        components[:dimensions],
+        variance[:dimensions].sum() / variance.sum(),
+        len(vectors)
+    )
+
+
+def load_projection(path):
+    """
+    Load a projection saved with EmbeddingProjection.save.
+
+    Raises:
+        ValueError: If the file's contents don't match its recorded version
+    """
+    with np.load(path) as data:
+        projection = EmbeddingProjection(
+            data["components"], data["explained_variance"], data["fitted_on"]
+        )
+        recorded_version = str(data["version"])
+    if projection.version != recorded_version:
+        raise ValueError(f"Projection file {path} is corrupt: expected {recorded_version}, got {projection.version}")
+    return projection
+
+
+def get_projection():
+    """
+    Get the projection configured by EMBEDDING_PROJECTION, loaded once.
+
+    Returns:
+        EmbeddingProjection, or None when reduced embeddings are disabled
+    """
+    global _projection, _projection_loaded
+    if not _projection_loaded:
+        _projection = load_projection(EMBEDDING_PROJECTION) if EMBEDDING_PROJECTION else None
+        _projection_loaded = True
+    return _projection
+
+
+def build_reduced_collection(projection, page_size=1000):
+    """
+    Project every stored record into the projection's parallel collection.
+    Records that are already there are skipped, so this also tops up a
+    reduced collection after messages were added without the projection.
+    The shared collection and every memory namespace get their own reduced
+    collection.
+
+    Returns:
+        int: Number of records added
+    """
+    from chroma_maintenance import iter_pages
+    from chromadb_storage import get_or_create_collection, get_reduced_collection, list_namespaces
+
+    added = 0
+    for namespace in [None] + list_namespaces():
+        reduced = get_reduced_collection(projection.version, namespace)
+        for page in iter_pages(get_or_create_collection(namespace), ["embeddings", "documents", "metadatas"], page_size):
+            existing = set(reduced.get(ids=page['ids'], include=[])['ids'])
+            keep = [i for i, msg_id in enumerate(page['ids']) if msg_id not in existing]
+            if not keep:
+                continue
+            metadatas = [page['metadatas'][i] or None for i in keep]
+            reduced.add(
+                ids=[page['ids'][i] for i in keep],
+                embeddings=projection.project(np.asarray(page['embeddings'])[keep]),
+                documents=[page['documents'][i] for i in keep],
+                metadatas=metadatas if any(metadatas) else None
+            )
+            added += len(keep)
+    return added
+
+
+def benchmark(dimensions_list, k=8, num_queries=200, sample=None, seed=0):
+    """
+    Compare recall@k and query latency of reduced indexes against the
+    full-size index. Recall is measured against exact full-size search, and
+    projections are fitted without the held-out query vectors.
+
+    Returns:
+        List of result dicts (dims, recall, p50_ms, p99_ms, bytes_per_vector)
+    """
+    import chromadb
+    from chromadb.config import Settings
+    from hnsw_tuning import evaluate, exact_neighbours, load_vectors, split_queries
+
+    base, queries = split_queries(load_vectors(sample, seed=seed), num_queries, seed)
+    k = min(k, len(base))
+    truth = exact_neighbours(base, queries, k)
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False, allow_reset=True))
+
+    results = []
+    for dimensions in [None] + list(dimensions_list):
+        if dimensions is None:
+            projected_base, projected_queries = base, queries
+            fit_seconds = 0.0
+        else:
+            start = time.perf_counter()
+            projection = fit_projection(base, dimensions)
+            fit_seconds = time.perf_counter() - start
+            projected_base, projected_queries = projection.project(base), projection.project(queries)
+
+        result = evaluate(client, projected_base, projected_queries, truth, k, None, None, None)
+        result.update({
+            "dims": projected_base.shape[1],
+            "bytes_per_vector": projected_base.shape[1] * 4,
+            "fit_seconds": fit_seconds,
+        })
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit, build and benchmark PCA-reduced embeddings")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fit_parser = subparsers.add_parser('fit', help="Fit a projection on the stored vectors and build its collection")
+    fit_parser.add_argument('--dims', type=int, default=256, help="Reduced dimensionality (128-256 recommended)")
+    fit_parser.add_argument('--sample', type=int, default=None, help="Fit on a random sample of this many vectors")
+    fit_parser.add_argument('--output', default=DEFAULT_PROJECTION_FILE, help="Where to save the projection")
+
+    build_parser = subparsers.add_parser('build', help="Add missing records to a projection's collection")
+    build_parser.add_argument('--projection', default=EMBEDDING_PROJECTION or DEFAULT_PROJECTION_FILE)
+
+    bench_parser = subparsers.add_parser('benchmark', help="Compare recall@k and latency of reduced vectors")
+    bench_parser.add_argument('--dims', default="64,128,256", help="Comma-separated dimensionalities")
+    bench_parser.add_argument('--k', type=int, default=8)
+    bench_parser.add_argument('--queries', type=int, default=200)
+    bench_parser.add_argument('--sample', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        from hnsw_tuning import load_vectors
+
+        print("Fitting projection...")
+        projection = fit_projection(load_vectors(args.sample), args.dims)
+        projection.save(args.output)
+        print(f"   {projection.version}: {projection.source_dimensions} -> {projection.dimensions} dims, "
+              f"{projection.explained_variance:.1%} of variance kept (fitted on {projection.fitted_on} vectors)")
+        print(f"   Saved to {args.output}")
+        print("\nBuilding reduced collection...")
+        print(f"   Added {build_reduced_collection(projection)} records")
+        print(f"\nSet EMBEDDING_PROJECTION={args.output} to search the reduced collection")
+
+    elif args.command == 'build':
+        projection = load_projection(args.projection)
+        print(f"Building reduced collection for {projection.version}...")
+        print(f"   Added {build_reduced_collection(projection)} records")
+
+    elif args.command == 'benchmark':
+        dims = [int(item) for item in args.dims.split(",") if item.strip()]
+        results = benchmark(dims, args.k, args.queries, args.sample)
+        print(f"{'dims':>5} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'bytes/vec':>10} {'fit s':>6}")
+        for result in results:
+            print(f"{result['dims']:>5} {result['recall']:>7.3f} {result['p50_ms']:>8.2f} "
+                  f"{result['p99_ms']:>8.2f} {result['bytes_per_vector']:>10} {result['fit_seconds']:>6.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,182 @@
+"""
+HNSW parameter tuning for the message collection.
+Builds throwaway in-memory indexes over the stored vectors for a grid of
+M / construction_ef / search_ef values, measures recall@k against exact
+(brute-force) cosine search and per-query latency, and recommends the fastest
+configuration that reaches the target recall. With --apply the live
+collections (shared and every namespace) are rebuilt with the recommended
+settings.
+
+Usage:
+    python hnsw_tuning.py [--sample 5000] [--queries 200] [--k 8] [--target-recall 0.95]
+    python hnsw_tuning.py --m 8,16,32 --construction-ef 100,200 --search-ef 10,50,100 --apply
+"""
+
+import argparse
+import itertools
+import time
+import numpy as np
+
+from chroma_maintenance import all_collections, iter_pages, rebuild_all_indexes
+from chromadb_storage import collection_metadata
+from metrics import percentile
+
+
+def load_vectors(sample=None, page_size=1000, seed=0):
+    """
+    Load stored embeddings from every collection, optionally a random sample of them.
+
+    Returns:
+        float32 matrix with one row per stored vector
+    """
+    pages = [
+        np.asarray(page['embeddings'], dtype=np.float32)
+        for _, collection in all_collections()
+        for page in iter_pages(collection, ["embeddings"], page_size)
+    ]
+    vectors = np.concatenate(pages) if pages else np.empty((0, 0), dtype=np.float32)
+    if sample and sample < len(vectors):
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), sample, replace=False)]
+    return vectors
+
+
+def split_queries(vectors, num_queries, seed=0):
+    """
+    Hold out query vectors from the indexed set. Held-out queries behave like
+    live queries: they are similar to stored messages but never identical.
+
+    Returns:
+        Tuple (base_vectors, query_vectors)
+    """
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    num_queries = min(num_queries, len(vectors) // 5)
+    return vectors[order[num_queries:]], vectors[order[:num_queries]]
+
+
+def exact_neighbours(base, queries, k):
+    """
+    Brute-force top-k cosine neighbours, the ground truth for recall.
+
+    Returns:
+        Integer matrix of shape (len(queries), k) with row indices into base
+    """
+    base_normed = base / np.linalg.norm(base, axis=1, keepdims=True)
+    query_normed = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    similarities = query_normed @ base_normed.T
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(similarities, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def evaluate(client, base, queries, truth, k, hnsw_m, construction_ef, search_ef):
+    """
+    Build an in-memory index with the given parameters and measure it.
+
+    Returns:
+        Dictionary with the parameters, recall, latency percentiles and build time
+    """
+    name = f"hnsw_tuning_{hnsw_m}_{construction_ef}_{search_ef}"
+    collection = client.create_collection(
+        name=name,
+        metadata=collection_metadata(hnsw_m, construction_ef, search_ef)
+    )
+    try:
+        start = time.perf_counter()
+        for offset in range(0, len(base), 5000):
+            batch = base[offset:offset + 5000]
+            collection.add(ids=[str(offset + i) for i in range(len(batch))], embeddings=batch)
+        build_seconds = time.perf_counter() - start
+
+        # The first query loads the index; keep it out of the latencies
+        collection.query(query_embeddings=[queries[0]], n_results=k, include=[])
+
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            results = collection.query(query_embeddings=[query], n_results=k, include=[])
+            latencies.append(time.perf_counter() - start)
+            hits += len({int(found) for found in results['ids'][0]} & set(expected.tolist()))
+    finally:
+        client.delete_collection(name=name)
+
+    return {
+        "M": hnsw_m,
+        "construction_ef": construction_ef,
+        "search_ef": search_ef,
+        "recall": hits / truth.size,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "build_seconds": build_seconds,
+    }
+
+
+def recommend(results, target_recall):
+    """
+    Pick the configuration with the lowest p99 latency that reaches the target
+    recall, or the highest-recall configuration if none does.
+    """
+    passing = [result for result in results if result["recall"] >= target_recall]
+    if passing:
+        return min(passing, key=lambda result: (result["p99_ms"], result["build_seconds"]))
+    return max(results, key=lambda result: (result["recall"], -result["p99_ms"]))
+
+
+def parse_grid(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep HNSW parameters over the stored vectors")
+    parser.add_argument('--sample', type=int, default=None, help="Use a random sample of this many stored vectors")
+    parser.add_argument('--queries', type=int, default=200, help="Held-out query vectors")
+    parser.add_argument('--k', type=int, default=8, help="Neighbours per query (memory retrieval uses 8)")
+    parser.add_argument('--m', type=parse_grid, default=[8, 16, 32], help="Comma-separated M values")
+    parser.add_argument('--construction-ef', type=parse_grid, default=[100, 200], help="Comma-separated construction_ef values")
+    parser.add_argument('--search-ef', type=parse_grid, default=[10, 25, 50, 100], help="Comma-separated search_ef values")
+    parser.add_argument('--target-recall', type=float, default=0.95, help="Minimum recall@k for a recommendation")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--apply', action='store_true', help="Rebuild the live collections with the recommended settings")
+    args = parser.parse_args()
+
+    import chromadb
+    from chromadb.config import Settings
+
+    print("Loading stored vectors...")
+    vectors = load_vectors(args.sample, seed=args.seed)
+    if len(vectors) < 50:
+        print(f"ERROR: need at least 50 stored vectors to tune, found {len(vectors)}")
+        return 1
+
+    base, queries = split_queries(vectors, args.queries, args.seed)
+    k = min(args.k, len(base))
+    truth = exact_neighbours(base, queries, k)
+    print(f"   {len(base)} indexed vectors, {len(queries)} held-out queries, recall@{k}")
+
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False, allow_reset=True))
+    results = []
+    print(f"\n{'M':>4} {'c_ef':>5} {'s_ef':>5} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8}")
+    for hnsw_m, construction_ef, search_ef in itertools.product(args.m, args.construction_ef, args.search_ef):
+        result = evaluate(client, base, queries, truth, k, hnsw_m, construction_ef, search_ef)
+        results.append(result)
+        print(f"{hnsw_m:>4} {construction_ef:>5} {search_ef:>5} {result['recall']:>7.3f} "
+              f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['build_seconds']:>8.2f}")
+
+    best = recommend(results, args.target_recall)
+    met = "meets" if best["recall"] >= args.target_recall else "is the best available; none reach"
+    print(f"\nRecommended: M={best['M']} construction_ef={best['construction_ef']} search_ef={best['search_ef']} "
+          f"(recall@{k} {best['recall']:.3f}, p99 {best['p99_ms']:.2f} ms; {met} the {args.target_recall} target)")
+    print("Set these so newly created collections use them:")
+    print(f"   HNSW_M={best['M']} HNSW_CONSTRUCTION_EF={best['construction_ef']} HNSW_SEARCH_EF={best['search_ef']}")
+
+    if args.apply:
+        print("\nRebuilding the live collections with the recommended settings...")
+        copied = rebuild_all_indexes(metadata=collection_metadata(best['M'], best['construction_ef'], best['search_ef']))
+        print(f"   Copied {sum(copied.values())} records into {len(copied)} collections")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
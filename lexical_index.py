@@ -0,0 +1,290 @@
+"""
+Local BM25 lexical index over stored messages.
+Kept in a SQLite file next to the vector store and updated by add_messages at
+ingest time, so exact terms (usernames, game names, in-jokes) can be matched
+without an embedding round trip. Retrieval fuses these results with vector
+search, and falls back to them alone when the embedding API is slow or down.
+
+Usage:
+    python lexical_index.py build      # index messages already in ChromaDB
+    python lexical_index.py search "valorant tonight"
+"""
+
+import argparse
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+from config import LEXICAL_INDEX_DB
+
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Terms found in more than this share of documents carry almost no signal and
+# have the longest postings lists, so they are skipped at query time
+MAX_DOCUMENT_FREQUENCY = 0.25
+
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)?")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for if in is it its of on or so that the this to was were with "
+    "i im i'm me my you your u we he she they them it's".split()
+)
+
+_index = None
+
+
+def tokenize(text):
+    """
+    Split text into lowercase index terms.
+
+    Returns:
+        List of terms (stopwords and single characters removed)
+    """
+    return [
+        token for token in TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index stored in SQLite.
+
+    Several processes (search workers, the memory service, ingestion scripts)
+    may write to the same file; SQLite's locking keeps them consistent.
+    Documents record the memory namespace they belong to (for guild messages
+    still in the shared collection, the namespace split-namespaces would move
+    them to), and searches can be restricted to namespaces; term statistics
+    are shared by all of them.
+    """
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path: SQLite file holding the index
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "doc_id TEXT PRIMARY KEY, content TEXT NOT NULL, author TEXT, length INTEGER NOT NULL, namespace TEXT);"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term, doc_id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+            "INSERT OR IGNORE INTO stats VALUES ('documents', 0), ('total_length', 0);"
+        )
+        # Indexes built before namespaces existed hold only shared-collection documents
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(documents)")]
+        if "namespace" not in columns:
+            self._db.execute("ALTER TABLE documents ADD COLUMN namespace TEXT")
+        self._db.commit()
+
+    def add(self, doc_ids, contents, authors=None, namespace=None):
+        """
+        Index new documents. Documents already in the index are skipped.
+
+        Args:
+            doc_ids: List of document IDs (the same IDs as the vector store)
+            contents: List of message texts
+            authors: Optional list of author names
+            namespace: Memory namespace of the documents (None for messages without a guild)
+
+        Returns:
+            int: Number of documents indexed
+        """
+        authors = authors or [None] * len(doc_ids)
+        with self._lock, self._db:
+            added = 0
+            added_length = 0
+            for doc_id, content, author in zip(doc_ids, contents, authors):
+                terms = Counter(tokenize(content))
+                length = sum(terms.values())
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO documents (doc_id, content, author, length, namespace) VALUES (?, ?, ?, ?, ?)",
+                    (doc_id, content, author, length, namespace)
+                )
+                if not cursor.rowcount:
+                    continue
+                self._db.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in terms.items()]
+                )
+                self._db.executemany(
+                    "INSERT INTO terms VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in terms]
+                )
+                added += 1
+                added_length += length
+
+            self._db.execute("UPDATE stats SET value = value + ? WHERE name = 'documents'", (added,))
+            self._db.execute("UPDATE stats SET value = value + ? WHERE name = 'total_length'", (added_length,))
+        return added
+
+    def count(self):
+        """Number of indexed documents."""
+        with self._lock:
+            return self._db.execute("SELECT value FROM stats WHERE name = 'documents'").fetchone()[0]
+
+    def set_namespace(self, doc_ids, namespace):
+        """Record that documents moved to another namespace."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE documents SET namespace = ? WHERE doc_id = ?",
+                [(namespace, doc_id) for doc_id in doc_ids]
+            )
+
+    def search(self, query_text, limit=8, namespaces=None, min_score=0.0):
+        """
+        Rank documents against a query with BM25.
+        Scoring runs inside SQLite, which releases the GIL while it steps
+        through the postings, so only the top results pass through Python.
+
+        Args:
+            query_text: Free-text query
+            limit: Maximum number of results
+            namespaces: Only return documents from these namespaces (None in
+                the list means the shared collection); default: all documents
+            min_score: Drop documents scoring below this
+
+        Returns:
+            List of tuples (doc_id, message_content, bm25_score, author), best first
+        """
+        query_terms = set(tokenize(query_text))
+        if not query_terms:
+            return []
+
+        with self._lock:
+            stats = dict(self._db.execute("SELECT name, value FROM stats"))
+            num_documents = stats["documents"]
+            if not num_documents:
+                return []
+            average_length = stats["total_length"] / num_documents
+
+            namespace_filter = ""
+            namespace_params = ()
+            if namespaces is not None:
+                named = [namespace for namespace in namespaces if namespace]
+                clauses = [f"d.namespace IN ({', '.join('?' * len(named))})"] if named else []
+                if None in namespaces:
+                    clauses.append("d.namespace IS NULL")
+                namespace_filter = f" AND ({' OR '.join(clauses) or '0'})"
+                namespace_params = tuple(named)
+
+            placeholders = ", ".join("?" * len(query_terms))
+            weighted_terms = []
+            for term, df in self._db.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", tuple(query_terms)):
+                if df <= max(1, MAX_DOCUMENT_FREQUENCY * num_documents):
+                    weighted_terms += [term, math.log(1 + (num_documents - df + 0.5) / (df + 0.5))]
+            if not weighted_terms:
+                return []
+
+            values = ", ".join("(?, ?)" for _ in range(len(weighted_terms) // 2))
+            rows = self._db.execute(
+                f"WITH query_terms(term, idf) AS (VALUES {values}) "
+                "SELECT scored.doc_id, doc.content, scored.score, doc.author FROM ("
+                "SELECT p.doc_id, SUM(q.idf * p.tf * ? / (p.tf + ? * (1 - ? + ? * d.length / ?))) AS score "
+                "FROM query_terms q JOIN postings p ON p.term = q.term JOIN documents d ON d.doc_id = p.doc_id "
+                f"WHERE 1{namespace_filter} GROUP BY p.doc_id HAVING score >= ? ORDER BY score DESC LIMIT ?"
+                ") scored JOIN documents doc ON doc.doc_id = scored.doc_id ORDER BY scored.score DESC",
+                (*weighted_terms, BM25_K1 + 1, BM25_K1, BM25_B, BM25_B, float(average_length),
+                 *namespace_params, min_score, limit)
+            ).fetchall()
+        return rows
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def get_lexical_index():
+    """
+    Get the process-wide lexical index.
+
+    Returns:
+        LexicalIndex, or None when LEXICAL_INDEX_DB is empty (index disabled)
+    """
+    global _index
+    if _index is None and LEXICAL_INDEX_DB:
+        _index = LexicalIndex(LEXICAL_INDEX_DB)
+    return _index
+
+
+def reciprocal_rank_fusion(ranked_lists, k=60, limit=8):
+    """
+    Merge several rankings with reciprocal rank fusion: each item scores
+    the sum of 1 / (k + rank) over the lists it appears in.
+
+    Args:
+        ranked_lists: Lists of item keys, best first
+        k: Damping constant; larger values flatten the contribution of top ranks
+        limit: Number of fused results
+
+    Returns:
+        List of (key, fused_score) tuples, best first
+    """
+    scores = Counter()
+    for ranked in ranked_lists:
+        for rank, key in enumerate(ranked, start=1):
+            scores[key] += 1 / (k + rank)
+    return scores.most_common(limit)
+
+
+def build_from_collection(page_size=1000):
+    """
+    Index every message already stored in ChromaDB.
+
+    Returns:
+        int: Number of documents newly indexed
+    """
+    from chroma_maintenance import iter_pages
+    from chromadb_storage import get_or_create_collection, list_namespaces, record_namespace
+
+    index = get_lexical_index()
+    added = 0
+    for namespace in [None] + list_namespaces():
+        for page in iter_pages(get_or_create_collection(namespace), ["documents", "metadatas"], page_size):
+            groups = {}
+            for i, metadata in enumerate(page['metadatas']):
+                # Guild messages in the shared collection are indexed under their own namespace
+                groups.setdefault(record_namespace(metadata) if namespace is None else namespace, []).append(i)
+            for record_ns, indices in groups.items():
+                ids = [page['ids'][i] for i in indices]
+                authors = [(page['metadatas'][i] or {}).get("author") for i in indices]
+                added += index.add(ids, [page['documents'][i] for i in indices], authors, record_ns)
+                if record_ns != namespace:
+                    # Indexes built before this kept them under the shared collection
+                    index.set_namespace(ids, record_ns)
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the BM25 lexical index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="Index messages already stored in ChromaDB")
+    search_parser = subparsers.add_parser('search', help="Run a lexical query")
+    search_parser.add_argument('query')
+    search_parser.add_argument('--limit', type=int, default=8)
+    args = parser.parse_args()
+
+    if get_lexical_index() is None:
+        print("ERROR: LEXICAL_INDEX_DB is empty, the lexical index is disabled")
+        return 1
+
+    if args.command == 'build':
+        print("Indexing stored messages...")
+        print(f"   Indexed {build_from_collection()} new messages ({get_lexical_index().count()} total)")
+    elif args.command == 'search':
+        for i, (_, content, score, author) in enumerate(get_lexical_index().search(args.query, args.limit), 1):
+            print(f"{i}. [BM25: {score:.2f}] {author}: {content}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
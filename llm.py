@@ -1,14 +1,145 @@
 import aiohttp
 import asyncio
 import json
+import logging
 from colorama import Fore
-from config import LLM_API_KEY
-from utils import log
+from config import (
+    LLM_API_KEY, GEMINI_API_BASE, DECISION_DEADLINE_SECONDS, GENERATION_DEADLINE_SECONDS, LLM_MAX_ATTEMPTS,
+    CONTEXT_CACHE
+)
+from utils import log, log_enabled
+from resilience import call_with_retries, post_json, CircuitOpenError, HTTPStatusError
 from memory_search import get_relevant_memories
 from user_management import replace_aliases_with_usernames
+from context_cache import ContextCache
+from chromadb_storage import namespace_for
+
+GENERATE_MODEL = "gemini-2.5-flash-preview-05-20"
+GENERATE_URL = f"{GEMINI_API_BASE}/v1beta/models/{GENERATE_MODEL}:generateContent"
+
+# Circuit breaker name shared by every generateContent call
+GENERATE_ENDPOINT = "gemini-generate"
+
+# Sent instead of waiting on the API while it is unhealthy
+UNAVAILABLE_REPLY = "sorry, i'm having trouble connecting to my brain rn. try again in a sec?"
+
+# Persona instructions cached server-side (None when context caching is off)
+persona_cache = ContextCache(GENERATE_MODEL) if CONTEXT_CACHE else None
+
+# Statuses the API returns when a referenced cachedContents entry is missing
+# (deleted, expired or never visible to this key)
+CACHE_MISS_STATUSES = {403, 404}
+
+# -------- Helpers --------
+def record_usage(usage, response_data):
+    """Add the token counts from a Gemini response to a usage dict, if one was given."""
+    if usage is None or not response_data:
+        return
+    metadata = response_data.get("usageMetadata", {})
+    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + metadata.get("promptTokenCount", 0)
+    usage["output_tokens"] = usage.get("output_tokens", 0) + metadata.get("candidatesTokenCount", 0)
+    usage["cached_tokens"] = usage.get("cached_tokens", 0) + metadata.get("cachedContentTokenCount", 0)
+    usage["calls"] = usage.get("calls", 0) + 1
+
+def build_system_instruction(user_id=None):
+    """Build the persona system instruction, personalised for the given user if known."""
+    # Load user data from JSON file
+    try:
+        with open('users.json', 'r') as f:
+            user_data = json.load(f)
+    except FileNotFoundError:
+        user_data = {}
+
+    # Base system instruction
+    system_instruction = "You are Blevitron. Talk like the messages you see in the chat history."
+
+    # Add user-specific instructions if user_id is provided
+    if user_id and str(user_id) in user_data:
+        user_info = user_data[str(user_id)]
+        system_instruction += f"\n\nThis is how you should act towards {user_info['username']}:\n{user_info['description']}"
+
+    return system_instruction
+
+def message_namespace(message):
+    """Memory namespace searched for a Discord message (None for the shared collection)."""
+    if not message.guild:
+        return None
+    return namespace_for(message.guild.id, message.channel.id)
+
+async def retrieve_memories(message_text, history, namespace=None):
+    """
+    Retrieve relevant memories for a message and its recent conversation.
+
+    Args:
+        message_text: The current message text
+        history: Recent conversation history for the channel
+        namespace: Memory namespace to search (see message_namespace)
+
+    Returns:
+        List of memory strings
+    """
+    processed_history = [
+        {"author": h['author'], "content": replace_aliases_with_usernames(h['content'])}
+        for h in history
+    ]
+    return await get_relevant_memories(
+        replace_aliases_with_usernames(message_text), processed_history, limit=40, namespace=namespace
+    )
+
+def format_memories(memories):
+    """Format memories as a bulleted list for a prompt."""
+    return "\n".join([f"- {mem}" for mem in memories])
+
+async def post_generate(payload):
+    """Send one generateContent request and return the decoded response."""
+    url = f"{GENERATE_URL}?key={LLM_API_KEY}"
+    async with aiohttp.ClientSession() as session:
+        return await post_json(session, url, payload)
+
+def is_cache_miss(error, cached_name):
+    """
+    Check whether a failed request failed because its cachedContents entry is gone.
+    An expired entry can also come back as a 400 naming the entry; any other
+    400 is a bad request that sending the instruction inline wouldn't fix.
+    """
+    if error.status in CACHE_MISS_STATUSES:
+        return True
+    return error.status == 400 and cached_name.rsplit("/", 1)[-1] in error.body
+
+async def post_generate_with_instruction(payload, system_instruction):
+    """
+    Send a generateContent request with a system instruction, referencing a
+    cached copy of the instruction when one is live and sending it inline otherwise.
+    """
+    cached_name = persona_cache.lookup(system_instruction) if persona_cache else None
+    if cached_name:
+        try:
+            return await post_generate({**payload, "cachedContent": cached_name})
+        except HTTPStatusError as e:
+            if not is_cache_miss(e, cached_name):
+                raise
+            # Expired or deleted server-side before our local TTL said so
+            persona_cache.invalidate(system_instruction)
+            log(f"[CONTEXT CACHE] {cached_name} unusable ({e.status}), sending the instruction inline", Fore.YELLOW)
+
+    return await post_generate({**payload, "systemInstruction": {"parts": [{"text": system_instruction}]}})
 
 # -------- AI Decision: Should Bot Reply? --------
-async def should_bot_reply(message, history):
+async def should_bot_reply(message, history, usage=None, memories=None, deadline_seconds=None):
+    """
+    Ask Gemini whether the bot should reply to a message.
+
+    Args:
+        message: The incoming Discord message
+        history: Recent conversation history for the channel
+        usage: Optional dict that token counts are added to
+        memories: Memories already retrieved by the caller (retrieved here if None)
+        deadline_seconds: Time allowed for the call (defaults to DECISION_DEADLINE_SECONDS)
+
+    Returns:
+        bool: Whether to reply, False if the call failed; None if it ran out of
+        time before deciding
+    """
     # Process aliases in the message content and history
     processed_content = replace_aliases_with_usernames(message.content)
     processed_history = [
@@ -20,8 +151,11 @@ async def should_bot_reply(message, history):
     history_text = "\n".join([f"{h['author']}: {h['content']}" for h in processed_history[-10:]])
 
     # Get relevant memories from the database
-    memories = await get_relevant_memories(processed_content, processed_history, limit=40)
-    memory_text = "\n".join([f"- {mem}" for mem in memories])
+    if memories is None:
+        memories = await get_relevant_memories(
+            processed_content, processed_history, limit=40, namespace=message_namespace(message)
+        )
+    memory_text = format_memories(memories)
 
     decision_prompt = f"""You are deciding whether "Botlivia Blevitron" (a Discord bot) should respond to this message.
 
@@ -44,23 +178,48 @@ Answer: """
         "systemInstruction": {"parts": [{"text": "You are a decision-making assistant. Respond with only YES or NO."}]}
     }
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={LLM_API_KEY}"
-
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload)) as resp:
-                response_data = await resp.json()
-                if response_data and response_data.get("candidates"):
-                    decision = response_data["candidates"][0]["content"]["parts"][0]["text"].strip().upper()
-                    log(f"[AI DECISION] Should reply: {decision}", Fore.YELLOW)
-                    return "YES" in decision
+        response_data = await call_with_retries(
+            GENERATE_ENDPOINT,
+            lambda: post_generate(payload),
+            max_attempts=LLM_MAX_ATTEMPTS,
+            deadline=min(DECISION_DEADLINE_SECONDS, deadline_seconds or DECISION_DEADLINE_SECONDS)
+        )
+        record_usage(usage, response_data)
+        if response_data and response_data.get("candidates"):
+            decision = response_data["candidates"][0]["content"]["parts"][0]["text"].strip().upper()
+            log(f"[AI DECISION] Should reply: {decision}", Fore.YELLOW)
+            return "YES" in decision
+    except CircuitOpenError:
+        log("[AI DECISION] API unhealthy (breaker open), defaulting to NO", Fore.YELLOW)
+    except asyncio.TimeoutError:
+        log("[AI DECISION] Ran out of time before deciding", Fore.YELLOW)
+        return None
     except Exception as e:
-        log(f"[AI DECISION ERROR] {e}, defaulting to NO", Fore.RED)
+        log(f"[AI DECISION ERROR] {type(e).__name__}: {e}, defaulting to NO", Fore.RED)
 
     return False
 
 # -------- LLM Response --------
-async def get_llm_response(prompt, history=None, user_id=None):
+async def get_llm_response(prompt, history=None, user_id=None, usage=None, memories=None, deadline_seconds=None,
+                           namespace=None):
+    """
+    Generate the bot's reply.
+
+    Args:
+        prompt: The generation prompt built by the caller
+        history: Recent conversation history for the channel
+        user_id: Discord ID of the author, for persona instructions
+        usage: Optional dict that token counts are added to
+        memories: Memories already retrieved by the caller (retrieved here if
+            None; pass an empty list to generate without memories)
+        deadline_seconds: Time allowed across all attempts (defaults to
+            GENERATION_DEADLINE_SECONDS)
+        namespace: Memory namespace searched when memories is None (see message_namespace)
+
+    Returns:
+        str: The reply text, or a canned reply if the API failed
+    """
     # Process aliases in the prompt and history
     processed_prompt = replace_aliases_with_usernames(prompt)
     processed_history = [
@@ -68,82 +227,130 @@ async def get_llm_response(prompt, history=None, user_id=None):
         for h in (history or [])
     ]
 
-    # Load user data from JSON file
-    try:
-        with open('users.json', 'r') as f:
-            user_data = json.load(f)
-    except FileNotFoundError:
-        user_data = {}
-
     # Retrieve relevant memories from past conversations
     try:
-        current_message = processed_prompt.split("User: ")[-1] if "User: " in processed_prompt else processed_prompt
-        memories = await get_relevant_memories(current_message, processed_history, limit=40)
+        if memories is None:
+            current_message = processed_prompt.split("User: ")[-1] if "User: " in processed_prompt else processed_prompt
+            memories = await get_relevant_memories(current_message, processed_history, limit=40, namespace=namespace)
         
         if memories:
-            memory_text = "\n".join([f"- {mem}" for mem in memories])
-            processed_prompt = f"[Relevant past messages for context]:\n{memory_text}\n\n{processed_prompt}"
+            processed_prompt = f"[Relevant past messages for context]:\n{format_memories(memories)}\n\n{processed_prompt}"
             log(f"[MEMORY] Retrieved {len(memories)} relevant memories", Fore.MAGENTA)
     except Exception as e:
         log(f"[MEMORY ERROR] {e}, continuing without memories", Fore.YELLOW)
 
-    # Base system instruction
-    system_instruction = "You are Blevitron. Talk like the messages you see in the chat history."
+    system_instruction = build_system_instruction(user_id)
 
-    # Add user-specific instructions if user_id is provided
-    if user_id and str(user_id) in user_data:
-        user_info = user_data[str(user_id)]
-        system_instruction += f"\n\nThis is how you should act towards {user_info['username']}:\n{user_info['description']}"
+    payload = {
+        "contents": [{"parts": [{"text": processed_prompt}]}]
+    }
+
+    try:
+        response_data = await call_with_retries(
+            GENERATE_ENDPOINT,
+            lambda: post_generate_with_instruction(payload, system_instruction),
+            max_attempts=LLM_MAX_ATTEMPTS,
+            deadline=min(GENERATION_DEADLINE_SECONDS, deadline_seconds or GENERATION_DEADLINE_SECONDS)
+        )
+    except CircuitOpenError:
+        log("[LLM ERROR] API unhealthy (breaker open), sending canned reply", Fore.YELLOW)
+        return UNAVAILABLE_REPLY
+    except HTTPStatusError as e:
+        log(f"[LLM ERROR] {e}", Fore.RED)
+        return UNAVAILABLE_REPLY if e.retryable else "uh idk"
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log(f"[LLM ERROR] Giving up after {type(e).__name__}: {e}", Fore.RED)
+        return UNAVAILABLE_REPLY
+
+    record_usage(usage, response_data)
+    if log_enabled(logging.DEBUG):
+        log(f"[LLM RESPONSE] Raw response: {json.dumps(response_data)[:200]}", Fore.CYAN, level=logging.DEBUG)
+
+    if response_data and response_data.get("candidates"):
+        return response_data["candidates"][0]["content"]["parts"][0]["text"]
+
+    log(f"[LLM ERROR] No candidates in response: {response_data}", Fore.RED)
+    return "uh idk"
+
+# -------- Combined Decision + Response --------
+DECIDE_AND_RESPOND_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "reply": {"type": "BOOLEAN"},
+        "text": {"type": "STRING"}
+    },
+    "required": ["reply"]
+}
+
+async def decide_and_respond(message, history, prompt, user_id=None, usage=None, memories=None, deadline_seconds=None):
+    """
+    Decide whether to reply and generate the reply in a single Gemini call.
+    Uses structured JSON output of the form {"reply": bool, "text": str}.
+
+    Args:
+        message: The incoming Discord message
+        history: Recent conversation history for the channel
+        prompt: The generation prompt built by the caller
+        user_id: Discord ID of the author, for persona instructions
+        usage: Optional dict that token counts are added to
+        memories: Memories already retrieved by the caller (retrieved here if None)
+        deadline_seconds: Time allowed for the call (defaults to GENERATION_DEADLINE_SECONDS)
+
+    Returns:
+        Tuple (should_reply, text), or None if the call or parsing failed and
+        the caller should fall back to the two-call path
+    """
+    processed_prompt = replace_aliases_with_usernames(prompt)
+    processed_history = [
+        {"author": h['author'], "content": replace_aliases_with_usernames(h['content'])}
+        for h in history
+    ]
+
+    try:
+        if memories is None:
+            current_message = processed_prompt.split("User: ")[-1] if "User: " in processed_prompt else processed_prompt
+            memories = await get_relevant_memories(
+                current_message, processed_history, limit=40, namespace=message_namespace(message)
+            )
+        if memories:
+            processed_prompt = f"[Relevant past messages for context]:\n{format_memories(memories)}\n\n{processed_prompt}"
+    except Exception as e:
+        log(f"[MEMORY ERROR] {e}, continuing without memories", Fore.YELLOW)
+
+    system_instruction = build_system_instruction(user_id) + (
+        "\n\nFirst decide whether Blevitron should respond to the current message from "
+        f"{message.author}. Answer with JSON: set \"reply\" to true or false, and when "
+        "reply is true put your response in \"text\"."
+    )
 
     payload = {
         "contents": [{"parts": [{"text": processed_prompt}]}],
-        "systemInstruction": {
-            "parts": [{"text": system_instruction}]
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": DECIDE_AND_RESPOND_SCHEMA
         }
     }
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent?key={LLM_API_KEY}"
+    try:
+        # A single attempt: on failure the two-call path is the retry
+        response_data = await call_with_retries(
+            GENERATE_ENDPOINT,
+            lambda: post_generate_with_instruction(payload, system_instruction),
+            max_attempts=1,
+            deadline=min(GENERATION_DEADLINE_SECONDS, deadline_seconds or GENERATION_DEADLINE_SECONDS)
+        )
+        record_usage(usage, response_data)
+        raw_text = response_data["candidates"][0]["content"]["parts"][0]["text"]
+        result = json.loads(raw_text)
+    except Exception as e:
+        log(f"[COMBINED ERROR] {type(e).__name__}: {e}, falling back to two calls", Fore.YELLOW)
+        return None
 
-    # Retry logic with exponential backoff
-    max_retries = 3
-    base_delay = 1
-    
-    for attempt in range(max_retries):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload)) as resp:
-                    if resp.status == 503:
-                        if attempt < max_retries - 1:
-                            delay = base_delay * (2 ** attempt)
-                            log(f"[LLM RETRY] API overloaded, retrying in {delay}s (attempt {attempt + 1}/{max_retries})", Fore.YELLOW)
-                            await asyncio.sleep(delay)
-                            continue
-                        else:
-                            log(f"[LLM ERROR] API still overloaded after {max_retries} attempts", Fore.RED)
-                            return "sorry, i'm having trouble connecting to my brain rn. try again in a sec?"
-                    
-                    if resp.status != 200:
-                        error_text = await resp.text()
-                        log(f"[LLM ERROR] API returned status {resp.status}: {error_text}", Fore.RED)
-                        return "uh idk"
-                    
-                    response_data = await resp.json()
-                    log(f"[LLM RESPONSE] Raw response: {json.dumps(response_data)[:200]}", Fore.CYAN)
-                    
-                    if response_data and response_data.get("candidates"):
-                        return response_data["candidates"][0]["content"]["parts"][0]["text"]
-                    else:
-                        log(f"[LLM ERROR] No candidates in response: {response_data}", Fore.RED)
-                        return "uh idk"
-        except Exception as e:
-            log(f"[LLM ERROR] Exception occurred: {type(e).__name__}: {e}", Fore.RED)
-            import traceback
-            log(f"[LLM ERROR] Traceback: {traceback.format_exc()}", Fore.RED)
-            
-            if attempt < max_retries - 1:
-                delay = base_delay * (2 ** attempt)
-                log(f"[LLM RETRY] Retrying in {delay}s (attempt {attempt + 1}/{max_retries})", Fore.YELLOW)
-                await asyncio.sleep(delay)
-                continue
-
-    return "uh idk"
\ No newline at end of file
+    should_reply = result.get("reply") if isinstance(result, dict) else None
+    text = (result.get("text") or "").strip() if isinstance(result, dict) else ""
+    if not isinstance(should_reply, bool) or (should_reply and not text):
+        log(f"[COMBINED ERROR] Unusable structured output: {raw_text[:200]}", Fore.YELLOW)
+        return None
+
+    log(f"[AI DECISION] Should reply (combined): {'YES' if should_reply else 'NO'}", Fore.YELLOW)
+    return should_reply, text
@@ -0,0 +1,515 @@
+"""
+Offline load test: replays exported conversations through the real on_message
+handler with Discord and Gemini stubbed locally.
+Messages parsed from the exports in attached_assets are turned into timed
+synthetic events, sped up by a configurable factor and spread over several
+channels. Gemini requests go to a local HTTP stub with configurable latency
+(through GEMINI_API_BASE), and the fake channels record when replies are sent.
+Vector and lexical search run against the real local stores.
+
+The report covers sustained throughput, growth of the in-flight handler queue,
+memory growth of conversation_history and reply-latency percentiles.
+
+Usage:
+    python load_test.py [--speedup 20] [--channels 4] [--duration 60]
+    python load_test.py --files attached_assets/export.json --llm-latency 1.5 --reply-rate 0.5
+"""
+
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import itertools
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+DEFAULT_EXPORT_FOLDER = "attached_assets"
+
+BOT_USER_ID = 1000000000000000001
+BOT_USER_NAME = "Botlivia Blevitron"
+STUB_REPLIES = ["lol", "real", "wait what", "nah that's crazy", "ok but why tho", "fr"]
+
+# When the replayed message that is currently being handled was dispatched
+_dispatched_at = contextvars.ContextVar("dispatched_at", default=None)
+
+
+# -------- Gemini stub --------
+class GeminiStub:
+    """
+    Local stand-in for the Gemini generateContent and batchEmbedContents endpoints.
+    Each request waits for the configured latency (jittered by +/-50%) before
+    answering, so API time is spent the same way it would be in production.
+    """
+
+    def __init__(self, llm_latency=0.8, embed_latency=0.1, reply_rate=0.3, dimensions=768, seed=0):
+        self.llm_latency = llm_latency
+        self.embed_latency = embed_latency
+        self.reply_rate = reply_rate
+        self.dimensions = dimensions
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.cached_contents = {}
+
+    def _delay(self, latency):
+        return latency * self.rng.uniform(0.5, 1.5)
+
+    def _embedding(self, text):
+        # Deterministic per text, like the real model
+        import numpy as np
+
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"].rsplit(":", 1)[-1]
+        payload = await request.json()
+        if method == "batchEmbedContents":
+            self.calls["embed"] += 1
+            await asyncio.sleep(self._delay(self.embed_latency))
+            return web.json_response({"embeddings": [
+                {"values": self._embedding(item["content"]["parts"][0]["text"])}
+                for item in payload["requests"]
+            ]})
+        if method != "generateContent":
+            return web.json_response({"error": {"message": f"unknown method {method}"}}, status=404)
+
+        await asyncio.sleep(self._delay(self.llm_latency))
+        reply = self.rng.random() < self.reply_rate
+        cached_text = ""
+        if "cachedContent" in payload:
+            if payload["cachedContent"] not in self.cached_contents:
+                return web.json_response({"error": {"message": "CachedContent not found"}}, status=404)
+            cached_text = self.cached_contents[payload["cachedContent"]]
+        system_text = payload.get("systemInstruction", {}).get("parts", [{}])[0].get("text", "")
+        if "generationConfig" in payload:
+            self.calls["combined"] += 1
+            text = json.dumps({"reply": reply, "text": self.rng.choice(STUB_REPLIES) if reply else ""})
+        elif "Respond with only YES or NO" in system_text:
+            self.calls["decision"] += 1
+            text = "YES" if reply else "NO"
+        else:
+            self.calls["generation"] += 1
+            text = self.rng.choice(STUB_REPLIES)
+
+        prompt_text = payload["contents"][0]["parts"][0]["text"]
+        return web.json_response({
+            "candidates": [{"content": {"parts": [{"text": text}]}}],
+            "usageMetadata": {
+                "promptTokenCount": (len(prompt_text) + len(system_text) + len(cached_text)) // 4,
+                "cachedContentTokenCount": len(cached_text) // 4,
+                "candidatesTokenCount": len(text) // 4,
+            },
+        })
+
+    async def handle_cache(self, request):
+        from aiohttp import web
+
+        payload = await request.json()
+        if request.method == "POST":
+            self.calls["cache_create"] += 1
+            name = f"cachedContents/stub-{len(self.cached_contents) + 1}"
+            self.cached_contents[name] = payload["systemInstruction"]["parts"][0]["text"]
+            return web.json_response({"name": name})
+        self.calls["cache_refresh"] += 1
+        name = f"cachedContents/{request.match_info['cache_id']}"
+        if name not in self.cached_contents:
+            return web.json_response({"error": {"message": "CachedContent not found"}}, status=404)
+        return web.json_response({"name": name, "ttl": payload.get("ttl")})
+
+    async def start(self, sock):
+        """Serve on an already-bound socket. Returns the aiohttp runner."""
+        from aiohttp import web
+
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/v1beta/models/{method}", self.handle)
+        app.router.add_post("/v1beta/cachedContents", self.handle_cache)
+        app.router.add_patch("/v1beta/cachedContents/{cache_id}", self.handle_cache)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.SockSite(runner, sock).start()
+        return runner
+
+
+# -------- Discord stubs --------
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+_ALL_PERMISSIONS = SimpleNamespace(send_messages=True, read_messages=True)
+
+
+class FakeChannel:
+    """A text channel whose sends are recorded instead of delivered."""
+
+    def __init__(self, channel_id, name, guild, report, send_latency=0.05):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.report = report
+        self.send_latency = send_latency
+
+    def __str__(self):
+        return self.name
+
+    def permissions_for(self, member):
+        return _ALL_PERMISSIONS
+
+    def typing(self):
+        return _Typing()
+
+    async def send(self, content):
+        await asyncio.sleep(self.send_latency)
+        self.report.record_reply(_dispatched_at.get())
+        return SimpleNamespace(content=content, channel=self)
+
+
+class FakeMessage:
+    def __init__(self, message_id, author, content, channel):
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.channel = channel
+        self.guild = channel.guild
+        self.mentions = []
+        self.reference = None
+        self.created_at = datetime.now(timezone.utc)
+
+
+# -------- Replay --------
+def load_conversation(paths, interval=5.0, max_gap=60.0, seed=0):
+    """
+    Parse exports into a timed conversation.
+    Structured exports keep their recorded gaps; text exports carry no usable
+    timestamps, so their messages arrive as a Poisson process with the given
+    mean interval. Gaps longer than max_gap (overnight silences) are capped.
+
+    Returns:
+        List of (gap_seconds, author, content) tuples in replay order
+    """
+    from message_parser import is_ingestible_content, iter_export_records, parse_discord_export
+
+    rng = random.Random(seed)
+    events = []
+    for path in paths:
+        if Path(path).suffix.lower() in (".json", ".csv"):
+            previous = None
+            for record in iter_export_records(path):
+                if not is_ingestible_content(record.content):
+                    continue
+                if record.timestamp is not None and previous is not None:
+                    gap = max(0.0, record.timestamp - previous)
+                else:
+                    gap = rng.expovariate(1 / interval)
+                previous = record.timestamp if record.timestamp is not None else previous
+                events.append((min(gap, max_gap), record.author, record.content))
+        else:
+            for author, content, _timestamp in parse_discord_export(path):
+                if is_ingestible_content(content):
+                    events.append((min(rng.expovariate(1 / interval), max_gap), author, content))
+    return events
+
+
+def deep_size(obj, seen=None):
+    """Approximate memory held by a structure of dicts, lists and strings, in bytes."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+    return size
+
+
+def growth_rate(samples):
+    """Least-squares slope of (time, value) samples, in units per second."""
+    if len(samples) < 2:
+        return 0.0
+    mean_t = sum(t for t, _ in samples) / len(samples)
+    mean_v = sum(v for _, v in samples) / len(samples)
+    variance = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not variance:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in samples) / variance
+
+
+class LoadReport:
+    """Counters and samples collected while replaying."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.dispatched = 0
+        self.completed = 0
+        self.in_flight = set()
+        self.reply_latencies = []
+        self.handler_latencies = []
+        self.dispatch_lag = []
+        self.queue_samples = []
+        self.history_samples = []
+
+    def record_reply(self, dispatched_at):
+        if dispatched_at is not None:
+            self.reply_latencies.append(time.monotonic() - dispatched_at)
+
+    def sample(self, history):
+        now = time.monotonic() - self.started
+        self.queue_samples.append((now, len(self.in_flight)))
+        self.history_samples.append((now, deep_size(history)))
+
+
+async def handle_message(on_message, message, report):
+    """Run the real handler for one message, timing it from dispatch."""
+    dispatched_at = time.monotonic()
+    _dispatched_at.set(dispatched_at)
+    try:
+        await on_message(message)
+    finally:
+        report.handler_latencies.append(time.monotonic() - dispatched_at)
+        report.completed += 1
+
+
+async def replay_channel(channel, events, authors, speedup, stop_at, report, on_message, ids, max_messages):
+    """Replay the conversation into one channel until stop_at or the message limit."""
+    next_at = time.monotonic()
+    for gap, author, content in itertools.cycle(events):
+        next_at += gap / speedup
+        if next_at >= stop_at:
+            return
+        await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        if max_messages and report.dispatched >= max_messages:
+            return
+        report.dispatch_lag.append(max(0.0, time.monotonic() - next_at))
+
+        if author not in authors:
+            authors[author] = FakeUser(2000000000000000000 + len(authors), author)
+        message = FakeMessage(next(ids), authors[author], content, channel)
+        task = asyncio.create_task(handle_message(on_message, message, report))
+        report.in_flight.add(task)
+        task.add_done_callback(report.in_flight.discard)
+        report.dispatched += 1
+
+
+async def run(args, stub_socket):
+    from metrics import LoopLagMonitor
+
+    stub = GeminiStub(args.llm_latency, args.embed_latency, args.reply_rate, seed=args.seed)
+    runner = await stub.start(stub_socket)
+
+    # Imported only now that the environment points it at the stubs
+    import bot as bot_module
+    import memory_search
+    import search_worker
+
+    bot_module.init_bot()
+    bot_module.bot._connection.user = FakeUser(BOT_USER_ID, BOT_USER_NAME, bot=True)
+
+    paths = args.files or sorted(
+        str(path) for path in Path(DEFAULT_EXPORT_FOLDER).iterdir()
+        if path.suffix.lower() in (".txt", ".json", ".csv")
+    )
+    events = load_conversation(paths, args.interval, args.max_gap, args.seed)
+    if not events:
+        print("ERROR: no replayable messages found")
+        await runner.cleanup()
+        return 1
+    conversation_seconds = sum(gap for gap, _, _ in events)
+    print(f"Loaded {len(events)} messages from {len(paths)} export(s) "
+          f"({conversation_seconds / 60:.1f} min of conversation, "
+          f"{len(events) / max(conversation_seconds, 1e-9) * args.speedup * args.channels:.1f} msg/s offered)")
+
+    print("Initializing the bot's local state...")
+    await bot_module.background_init()
+
+    report = LoadReport()
+    guild = SimpleNamespace(id=1, name="load-test", me=bot_module.bot.user)
+    channels = [
+        FakeChannel(10000 + i, f"load-test-{i}", guild, report, args.send_latency)
+        for i in range(args.channels)
+    ]
+    authors = {}
+    ids = itertools.count(1)
+    history = bot_module.conversation_history
+    loop_lag = LoopLagMonitor(report_interval=0)
+    loop_lag.start()
+    rss_start_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"Replaying at {args.speedup:g}x into {args.channels} channel(s) for {args.duration:g}s...\n")
+    report.started = time.monotonic()
+    stop_at = report.started + args.duration
+    # Each channel starts at a different point of the conversation
+    producers = [
+        asyncio.create_task(replay_channel(
+            channel,
+            events[len(events) * i // args.channels:] + events[:len(events) * i // args.channels],
+            authors, args.speedup, stop_at, report, bot_module.on_message, ids, args.messages
+        ))
+        for i, channel in enumerate(channels)
+    ]
+
+    report.sample(history)
+    while not all(producer.done() for producer in producers):
+        await asyncio.sleep(min(args.sample_interval, max(0.0, stop_at - time.monotonic())) or 0.05)
+        report.sample(history)
+        elapsed = time.monotonic() - report.started
+        print(f"  t={elapsed:6.1f}s dispatched={report.dispatched} completed={report.completed} "
+              f"in_flight={len(report.in_flight)} replies={len(report.reply_latencies)} "
+              f"history={report.history_samples[-1][1] / 1024:.1f} KiB")
+    offered_seconds = time.monotonic() - report.started
+    completed_in_window = report.completed
+    in_flight_at_stop = len(report.in_flight)
+
+    drain_started = time.monotonic()
+    if report.in_flight:
+        await asyncio.wait(set(report.in_flight), timeout=args.drain_timeout)
+    drain_seconds = time.monotonic() - drain_started
+    report.sample(history)
+    loop_lag.stop()
+    rss_end_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print_report(report, offered_seconds, completed_in_window, in_flight_at_stop, drain_seconds,
+                 len(history), loop_lag.snapshot(), rss_start_kb, rss_end_kb, stub)
+    for line in bot_module.deadline_stats.summary_lines() + bot_module.reply_mode_stats.summary_lines():
+        print(f"   {line}")
+    import llm
+    if llm.persona_cache is not None:
+        print("   [CONTEXT CACHE] " + " ".join(f"{k}={v}" for k, v in sorted(llm.persona_cache.snapshot().items())))
+    from resilience import breaker_states
+    for endpoint, state in sorted(breaker_states().items()):
+        print(f"   [BREAKER] {endpoint} " + " ".join(f"{k}={v}" for k, v in sorted(state.items())))
+
+    for task in report.in_flight:
+        task.cancel()
+    await (await memory_search.get_http_session()).close()
+    search_worker.shutdown()
+    await runner.cleanup()
+    return 0
+
+
+def print_report(report, offered_seconds, completed_in_window, in_flight_at_stop, drain_seconds,
+                 history_channels, loop_lag, rss_start_kb, rss_end_kb, stub):
+    from metrics import percentile
+
+    offered_rate = report.dispatched / offered_seconds if offered_seconds else 0.0
+    sustained_rate = completed_in_window / offered_seconds if offered_seconds else 0.0
+    history_start = report.history_samples[0][1]
+    history_end = report.history_samples[-1][1]
+    # Skip the ramp-up from an empty queue and the sample taken after draining
+    queue_growth = growth_rate(report.queue_samples[1:-1])
+    backlog_added = queue_growth * offered_seconds
+
+    print("\n" + "=" * 60)
+    print("LOAD TEST REPORT")
+    print("=" * 60)
+    print("Throughput")
+    print(f"   offered:   {report.dispatched} messages in {offered_seconds:.1f}s ({offered_rate:.2f} msg/s)")
+    print(f"   sustained: {completed_in_window} handled in the window ({sustained_rate:.2f} msg/s)")
+    print(f"   drained:   {report.completed - completed_in_window} more in {drain_seconds:.1f}s, "
+          f"{len(report.in_flight)} still running")
+    print("Queue (in-flight on_message handlers)")
+    print(f"   max={max(size for _, size in report.queue_samples)} at_stop={in_flight_at_stop} "
+          f"growth={queue_growth:+.2f}/s")
+    print("conversation_history")
+    print(f"   {history_start / 1024:.1f} KiB -> {history_end / 1024:.1f} KiB "
+          f"({growth_rate(report.history_samples) / 1024:+.2f} KiB/s, "
+          f"{history_channels} channels)")
+    print(f"   peak RSS {rss_start_kb / 1024:.0f} MiB -> {rss_end_kb / 1024:.0f} MiB")
+    print(f"Reply latency (dispatch to send, {len(report.reply_latencies)} replies)")
+    print(f"   p50={percentile(report.reply_latencies, 50) * 1000:.0f}ms "
+          f"p90={percentile(report.reply_latencies, 90) * 1000:.0f}ms "
+          f"p99={percentile(report.reply_latencies, 99) * 1000:.0f}ms "
+          f"max={max(report.reply_latencies, default=0.0) * 1000:.0f}ms")
+    print("Handler time (all messages)")
+    print(f"   p50={percentile(report.handler_latencies, 50) * 1000:.0f}ms "
+          f"p99={percentile(report.handler_latencies, 99) * 1000:.0f}ms")
+    print("Event loop")
+    print(f"   lag p50={loop_lag['p50_ms']:.1f}ms p99={loop_lag['p99_ms']:.1f}ms max={loop_lag['max_ms']:.1f}ms, "
+          f"dispatch lag p99={percentile(report.dispatch_lag, 99) * 1000:.0f}ms")
+    print("Gemini stub calls")
+    print("   " + " ".join(f"{kind}={count}" for kind, count in sorted(stub.calls.items())))
+
+    if report.in_flight or backlog_added > max(5, 0.05 * report.dispatched):
+        print(f"\nThe handler queue kept growing ({queue_growth:+.2f}/s): {offered_rate:.2f} msg/s is above capacity")
+    elif percentile(report.dispatch_lag, 99) > 1.0:
+        print(f"\nThe replay fell behind schedule: the event loop is saturated at {offered_rate:.2f} msg/s")
+    else:
+        print(f"\nKept up with {offered_rate:.2f} msg/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay exported conversations through on_message with Discord and Gemini stubbed")
+    parser.add_argument('--files', nargs='*', help=f"Export files to replay (default: everything in {DEFAULT_EXPORT_FOLDER}/)")
+    parser.add_argument('--speedup', type=float, default=20.0, help="Replay this many times faster than the conversation happened")
+    parser.add_argument('--channels', type=int, default=4, help="Channels replaying the conversation concurrently")
+    parser.add_argument('--duration', type=float, default=60.0, help="Seconds to keep offering load")
+    parser.add_argument('--messages', type=int, default=0, help="Stop after this many messages (0 = no limit)")
+    parser.add_argument('--interval', type=float, default=5.0, help="Mean seconds between messages for exports without timestamps")
+    parser.add_argument('--max-gap', type=float, default=60.0, help="Cap on the gap between two replayed messages, before speed-up")
+    parser.add_argument('--llm-latency', type=float, default=0.8, help="Mean seconds the Gemini stub takes per generateContent call")
+    parser.add_argument('--embed-latency', type=float, default=0.1, help="Mean seconds the Gemini stub takes per embedding batch")
+    parser.add_argument('--send-latency', type=float, default=0.05, help="Seconds a fake channel.send takes")
+    parser.add_argument('--reply-rate', type=float, default=0.3, help="Share of decisions the Gemini stub answers YES")
+    parser.add_argument('--sample-interval', type=float, default=5.0, help="Seconds between queue and memory samples")
+    parser.add_argument('--drain-timeout', type=float, default=30.0, help="Seconds to wait for in-flight handlers after the run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="Keep the bot's console logging on")
+    args = parser.parse_args()
+
+    if args.speedup <= 0 or args.channels < 1:
+        print("ERROR: --speedup must be positive and --channels at least 1")
+        return 1
+
+    stub_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    stub_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    stub_socket.bind(("127.0.0.1", 0))
+
+    # Must be set before the bot's modules read their configuration
+    os.environ["GEMINI_API_BASE"] = f"http://127.0.0.1:{stub_socket.getsockname()[1]}"
+    os.environ.setdefault("LLM_API_KEY", "load-test")
+    os.environ["PROCESSED_MESSAGES_DB"] = ""
+    os.environ["LIVE_INGEST"] = ""
+    if not args.verbose:
+        os.environ["LOG_CONSOLE"] = "0"
+
+    return asyncio.run(run(args, stub_socket))
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
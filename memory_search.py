@@ -1,15 +1,39 @@
 import os
 import json
+import asyncio
 import aiohttp
-from chromadb_storage import search_similar_messages
+from chromadb_storage import search_similar_messages_batch
+from search_worker import search_batch_in_worker
+from batching import MicroBatcher
+from resilience import call_with_retries, post_json, CircuitOpenError, HTTPStatusError
+from config import (
+    MEMORY_SERVICE_ADDRESS, SEARCH_WORKER_PROCESSES, SEARCH_BATCH_WINDOW_MS, SEARCH_BATCH_MAX_SIZE,
+    EMBED_BATCH_WINDOW_MS, EMBED_BATCH_MAX_SIZE, EMBED_DEADLINE_SECONDS, EMBED_MAX_ATTEMPTS,
+    RETRIEVAL_MODE, RECENCY_HALF_LIFE_DAYS, RECENCY_WEIGHT, RECENCY_WINDOWS_DAYS, EMBEDDING_PROJECTION,
+    LEXICAL_INDEX_DB, RETRIEVAL_FUSION, LEXICAL_FALLBACK_SECONDS, RRF_K, LEXICAL_MIN_SCORE, GEMINI_API_BASE,
+    MEMORY_GLOBAL_FALLBACK, MEMORY_SNAPSHOT
+)
 from utils import log
 from colorama import Fore
 
 LLM_API_KEY = os.getenv('LLM_API_KEY')
 
+# Circuit breaker name shared by every embedding call
+EMBED_ENDPOINT = "gemini-embed"
+
+# Time-decay settings passed to the vector store in recency retrieval mode
+RECENCY_SETTINGS = {
+    "half_life_days": RECENCY_HALF_LIFE_DAYS,
+    "recency_weight": RECENCY_WEIGHT,
+    "windows_days": RECENCY_WINDOWS_DAYS,
+} if RETRIEVAL_MODE == "recency" else None
+
 # Reusable aiohttp session for efficiency
 _http_session = None
 
+# Session for the shared memory service (may use a Unix socket connector)
+_service_session = None
+
 async def get_http_session():
     """Get or create a persistent aiohttp session"""
     global _http_session
@@ -17,39 +41,60 @@ async def get_http_session():
         _http_session = aiohttp.ClientSession()
     return _http_session
 
-async def generate_query_embedding(query_text):
+async def get_service_session():
+    """Get or create the session used to talk to the shared memory service"""
+    global _service_session
+    if _service_session is None or _service_session.closed:
+        from memory_service import parse_service_address
+
+        kind, target = parse_service_address(MEMORY_SERVICE_ADDRESS)
+        connector = aiohttp.UnixConnector(path=target) if kind == "unix" else None
+        _service_session = aiohttp.ClientSession(connector=connector)
+    return _service_session
+
+async def embed_texts(texts, endpoint=EMBED_ENDPOINT):
     """
-    Generate embedding for a query text using Google's embedding model.
+    Generate embeddings for several texts with one batchEmbedContents request.
     Uses persistent HTTP session for efficiency.
 
     Args:
-        query_text: The text to embed
+        texts: List of texts to embed
+        endpoint: Circuit breaker to use (background ingestion uses its own)
 
     Returns:
-        List of floats representing the embedding vector
+        List of embedding vectors, one per text
     """
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/text-embedding-004:embedContent?key={LLM_API_KEY}"
+    url = f"{GEMINI_API_BASE}/v1beta/models/text-embedding-004:batchEmbedContents?key={LLM_API_KEY}"
 
     payload = {
-        "model": "models/text-embedding-004",
-        "content": {
-            "parts": [{
-                "text": query_text
-            }]
-        }
+        "requests": [
+            {
+                "model": "models/text-embedding-004",
+                "content": {
+                    "parts": [{
+                        "text": text
+                    }]
+                }
+            }
+            for text in texts
+        ]
     }
 
     session = await get_http_session()
     try:
-        async with session.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(payload)) as resp:
-            if resp.status != 200:
-                error_text = await resp.text()
-                log(f"[ERROR] Embedding API error: {resp.status} - {error_text}", Fore.RED)
-                raise Exception(f"Embedding API error: {error_text}")
-
-            response_data = await resp.json()
-            embedding = response_data['embedding']['values']
-            return embedding
+        response_data = await call_with_retries(
+            endpoint,
+            lambda: post_json(session, url, payload),
+            max_attempts=EMBED_MAX_ATTEMPTS,
+            deadline=EMBED_DEADLINE_SECONDS
+        )
+        return [embedding['values'] for embedding in response_data['embeddings']]
+    except CircuitOpenError:
+        log("[ERROR] Embedding API unhealthy (breaker open), skipping embedding", Fore.YELLOW)
+        raise
+    except HTTPStatusError as e:
+        log(f"[ERROR] Embedding API error: {e.status} - {e.body}", Fore.RED)
+        raise
     except aiohttp.ClientError as e:
         log(f"[ERROR] Network error during embedding generation: {e}", Fore.RED)
         raise
@@ -58,36 +103,296 @@ async def generate_query_embedding(query_text):
         raise
 
 
-async def search_similar_messages_async(query_text, limit=8):
+# Groups query texts from concurrent callers into one batchEmbedContents call
+_embedding_batcher = MicroBatcher(
+    embed_texts,
+    max_batch_size=EMBED_BATCH_MAX_SIZE,
+    max_wait=EMBED_BATCH_WINDOW_MS / 1000
+)
+
+
+async def generate_query_embedding(query_text):
+    """
+    Generate embedding for a query text using Google's embedding model.
+    Concurrent calls are grouped into a single batch request unless
+    EMBED_BATCH_WINDOW_MS is 0.
+
+    Args:
+        query_text: The text to embed
+
+    Returns:
+        List of floats representing the embedding vector
+    """
+    if EMBED_BATCH_WINDOW_MS <= 0:
+        embeddings = await embed_texts([query_text])
+        return embeddings[0]
+
+    return await _embedding_batcher.submit(query_text)
+
+
+async def search_memory_service(query_embeddings, limit, projection_version=None, namespace=None):
+    """
+    Search the shared memory service used by sharded deployments.
+
+    Args:
+        query_embeddings: List of embedding vectors to search for
+        limit: Maximum number of results to return per query
+        projection_version: Version of the projection already applied to the embeddings
+        namespace: Memory namespace to search (None for the shared collection)
+
+    Returns:
+        List with one list of (message_content, similarity_score, author) tuples per query
+    """
+    from memory_service import service_base_url
+
+    session = await get_service_session()
+    url = f"{service_base_url(MEMORY_SERVICE_ADDRESS)}/search"
+    payload = {
+        "embeddings": query_embeddings,
+        "limit": limit,
+        "recency": RECENCY_SETTINGS,
+        "projection_version": projection_version,
+        "namespace": namespace,
+        "global_fallback": MEMORY_GLOBAL_FALLBACK,
+    }
+
+    async with session.post(url, json=payload) as resp:
+        if resp.status != 200:
+            error_text = await resp.text()
+            raise Exception(f"Memory service error: {resp.status} - {error_text}")
+        response_data = await resp.json()
+        return [[tuple(result) for result in results] for results in response_data["results"]]
+
+
+async def add_to_memory_service(messages, embeddings, message_ids, authors, metadatas):
+    """
+    Store new messages through the shared memory service.
+
+    Returns:
+        int: Number of messages added (excludes duplicates)
+    """
+    from memory_service import service_base_url
+
+    session = await get_service_session()
+    url = f"{service_base_url(MEMORY_SERVICE_ADDRESS)}/add"
+    payload = {
+        "messages": messages,
+        "embeddings": embeddings,
+        "ids": message_ids,
+        "authors": authors,
+        "metadatas": metadatas,
+    }
+
+    async with session.post(url, json=payload) as resp:
+        if resp.status != 200:
+            error_text = await resp.text()
+            raise Exception(f"Memory service error: {resp.status} - {error_text}")
+        response_data = await resp.json()
+        return response_data["added"]
+
+
+async def search_by_embeddings(query_embeddings, limit=8, namespace=None):
+    """
+    Search for messages similar to several embeddings using the configured backend.
+    In recency retrieval mode results are ranked with time decay.
+    Uses the shared memory service when MEMORY_SERVICE_ADDRESS is set, then the
+    dedicated search worker processes, and otherwise queries the local ChromaDB
+    store on the default thread pool. When EMBEDDING_PROJECTION is set the
+    queries are PCA-reduced first and search the reduced collection, unless
+    memory is served from a MEMORY_SNAPSHOT (which holds full-size vectors).
+
+    Args:
+        query_embeddings: List of embedding vectors to search for
+        limit: Maximum number of results to return per query
+        namespace: Memory namespace to search (None for the shared collection),
+            merged with the shared-collection messages without a guild; with
+            MEMORY_GLOBAL_FALLBACK, with the whole shared collection
+
+    Returns:
+        List with one list of (message_content, similarity_score, author) tuples per query
+    """
+    projection_version = None
+    if EMBEDDING_PROJECTION and not MEMORY_SNAPSHOT:
+        from embedding_projection import get_projection
+        projection = get_projection()
+        query_embeddings = projection.project(query_embeddings).tolist()
+        projection_version = projection.version
+
+    if MEMORY_SERVICE_ADDRESS:
+        return await search_memory_service(query_embeddings, limit, projection_version, namespace)
+
+    if SEARCH_WORKER_PROCESSES > 0:
+        return await search_batch_in_worker(
+            query_embeddings, limit, recency=RECENCY_SETTINGS, projection_version=projection_version,
+            namespace=namespace, global_fallback=MEMORY_GLOBAL_FALLBACK
+        )
+
+    # Run in executor to avoid blocking event loop (ChromaDB is synchronous)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, search_similar_messages_batch, query_embeddings, limit, RECENCY_SETTINGS, projection_version,
+        namespace, MEMORY_GLOBAL_FALLBACK
+    )
+
+
+async def _process_search_batch(requests):
+    """
+    Run coalesced searches as batched queries, one per namespace.
+    Each request is a (query_embedding, limit, namespace) tuple; each namespace
+    is queried with its largest limit and each caller's results are trimmed to
+    its own limit.
+    """
+    by_namespace = {}
+    for index, (_, _, namespace) in enumerate(requests):
+        by_namespace.setdefault(namespace, []).append(index)
+
+    async def search_namespace(namespace, indices):
+        max_limit = max(requests[i][1] for i in indices)
+        return await search_by_embeddings([requests[i][0] for i in indices], max_limit, namespace)
+
+    namespace_results = await asyncio.gather(*[
+        search_namespace(namespace, indices) for namespace, indices in by_namespace.items()
+    ])
+
+    results = [None] * len(requests)
+    for indices, batch_results in zip(by_namespace.values(), namespace_results):
+        for i, rows in zip(indices, batch_results):
+            results[i] = rows[:requests[i][1]]
+    return results
+
+
+# Coalesces searches from concurrent channels into a single ChromaDB query
+_search_batcher = MicroBatcher(
+    _process_search_batch,
+    max_batch_size=SEARCH_BATCH_MAX_SIZE,
+    max_wait=SEARCH_BATCH_WINDOW_MS / 1000
+)
+
+
+async def search_by_embedding(query_embedding, limit=8, namespace=None):
+    """
+    Search for messages similar to an embedding.
+    Concurrent calls are coalesced into one batched query per namespace
+    unless SEARCH_BATCH_WINDOW_MS is 0.
+
+    Args:
+        query_embedding: The embedding vector to search for
+        limit: Maximum number of results to return
+        namespace: Memory namespace to search (None for the shared collection)
+
+    Returns:
+        List of tuples (message_content, similarity_score, author)
+    """
+    if SEARCH_BATCH_WINDOW_MS <= 0:
+        results = await search_by_embeddings([query_embedding], limit, namespace)
+        return results[0]
+
+    return await _search_batcher.submit((query_embedding, limit, namespace))
+
+
+def _search_lexical_namespace(index, query_text, limit, namespace):
+    """
+    Search a namespace in the BM25 index together with the messages without a
+    guild, like vector search. The index files guild messages still in the
+    shared collection under their own namespace, so MEMORY_GLOBAL_FALLBACK
+    doesn't reach other guilds' messages here.
+    """
+    return index.search(query_text, limit, [namespace, None] if namespace else [None], LEXICAL_MIN_SCORE)
+
+
+async def search_lexical(query_text, limit=8, namespace=None):
     """
-    Search for messages similar to the query text using vector similarity.
-    Uses ChromaDB for local vector search without blocking the event loop.
+    Search the local BM25 index. Needs no network, so it also serves as the
+    fallback when the embedding API is slow or unavailable. Hits below
+    LEXICAL_MIN_SCORE are dropped.
+
+    Args:
+        query_text: The text to search for
+        limit: Maximum number of results to return
+        namespace: Memory namespace to search (None for the shared collection)
+
+    Returns:
+        List of tuples (message_content, None, author); lexical hits have no
+        cosine similarity
+    """
+    from lexical_index import get_lexical_index
+
+    loop = asyncio.get_running_loop()
+    try:
+        index = await loop.run_in_executor(None, get_lexical_index)
+        results = await loop.run_in_executor(None, _search_lexical_namespace, index, query_text, limit, namespace)
+    except Exception as e:
+        log(f"[ERROR] Lexical search failed: {e}", Fore.RED)
+        return []
+    return [(content, None, author) for _, content, _, author in results]
+
+
+def fuse_results(vector_results, lexical_results, limit):
+    """
+    Merge vector and lexical results with reciprocal rank fusion.
+    Messages are matched by content; a message found by both keeps its
+    vector similarity.
+
+    Returns:
+        List of tuples (message_content, similarity_score or None, author)
+    """
+    from lexical_index import reciprocal_rank_fusion
+
+    by_content = {}
+    for result in vector_results + lexical_results:
+        by_content.setdefault(result[0], result)
+
+    fused = reciprocal_rank_fusion(
+        [[content for content, _, _ in vector_results], [content for content, _, _ in lexical_results]],
+        k=RRF_K,
+        limit=limit
+    )
+    return [by_content[content] for content, _ in fused]
+
+
+async def search_similar_messages_async(query_text, limit=8, namespace=None):
+    """
+    Search for messages similar to the query text.
+    Uses ChromaDB for local vector search without blocking the event loop. In
+    hybrid mode the BM25 index is searched at the same time and both rankings
+    are fused; if the query embedding fails or takes longer than
+    LEXICAL_FALLBACK_SECONDS, the lexical results are returned alone.
 
     Args:
         query_text: The text to search for
         limit: Maximum number of results to return (default 8)
+        namespace: Memory namespace to search (None for the shared collection)
 
     Returns:
-        List of tuples (message_content, similarity_score, author)
+        List of tuples (message_content, similarity_score, author); the
+        similarity is None for messages found only by lexical search
     """
+    lexical_task = None
+    if RETRIEVAL_FUSION == "hybrid" and LEXICAL_INDEX_DB:
+        lexical_task = asyncio.create_task(search_lexical(query_text, limit, namespace))
+
     try:
         # Generate embedding for the query
-        query_embedding = await generate_query_embedding(query_text)
+        if lexical_task:
+            query_embedding = await asyncio.wait_for(generate_query_embedding(query_text), LEXICAL_FALLBACK_SECONDS)
+        else:
+            query_embedding = await generate_query_embedding(query_text)
 
-        # Use ChromaDB to search for similar messages
-        # Run in executor to avoid blocking event loop (ChromaDB is synchronous)
-        import asyncio
-        loop = asyncio.get_event_loop()
-        results = await loop.run_in_executor(None, search_similar_messages, query_embedding, limit)
-
-        return results
+        vector_results = await search_by_embedding(query_embedding, limit, namespace)
 
     except Exception as e:
+        if lexical_task:
+            log(f"[MEMORY] Vector search unavailable ({type(e).__name__}), using lexical results only", Fore.YELLOW)
+            return await lexical_task
         log(f"[ERROR] Error in search_similar_messages: {e}", Fore.RED)
         return []
 
+    if lexical_task is None:
+        return vector_results
+    return fuse_results(vector_results, await lexical_task, limit)
+
 
-async def get_relevant_memories(current_message, conversation_history, limit=40):
+async def get_relevant_memories(current_message, conversation_history, limit=40, namespace=None):
     """
     Get relevant memories based on current message and recent conversation.
 
@@ -95,6 +400,7 @@ async def get_relevant_memories(current_message, conversation_history, limit=40)
         current_message: The current message text
         conversation_history: List of recent messages for context
         limit: Number of memories to retrieve
+        namespace: Memory namespace of the conversation (None for the shared collection)
 
     Returns:
         List of relevant message strings
@@ -104,18 +410,20 @@ async def get_relevant_memories(current_message, conversation_history, limit=40)
     search_query = f"{context} {current_message}"
 
     # Search for similar messages
-    results = await search_similar_messages_async(search_query, limit)
+    results = await search_similar_messages_async(search_query, limit, namespace)
 
-    # Extract just the message content
-    memories = [content for content, similarity in results if similarity > 0.3]
+    # Extract just the message content; lexical-only hits have no similarity
+    # and already passed LEXICAL_MIN_SCORE instead
+    memories = [
+        content for content, similarity, _author in results
+        if similarity is None or similarity > 0.3
+    ]
 
     return memories
 
 
 if __name__ == '__main__':
     # Test the search function
-    import asyncio
-
     async def test():
         test_query = "what do you want to do tonight? want to play valorant?"
         print(f"Searching for messages similar to: '{test_query}'\n")
@@ -123,7 +431,8 @@ if __name__ == '__main__':
         results = await search_similar_messages_async(test_query, limit=40)
 
         print(f"Found {len(results)} similar messages:\n")
-        for i, (content, similarity) in enumerate(results, 1):
-            print(f"{i}. [Similarity: {similarity:.3f}] {content}")
+        for i, (content, similarity, _author) in enumerate(results, 1):
+            score = "lexical" if similarity is None else f"{similarity:.3f}"
+            print(f"{i}. [Similarity: {score}] {content}")
 
     asyncio.run(test())
\ No newline at end of file
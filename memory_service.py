@@ -0,0 +1,159 @@
+"""
+Shared memory retrieval service.
+Runs ChromaDB vector search in a single local process and serves it over a
+Unix socket or localhost TCP, so every bot shard queries the same vector store
+instead of each process holding its own ChromaDB handle.
+
+Usage:
+    MEMORY_SERVICE_ADDRESS=unix:/tmp/blevitron-memory.sock python memory_service.py
+    MEMORY_SERVICE_ADDRESS=127.0.0.1:8765 python memory_service.py
+"""
+
+import asyncio
+import os
+from aiohttp import web
+from colorama import Fore
+
+import config
+from chromadb_storage import search_similar_messages_batch, add_messages, namespace_stats
+from utils import log
+
+DEFAULT_SERVICE_ADDRESS = "unix:/tmp/blevitron-memory.sock"
+
+
+def parse_service_address(address):
+    """
+    Parse a memory service address.
+
+    Args:
+        address: Either "unix:/path/to.sock" or "host:port"
+
+    Returns:
+        Tuple ("unix", path) or ("tcp", (host, port))
+    """
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid memory service address: {address!r}")
+    return "tcp", (host, int(port))
+
+
+def service_base_url(address):
+    """
+    Get the HTTP base URL for a memory service address.
+    Unix socket requests still need a host in the URL; the connector ignores it.
+    """
+    kind, target = parse_service_address(address)
+    if kind == "unix":
+        return "http://localhost"
+    host, port = target
+    return f"http://{host}:{port}"
+
+
+async def handle_search(request):
+    """
+    Run vector searches for query embeddings sent by a shard.
+    Accepts either a single "embedding" or a batch of "embeddings", optional
+    "recency" settings for time-weighted ranking, an optional
+    "projection_version" when the embeddings are already PCA-reduced, and an
+    optional memory "namespace" with "global_fallback".
+    """
+    try:
+        payload = await request.json()
+        embeddings = payload["embeddings"] if "embeddings" in payload else [payload["embedding"]]
+        limit = int(payload.get("limit", 8))
+        recency = payload.get("recency")
+        projection_version = payload.get("projection_version")
+        namespace = payload.get("namespace")
+        global_fallback = bool(payload.get("global_fallback"))
+    except (ValueError, KeyError, TypeError) as e:
+        return web.json_response({"error": f"Invalid request: {e}"}, status=400)
+
+    loop = asyncio.get_running_loop()
+    batch_results = await loop.run_in_executor(
+        None, search_similar_messages_batch, embeddings, limit, recency, projection_version,
+        namespace, global_fallback
+    )
+    batch_results = [[list(result) for result in results] for results in batch_results]
+
+    if "embeddings" in payload:
+        return web.json_response({"results": batch_results})
+    return web.json_response({"results": batch_results[0]})
+
+
+async def handle_add(request):
+    """Store new messages sent by a shard's live ingestion buffer."""
+    try:
+        payload = await request.json()
+        args = (
+            payload["messages"], payload["embeddings"], payload["ids"],
+            payload.get("authors"), payload.get("metadatas")
+        )
+    except (ValueError, KeyError, TypeError) as e:
+        return web.json_response({"error": f"Invalid request: {e}"}, status=400)
+
+    loop = asyncio.get_running_loop()
+    added = await loop.run_in_executor(None, add_messages, *args)
+    return web.json_response({"added": added})
+
+
+def served_namespace_counts():
+    """Message counts per namespace of the snapshot or ChromaDB store searches run against."""
+    if config.MEMORY_SNAPSHOT:
+        from memory_snapshot import get_snapshot
+        return get_snapshot().namespace_counts()
+    return namespace_stats()
+
+
+async def handle_health(request):
+    """Report that the service is up and how many messages it serves, per namespace."""
+    loop = asyncio.get_running_loop()
+    counts = await loop.run_in_executor(None, served_namespace_counts)
+    return web.json_response({
+        "status": "ok",
+        "count": sum(counts.values()),
+        "namespaces": {namespace or "shared": count for namespace, count in counts.items()},
+    })
+
+
+def create_app():
+    """
+    Create the aiohttp application serving memory search.
+
+    Returns:
+        aiohttp.web.Application
+    """
+    app = web.Application(client_max_size=4 * 1024 * 1024)
+    app.router.add_post("/search", handle_search)
+    app.router.add_post("/add", handle_add)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+def run_service(address=None):
+    """
+    Start the memory service and block until it is stopped.
+
+    Args:
+        address: Address to listen on (defaults to MEMORY_SERVICE_ADDRESS)
+    """
+    address = address or config.MEMORY_SERVICE_ADDRESS or DEFAULT_SERVICE_ADDRESS
+    kind, target = parse_service_address(address)
+    app = create_app()
+
+    log(f"[MEMORY SERVICE] Listening on {address} ({sum(served_namespace_counts().values())} messages)", Fore.GREEN)
+
+    if kind == "unix":
+        # Remove a stale socket left behind by a previous run
+        if os.path.exists(target):
+            os.remove(target)
+        web.run_app(app, path=target, print=None)
+    else:
+        host, port = target
+        web.run_app(app, host=host, port=port, print=None)
+
+
+if __name__ == '__main__':
+    run_service()
@@ -0,0 +1,462 @@
+"""
+Portable binary snapshots of the message memory.
+A snapshot is a directory holding every collection (shared and namespaces) in
+columnar form:
+- vectors.npy: float32 embedding matrix, memory-mapped on load so opening a
+  snapshot reads no vectors until they are searched, and every process
+  serving it shares the same pages
+- records.npz: IDs, authors and timestamps as arrays, and message text and
+  remaining metadata as UTF-8 blobs with row offsets
+- manifest.json: format version, shape, the row range of each namespace and
+  the size and SHA-256 of each file
+
+Records of a namespace are stored as one contiguous block of rows, so a
+namespace search scans a slice of the matrix without copying it. Search is
+exact (brute-force cosine similarity), which needs no index to be built or
+loaded at startup.
+
+Usage:
+    python memory_snapshot.py export [--output snapshots/memory-20250101-120000]
+    python memory_snapshot.py import SNAPSHOT
+    python memory_snapshot.py verify SNAPSHOT
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+import numpy as np
+
+from config import MEMORY_SNAPSHOT, MEMORY_SNAPSHOT_VERIFY
+
+SNAPSHOT_FORMAT = "blevitron-memory-snapshot"
+SNAPSHOT_VERSION = 1
+
+VECTORS_FILE = "vectors.npy"
+RECORDS_FILE = "records.npz"
+MANIFEST_FILE = "manifest.json"
+
+# Metadata stored in columns of their own rather than in the JSON blob
+COLUMN_METADATA_KEYS = ("author", "timestamp")
+
+_snapshot = None
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pack_strings(strings):
+    """
+    Encode strings as one UTF-8 blob plus row offsets.
+
+    Returns:
+        Tuple (offsets, blob): int64 array of len(strings) + 1 offsets and a uint8 array
+    """
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(item) for item in encoded], dtype=np.int64), out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def unpack_string(offsets, blob, row):
+    return blob[offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+
+
+def export_snapshot(output, page_size=1000):
+    """
+    Write every collection of the ChromaDB store to a new snapshot directory.
+    The snapshot is assembled next to the output and renamed into place, so an
+    interrupted export never leaves a partial snapshot behind.
+
+    Args:
+        output: Snapshot directory to create (must not exist)
+        page_size: Records read per request
+
+    Returns:
+        The snapshot's manifest dict
+    """
+    from chroma_maintenance import iter_pages
+    from chromadb_storage import get_or_create_collection, list_namespaces
+
+    if os.path.exists(output):
+        raise FileExistsError(f"{output} already exists")
+    partial = f"{output}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+
+    collections = [(namespace, get_or_create_collection(namespace)) for namespace in [None] + list_namespaces()]
+    counts = [collection.count() for _, collection in collections]
+    total = sum(counts)
+    dimension = 0
+    for _, collection in collections:
+        sample = collection.get(limit=1, include=["embeddings"])
+        if sample['ids']:
+            dimension = len(sample['embeddings'][0])
+            break
+
+    # Written in place through a memory map, so the export never holds all vectors in memory
+    vectors = np.lib.format.open_memmap(
+        os.path.join(partial, VECTORS_FILE), mode="w+", dtype=np.float32, shape=(total, dimension)
+    )
+    ids, documents, authors, timestamps, extra_metadata = [], [], [], [], []
+    namespaces = []
+    row = 0
+    for (namespace, collection), expected in zip(collections, counts):
+        start = row
+        for page in iter_pages(collection, ["embeddings", "documents", "metadatas"], page_size):
+            # Messages stored during the export don't fit the matrix; the next export picks them up
+            count = min(len(page['ids']), start + expected - row)
+            if count <= 0:
+                break
+            vectors[row:row + count] = np.asarray(page['embeddings'][:count], dtype=np.float32)
+            for msg_id, document, metadata in list(zip(page['ids'], page['documents'], page['metadatas']))[:count]:
+                metadata = metadata or {}
+                ids.append(msg_id)
+                documents.append(document or "")
+                authors.append(metadata.get("author") or "")
+                timestamp = metadata.get("timestamp")
+                timestamps.append(float(timestamp) if timestamp is not None else np.nan)
+                extra = {key: value for key, value in metadata.items() if key not in COLUMN_METADATA_KEYS}
+                extra_metadata.append(json.dumps(extra, separators=(",", ":")) if extra else "")
+            row += count
+        namespaces.append({"name": namespace, "start": start, "count": row - start})
+    vectors.flush()
+    del vectors
+
+    if row < total:
+        # Records deleted during the export: rewrite the matrix at its real size
+        trimmed = np.load(os.path.join(partial, VECTORS_FILE))[:row]
+        np.save(os.path.join(partial, VECTORS_FILE), trimmed)
+
+    document_offsets, document_blob = pack_strings(documents)
+    metadata_offsets, metadata_blob = pack_strings(extra_metadata)
+    np.savez(
+        os.path.join(partial, RECORDS_FILE),
+        ids=np.array(ids, dtype=str),
+        authors=np.array(authors, dtype=str),
+        timestamps=np.array(timestamps, dtype=np.float64),
+        document_offsets=document_offsets,
+        document_blob=document_blob,
+        metadata_offsets=metadata_offsets,
+        metadata_blob=metadata_blob,
+    )
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "count": row,
+        "dimension": dimension,
+        "namespaces": namespaces,
+        "files": {
+            name: {"bytes": os.path.getsize(os.path.join(partial, name)), "sha256": file_sha256(os.path.join(partial, name))}
+            for name in (VECTORS_FILE, RECORDS_FILE)
+        },
+    }
+    with open(os.path.join(partial, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(partial, output)
+    return manifest
+
+
+def verify_files(path, manifest, checksums=True):
+    """
+    Check a snapshot's files against its manifest.
+
+    Args:
+        path: Snapshot directory
+        manifest: The snapshot's manifest dict
+        checksums: Also compare SHA-256 checksums (reads every byte)
+
+    Returns:
+        List of problem descriptions (empty if the snapshot is intact)
+    """
+    problems = []
+    for name, expected in manifest["files"].items():
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path):
+            problems.append(f"{name} is missing")
+        elif os.path.getsize(file_path) != expected["bytes"]:
+            problems.append(f"{name} is {os.path.getsize(file_path)} bytes, expected {expected['bytes']}")
+        elif checksums and file_sha256(file_path) != expected["sha256"]:
+            problems.append(f"{name} doesn't match its checksum")
+    return problems
+
+
+class MemorySnapshot:
+    """
+    A snapshot opened for searching. Vectors stay memory-mapped; message text
+    and metadata are decoded only for the rows a search returns.
+    """
+
+    def __init__(self, path, verify=False):
+        """
+        Args:
+            path: Snapshot directory
+            verify: Check file checksums before opening (file sizes are always checked)
+
+        Raises:
+            ValueError: If the snapshot has an unknown format or doesn't match its manifest
+        """
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != SNAPSHOT_FORMAT or self.manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} memory snapshot")
+        problems = verify_files(path, self.manifest, checksums=verify)
+        if problems:
+            raise ValueError(f"Snapshot {path} is damaged: {'; '.join(problems)}")
+
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        with np.load(os.path.join(path, RECORDS_FILE)) as records:
+            self.columns = {name: records[name] for name in records.files}
+        self.norms = None
+        self.ranges = {entry["name"]: (entry["start"], entry["start"] + entry["count"])
+                       for entry in self.manifest["namespaces"]}
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    def namespace_counts(self):
+        """Dictionary mapping namespace (None for the shared collection) to record count."""
+        return {name: end - start for name, (start, end) in self.ranges.items()}
+
+    def record(self, row):
+        """
+        Decode one record.
+
+        Returns:
+            Tuple (message_id, document, metadata)
+        """
+        columns = self.columns
+        raw_metadata = unpack_string(columns["metadata_offsets"], columns["metadata_blob"], row)
+        metadata = json.loads(raw_metadata) if raw_metadata else {}
+        if columns["authors"][row]:
+            metadata["author"] = str(columns["authors"][row])
+        if not np.isnan(columns["timestamps"][row]):
+            metadata["timestamp"] = float(columns["timestamps"][row])
+        return (
+            str(columns["ids"][row]),
+            unpack_string(columns["document_offsets"], columns["document_blob"], row),
+            metadata
+        )
+
+    def _norms(self):
+        # Computed on first search rather than at startup, which would read every vector
+        if self.norms is None:
+            norms = np.linalg.norm(self.vectors, axis=1)
+            norms[norms == 0] = 1.0
+            self.norms = norms
+        return self.norms
+
+    def _search_range(self, namespace, queries, limit, recency, keep=None):
+        """
+        Search one namespace's rows, keeping only records whose metadata the
+        optional keep predicate accepts.
+
+        Returns:
+            List with one entry per query, each a list of tuples
+            (score, message_content, similarity_score, author), best first
+        """
+        start, end = self.ranges.get(namespace, (0, 0))
+        if end <= start or limit <= 0:
+            return [[] for _ in queries]
+
+        # Slicing the memory map is zero-copy; only the product is materialised
+        similarities = (self.vectors[start:end] @ queries.T) / self._norms()[start:end, None]
+        scores = similarities
+        if recency:
+            half_life_days = recency.get("half_life_days", 90)
+            recency_weight = recency.get("recency_weight", 0.5)
+            timestamps = self.columns["timestamps"][start:end]
+            age_days = np.maximum(0.0, time.time() - np.nan_to_num(timestamps, nan=0.0)) / 86400
+            factors = (1 - recency_weight) + recency_weight * 0.5 ** (age_days / half_life_days)
+            # Undated messages get the floor, as in chromadb_storage.recency_factor
+            factors[np.isnan(timestamps)] = 1 - recency_weight
+            scores = similarities * factors[:, None]
+
+        k = min(limit, end - start)
+        batch_results = []
+        for query_index in range(len(queries)):
+            column = scores[:, query_index]
+            if keep:
+                # Filtered records can push the results past the top k, so rank them all
+                top = np.argsort(-column)
+            else:
+                top = np.argpartition(-column, k - 1)[:k]
+                top = top[np.argsort(-column[top])]
+            rows = []
+            for offset in top:
+                if len(rows) == k:
+                    break
+                row = start + int(offset)
+                if keep and not keep(self.record(row)[2]):
+                    continue
+                rows.append((
+                    float(column[offset]),
+                    unpack_string(self.columns["document_offsets"], self.columns["document_blob"], row),
+                    float(similarities[offset, query_index]),
+                    str(self.columns["authors"][row]) or None
+                ))
+            batch_results.append(rows)
+        return batch_results
+
+    def search(self, query_embeddings, limit=8, recency=None, namespace=None, global_fallback=False):
+        """
+        Search the snapshot like chromadb_storage.search_similar_messages_batch.
+
+        Returns:
+            List with one entry per query, each a list of tuples
+            (message_content, similarity_score, author)
+        """
+        if not len(query_embeddings):
+            return []
+        if not len(self):
+            return [[] for _ in query_embeddings]
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.shape[1] != self.vectors.shape[1]:
+            raise ValueError(f"Snapshot holds {self.vectors.shape[1]}-dim vectors, got {queries.shape[1]}-dim queries")
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1.0, norms)
+
+        batch_results = self._search_range(namespace, queries, limit, recency)
+        if namespace:
+            from chromadb_storage import record_namespace
+            keep = None if global_fallback else (lambda metadata: record_namespace(metadata) in (None, namespace))
+            shared = self._search_range(None, queries, limit, recency, keep)
+            batch_results = [
+                sorted(rows + shared_rows, key=lambda row: row[0], reverse=True)[:limit]
+                for rows, shared_rows in zip(batch_results, shared)
+            ]
+        return [[(msg, similarity, author) for _, msg, similarity, author in rows] for rows in batch_results]
+
+
+def get_snapshot():
+    """
+    Get the snapshot configured by MEMORY_SNAPSHOT, opened once per process.
+
+    Returns:
+        MemorySnapshot, or None when no snapshot is configured
+    """
+    global _snapshot
+    if _snapshot is None and MEMORY_SNAPSHOT:
+        _snapshot = MemorySnapshot(MEMORY_SNAPSHOT, verify=MEMORY_SNAPSHOT_VERIFY)
+    return _snapshot
+
+
+def import_snapshot(path, page_size=1000):
+    """
+    Merge a snapshot into the ChromaDB store: each namespace's records are
+    upserted into its collection, which is created if missing. Records with an
+    ID that is already stored are overwritten, so importing the same snapshot
+    twice is harmless, and records the snapshot doesn't have are kept. The
+    lexical and near-duplicate indexes are updated too; reduced collections
+    are rebuilt with embedding_projection.py.
+
+    Returns:
+        int: Number of records imported
+
+    Raises:
+        ValueError: If the snapshot fails verification
+    """
+    from chromadb_storage import get_or_create_collection
+    from lexical_index import get_lexical_index
+    from near_duplicates import get_near_duplicate_index
+
+    snapshot = MemorySnapshot(path, verify=True)
+    index = get_lexical_index()
+    near_duplicates = get_near_duplicate_index()
+    imported = 0
+    for namespace, (start, end) in snapshot.ranges.items():
+        collection = get_or_create_collection(namespace)
+        for page_start in range(start, end, page_size):
+            rows = range(page_start, min(page_start + page_size, end))
+            records = [snapshot.record(row) for row in rows]
+            metadatas = [metadata or None for _, _, metadata in records]
+            collection.upsert(
+                ids=[msg_id for msg_id, _, _ in records],
+                embeddings=np.asarray(snapshot.vectors[rows.start:rows.stop]),
+                documents=[document for _, document, _ in records],
+                metadatas=metadatas if any(metadatas) else None
+            )
+            if index is not None:
+                index.add(
+                    [msg_id for msg_id, _, _ in records],
+                    [document for _, document, _ in records],
+                    [metadata.get("author") for _, _, metadata in records],
+                    namespace
+                )
+            if near_duplicates is not None:
+                near_duplicates.add(
+                    [msg_id for msg_id, _, _ in records], [document for _, document, _ in records], namespace
+                )
+            imported += len(records)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, import and verify portable memory snapshots")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Write the ChromaDB store to a new snapshot")
+    export_parser.add_argument('--output', default=None,
+                               help="Snapshot directory (default: snapshots/memory-<timestamp>)")
+    export_parser.add_argument('--page-size', type=int, default=1000, help="Records read per request")
+
+    import_parser = subparsers.add_parser('import', help="Load a snapshot into the ChromaDB store")
+    import_parser.add_argument('snapshot')
+    import_parser.add_argument('--page-size', type=int, default=1000, help="Records written per request")
+
+    verify_parser = subparsers.add_parser('verify', help="Check a snapshot's checksums and open it")
+    verify_parser.add_argument('snapshot')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        output = args.output or os.path.join("snapshots", f"memory-{datetime.now():%Y%m%d-%H%M%S}")
+        print(f"Exporting memory to {output}...")
+        start = time.perf_counter()
+        manifest = export_snapshot(output, args.page_size)
+        size = sum(entry["bytes"] for entry in manifest["files"].values())
+        print(f"   {manifest['count']} records ({manifest['dimension']} dims, "
+              f"{len(manifest['namespaces']) - 1} namespaces), {size / 1024 / 1024:.1f} MB "
+              f"in {time.perf_counter() - start:.1f}s")
+        print(f"\nSet MEMORY_SNAPSHOT={output} to serve memory from it")
+
+    elif args.command == 'import':
+        print(f"Importing {args.snapshot}...")
+        try:
+            imported = import_snapshot(args.snapshot, args.page_size)
+        except ValueError as e:
+            print(f"ERROR: {e}")
+            return 1
+        print(f"   Imported {imported} records")
+        print("   Run 'python embedding_projection.py build' to fill reduced collections, if enabled")
+
+    elif args.command == 'verify':
+        start = time.perf_counter()
+        try:
+            snapshot = MemorySnapshot(args.snapshot, verify=True)
+        except ValueError as e:
+            print(f"   ✗ {e}")
+            return 1
+        verified = time.perf_counter() - start
+        start = time.perf_counter()
+        MemorySnapshot(args.snapshot)
+        print(f"   ✓ {len(snapshot)} records, {snapshot.manifest['dimension']} dims, "
+              f"created {snapshot.manifest['created_at']}")
+        for name, count in snapshot.namespace_counts().items():
+            print(f"      {name or 'shared'}: {count}")
+        print(f"   Checksums verified in {verified:.2f}s; opens in {(time.perf_counter() - start) * 1000:.1f}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
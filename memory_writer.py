@@ -0,0 +1,219 @@
+"""
+Write-behind ingestion of live Discord messages into memory.
+Incoming messages are spooled to a local SQLite file so nothing is lost on a
+crash, then flushed in batches in the background: one batch embedding request
+followed by one bulk add to the vector store. Near-duplicates of stored
+messages are dropped before embedding. Nothing here runs on the reply path.
+"""
+
+import asyncio
+import json
+import sqlite3
+from colorama import Fore
+
+from config import MEMORY_SERVICE_ADDRESS, SEARCH_WORKER_PROCESSES
+from message_parser import is_ingestible_content
+from utils import log
+
+# Separate circuit breaker so ingestion failures never trip the live retrieval one
+INGEST_EMBED_ENDPOINT = "gemini-embed-ingest"
+
+# batchEmbedContents accepts at most 100 texts per request
+MAX_EMBED_BATCH = 100
+
+
+def message_to_record(message):
+    """
+    Build a spool record from a Discord message.
+
+    Returns:
+        dict, or None if the message shouldn't be stored as a memory
+    """
+    if message.author.bot or not message.guild or not is_ingestible_content(message.content):
+        return None
+
+    return {
+        "id": str(message.id),
+        "content": message.content.strip(),
+        "author": message.author.name,
+        "author_id": str(message.author.id),
+        "guild_id": str(message.guild.id),
+        "channel_id": str(message.channel.id),
+        "channel": getattr(message.channel, "name", None),
+        "timestamp": message.created_at.timestamp(),
+    }
+
+
+async def store_batch(records, embeddings):
+    """
+    Store embedded records through the configured backend: the memory
+    service, the search workers' write process, or ChromaDB in this process.
+
+    Raises:
+        Exception: If the records weren't stored; flush keeps them spooled
+    """
+    messages = [record["content"] for record in records]
+    ids = [record["id"] for record in records]
+    authors = [record["author"] for record in records]
+    metadatas = [
+        {
+            "message_id": record["id"],
+            "timestamp": record["timestamp"],
+            "guild_id": record["guild_id"],
+            "channel_id": record["channel_id"],
+            "channel": record["channel"],
+            "author_id": record["author_id"],
+        }
+        for record in records
+    ]
+
+    if MEMORY_SERVICE_ADDRESS:
+        from memory_search import add_to_memory_service
+        return await add_to_memory_service(messages, embeddings, ids, authors, metadatas)
+
+    if SEARCH_WORKER_PROCESSES > 0:
+        from search_worker import add_in_worker
+        return await add_in_worker(messages, embeddings, ids, authors, metadatas)
+
+    from chromadb_storage import add_messages
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, add_messages, messages, embeddings, ids, authors, metadatas)
+
+
+class WriteBehindBuffer:
+    """
+    Durable spool of messages waiting to be embedded and stored.
+
+    A flush is triggered when max_batch_size messages are pending or every
+    flush_interval seconds. Flushes run under their own semaphore and a
+    separate circuit breaker, so they never compete with replies for limits.
+    """
+
+    def __init__(self, spool_path, max_batch_size=50, flush_interval=30, max_concurrency=1):
+        """
+        Args:
+            spool_path: SQLite file used as the durable spool
+            max_batch_size: Pending messages that trigger a flush
+            flush_interval: Maximum seconds between flushes
+            max_concurrency: Maximum concurrent flushes
+        """
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._wake = asyncio.Event()
+        self._task = None
+        self.stored = 0
+        self.near_duplicates = 0
+        self.failed_flushes = 0
+
+        self._db = sqlite3.connect(spool_path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, record TEXT NOT NULL)"
+        )
+        self._db.commit()
+        self.pending = self._db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def enqueue(self, message):
+        """
+        Spool a Discord message for ingestion if it is eligible.
+
+        Args:
+            message: The incoming Discord message
+
+        Returns:
+            bool: True if the message was spooled
+        """
+        record = message_to_record(message)
+        if record is None:
+            return False
+
+        self._db.execute("INSERT INTO spool (record) VALUES (?)", (json.dumps(record),))
+        self._db.commit()
+        self.pending += 1
+
+        if self.pending >= self.max_batch_size:
+            self._wake.set()
+        return True
+
+    def start(self):
+        """Start the background flusher; messages left over from a crash are flushed first."""
+        if self._task is None or self._task.done():
+            if self.pending:
+                log(f"[INGEST] Recovered {self.pending} spooled messages", Fore.MAGENTA)
+                self._wake.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def _drop_near_duplicates(self, records):
+        from chromadb_storage import namespace_for
+        from near_duplicates import get_near_duplicate_index
+
+        index = get_near_duplicate_index()
+        if index is None:
+            return records
+        loop = asyncio.get_running_loop()
+        matches = await loop.run_in_executor(
+            None, index.find_duplicates,
+            [record["id"] for record in records],
+            [record["content"] for record in records],
+            [namespace_for(record["guild_id"], record["channel_id"]) for record in records]
+        )
+        return [record for record, match in zip(records, matches) if match is None]
+
+    async def flush(self):
+        """Embed and store everything currently spooled, one batch at a time."""
+        from memory_search import embed_texts
+
+        async with self._semaphore:
+            while True:
+                rows = self._db.execute(
+                    "SELECT seq, record FROM spool ORDER BY seq LIMIT ?",
+                    (min(self.max_batch_size, MAX_EMBED_BATCH),)
+                ).fetchall()
+                if not rows:
+                    return
+
+                records = [json.loads(record) for _, record in rows]
+                try:
+                    records = await self._drop_near_duplicates(records)
+                    added = 0
+                    if records:
+                        embeddings = await embed_texts(
+                            [record["content"] for record in records],
+                            endpoint=INGEST_EMBED_ENDPOINT
+                        )
+                        added = await store_batch(records, embeddings)
+                except Exception as e:
+                    # Leave the batch spooled; the next flush retries it
+                    self.failed_flushes += 1
+                    log(f"[INGEST] Flush failed, {self.pending} messages stay spooled: {e}", Fore.YELLOW)
+                    return
+
+                last_seq = rows[-1][0]
+                self._db.execute("DELETE FROM spool WHERE seq <= ?", (last_seq,))
+                self._db.commit()
+                self.pending = max(0, self.pending - len(rows))
+                self.stored += added
+                self.near_duplicates += len(rows) - len(records)
+                log(
+                    f"[INGEST] Stored {added} new memories ({len(records) - added} already known, "
+                    f"{len(rows) - len(records)} near-duplicates skipped)",
+                    Fore.MAGENTA
+                )
+
+    def stop(self):
+        """Stop the background flusher. Spooled messages are kept for the next start."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
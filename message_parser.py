@@ -1,16 +1,41 @@
 import re
+import csv
+import json
+import hashlib
+from datetime import datetime
 from pathlib import Path
+from typing import NamedTuple, Optional
+
+
+class ExportMessage(NamedTuple):
+    """A single message from a structured (JSON/CSV) Discord export."""
+    id: str
+    timestamp: Optional[float]
+    guild_id: Optional[str]
+    channel_id: Optional[str]
+    channel: Optional[str]
+    author_id: Optional[str]
+    author: str
+    content: str
+
+
+# DiscordChatExporter message types that carry user-written content
+CONTENT_MESSAGE_TYPES = {'Default', 'Reply', 'ThreadStarterMessage'}
+
+# Matches "Guild - Channel [123456789]" style export file names
+EXPORT_FILENAME_PATTERN = re.compile(r'^(?:.* - )?(?P<channel>.+?)\s*\[(?P<channel_id>\d+)\]')
 
 def parse_legacy_discord_export(file_path):
     """
-    Parse legacy Discord export text file and extract message content with author information.
-    Skips timestamps, call logs, and header information.
+    Parse legacy Discord export text file and extract message content with
+    author information and timestamp. Skips call logs and header information.
     
     Args:
         file_path: Path to the Discord export .txt file
         
     Returns:
-        List of tuples (author, message_content)
+        List of tuples (author, message_content, timestamp), the timestamp in
+        epoch seconds (None if it can't be parsed)
     """
     messages = []
     
@@ -27,11 +52,12 @@ def parse_legacy_discord_export(file_path):
             continue
         
         # Look for message pattern: [timestamp] username
-        message_pattern = r'^\[\d+/\d+/\d+\s+\d+:\d+\s+[AP]M\]\s+(.+)$'
+        message_pattern = r'^\[(\d+/\d+/\d+\s+\d+:\d+\s+[AP]M)\]\s+(.+)$'
         match = re.match(message_pattern, line)
         
         if match:
-            username = match.group(1)
+            timestamp = parse_export_timestamp(' '.join(match.group(1).split()))
+            username = match.group(2)
             i += 1
             
             # Next line should be the message content
@@ -54,8 +80,8 @@ def parse_legacy_discord_export(file_path):
                             full_message += ' ' + next_line
                         i += 1
                     
-                    # Store as tuple of (author, message)
-                    messages.append((username, full_message))
+                    # Store as tuple of (author, message, timestamp)
+                    messages.append((username, full_message, timestamp))
                 else:
                     i += 1
             else:
@@ -68,13 +94,13 @@ def parse_legacy_discord_export(file_path):
 def parse_raw_text_file(file_path):
     """
     Parse a raw text file where each line is a message.
-    Assigns a default author name.
+    Assigns a default author name; raw lines carry no timestamp.
 
     Args:
         file_path: Path to the raw .txt file
 
     Returns:
-        List of tuples (author, message_content)
+        List of tuples (author, message_content, None)
     """
     messages = []
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -83,7 +109,7 @@ def parse_raw_text_file(file_path):
     for line in lines:
         content = line.strip()
         if content:
-            messages.append(("Unknown", content))
+            messages.append(("Unknown", content, None))
 
     return messages
 
@@ -95,7 +121,8 @@ def parse_discord_export(file_path):
         file_path: Path to the Discord export .txt file
 
     Returns:
-        List of tuples (author, message_content)
+        List of tuples (author, message_content, timestamp); the timestamp is
+        None for raw text files
     """
     with open(file_path, 'r', encoding='utf-8') as f:
         first_line = f.readline().strip()
@@ -116,6 +143,216 @@ def parse_discord_export(file_path):
         else:
             return parse_raw_text_file(file_path)
 
+def parse_export_timestamp(value):
+    """
+    Convert an export timestamp to seconds since the epoch.
+
+    Args:
+        value: ISO 8601 timestamp (as written by DiscordChatExporter) or a
+            "dd-Mon-yy hh:mm AM" style CSV date
+
+    Returns:
+        float epoch seconds, or None if the value can't be parsed
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        pass
+    for date_format in ('%d-%b-%y %I:%M %p', '%m/%d/%Y %I:%M %p'):
+        try:
+            return datetime.strptime(value, date_format).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def is_ingestible_content(content):
+    """Skip empty messages and messages that are only a link or embed."""
+    content = content.strip()
+    return bool(content) and not content.startswith('http') and not content.startswith('{Embed}')
+
+
+def channel_from_filename(file_path):
+    """
+    Get the channel name and ID from a DiscordChatExporter file name.
+
+    Returns:
+        Tuple (channel_name, channel_id), either of which may be None
+    """
+    match = EXPORT_FILENAME_PATTERN.match(Path(file_path).name)
+    if not match:
+        return None, None
+    return match.group('channel').strip(), match.group('channel_id')
+
+
+class _JSONStreamReader:
+    """
+    Minimal incremental reader for a top-level JSON object.
+    Decodes one value at a time from a sliding buffer so memory use stays
+    bounded by the largest single value rather than the whole file.
+    """
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        # Drop what has already been consumed before growing the buffer
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buffer += chunk
+
+    def peek(self):
+        """Skip whitespace and return the next character ('' at end of input)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} in JSON export")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                result, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A value touching the end of the buffer may be truncated (e.g. a number)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return result
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_discord_json_export(file_path):
+    """
+    Stream messages from a DiscordChatExporter JSON export.
+    Reads the file incrementally, so memory use does not grow with file size.
+
+    Args:
+        file_path: Path to the .json export
+
+    Yields:
+        ExportMessage records
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        reader = _JSONStreamReader(f)
+        guild = {}
+        channel = {}
+
+        reader.expect('{')
+        while reader.peek() not in ('}', ''):
+            key = reader.value()
+            reader.expect(':')
+
+            if key != 'messages':
+                value = reader.value()
+                if key == 'guild' and isinstance(value, dict):
+                    guild = value
+                elif key == 'channel' and isinstance(value, dict):
+                    channel = value
+            else:
+                reader.expect('[')
+                while reader.peek() != ']':
+                    message = reader.value()
+                    if reader.peek() == ',':
+                        reader.pos += 1
+
+                    content = message.get('content') or ''
+                    if message.get('type', 'Default') not in CONTENT_MESSAGE_TYPES or not is_ingestible_content(content):
+                        continue
+
+                    author = message.get('author') or {}
+                    yield ExportMessage(
+                        id=str(message['id']),
+                        timestamp=parse_export_timestamp(message.get('timestamp')),
+                        # DM exports have guild ID "0"
+                        guild_id=str(guild['id']) if guild.get('id') and str(guild['id']) != '0' else None,
+                        channel_id=str(channel['id']) if channel.get('id') else None,
+                        channel=channel.get('name'),
+                        author_id=str(author['id']) if author.get('id') else None,
+                        author=author.get('name') or author.get('nickname') or 'Unknown',
+                        content=content.strip()
+                    )
+                reader.expect(']')
+
+            if reader.peek() == ',':
+                reader.pos += 1
+
+
+def iter_discord_csv_export(file_path):
+    """
+    Stream messages from a DiscordChatExporter CSV export.
+    CSV exports carry no message IDs, so a stable ID is derived from the
+    author ID, timestamp and content; repeated messages sent at different
+    times keep distinct IDs.
+
+    Args:
+        file_path: Path to the .csv export
+
+    Yields:
+        ExportMessage records
+    """
+    channel, channel_id = channel_from_filename(file_path)
+
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            content = row.get('Content') or ''
+            if not is_ingestible_content(content):
+                continue
+
+            author_id = row.get('AuthorID') or None
+            date = row.get('Date') or ''
+            digest = hashlib.sha256(f"{author_id}|{date}|{content}".encode('utf-8')).hexdigest()
+
+            yield ExportMessage(
+                id=f"csv-{digest}",
+                timestamp=parse_export_timestamp(date),
+                guild_id=None,
+                channel_id=channel_id,
+                channel=channel,
+                author_id=author_id,
+                author=row.get('Author') or 'Unknown',
+                content=content.strip()
+            )
+
+
+def iter_export_records(file_path):
+    """
+    Stream typed records from a structured export, picking the parser by extension.
+
+    Args:
+        file_path: Path to a .json or .csv export
+
+    Yields:
+        ExportMessage records
+    """
+    suffix = Path(file_path).suffix.lower()
+    if suffix == '.json':
+        return iter_discord_json_export(file_path)
+    if suffix == '.csv':
+        return iter_discord_csv_export(file_path)
+    raise ValueError(f"Unsupported export format: {file_path}")
+
+
 def parse_all_files_in_folder(folder_path):
     """
     Parse all .txt files in a folder and return combined messages.
@@ -145,9 +382,9 @@ if __name__ == '__main__':
     
     print(f"\nTotal messages extracted: {len(messages)}")
     print("\nFirst 5 messages:")
-    for i, (author, msg) in enumerate(messages[:5], 1):
+    for i, (author, msg, _timestamp) in enumerate(messages[:5], 1):
         print(f"{i}. [{author}] {msg}")
     
     print("\nLast 5 messages:")
-    for i, (author, msg) in enumerate(messages[-5:], 1):
+    for i, (author, msg, _timestamp) in enumerate(messages[-5:], 1):
         print(f"{i}. [{author}] {msg}")
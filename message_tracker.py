@@ -0,0 +1,110 @@
+"""
+Idempotency tracking for processed Discord messages.
+Keeps a time-bounded set of message IDs with constant-time lookups, optionally
+backed by a SQLite table so gateway replays after a restart are still ignored.
+"""
+
+import sqlite3
+import time
+from collections import deque
+
+
+class ProcessedMessageTracker:
+    """
+    Time-bounded set of processed message IDs.
+
+    IDs live in a hash set for O(1) membership checks. A FIFO queue of
+    (expires_at, message_id) pairs drives expiry; because retention is fixed,
+    insertion order is also expiry order, so expiring is O(1) amortized.
+    """
+
+    def __init__(self, retention_seconds=3600, db_path=None):
+        """
+        Args:
+            retention_seconds: How long a message ID is remembered
+            db_path: Optional SQLite file used to persist IDs across restarts
+        """
+        self.retention_seconds = retention_seconds
+        self._seen = set()
+        self._expiry_queue = deque()
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS processed_messages ("
+                "message_id INTEGER PRIMARY KEY, expires_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_processed_messages_expires "
+                "ON processed_messages (expires_at)"
+            )
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        """Restore unexpired IDs from the SQLite table."""
+        now = time.time()
+        self._db.execute("DELETE FROM processed_messages WHERE expires_at <= ?", (now,))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT message_id, expires_at FROM processed_messages ORDER BY expires_at"
+        )
+        for message_id, expires_at in rows:
+            self._seen.add(message_id)
+            self._expiry_queue.append((expires_at, message_id))
+
+    def _expire(self, now):
+        """Drop every ID whose retention window has passed."""
+        expired = False
+        while self._expiry_queue and self._expiry_queue[0][0] <= now:
+            _, message_id = self._expiry_queue.popleft()
+            self._seen.discard(message_id)
+            expired = True
+
+        if expired and self._db is not None:
+            self._db.execute("DELETE FROM processed_messages WHERE expires_at <= ?", (now,))
+
+    def __contains__(self, message_id):
+        self._expire(time.time())
+        return message_id in self._seen
+
+    def __len__(self):
+        return len(self._seen)
+
+    def mark(self, message_id):
+        """
+        Record a message ID as processed.
+
+        Args:
+            message_id: Discord snowflake of the message
+
+        Returns:
+            bool: True if the ID was new, False if it had already been processed
+        """
+        now = time.time()
+        self._expire(now)
+
+        if message_id in self._seen:
+            return False
+
+        expires_at = now + self.retention_seconds
+        self._seen.add(message_id)
+        self._expiry_queue.append((expires_at, message_id))
+
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO processed_messages (message_id, expires_at) VALUES (?, ?)",
+                (message_id, expires_at)
+            )
+            self._db.commit()
+
+        return True
+
+    def close(self):
+        """Close the backing SQLite connection, if any."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,270 @@
+"""
+Lightweight runtime metrics for the bot.
+Tracks event loop lag so the effect of moving work off the loop (e.g. the
+out-of-process search worker) can be measured, along with reply mode
+comparisons and reply deadline misses.
+"""
+
+import asyncio
+from collections import deque
+from colorama import Fore
+from utils import log
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a sequence of numbers.
+
+    Args:
+        values: Sequence of numbers
+        pct: Percentile between 0 and 100
+
+    Returns:
+        float: The percentile value, or 0.0 for an empty sequence
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up from a fixed sleep.
+    A busy loop (blocking calls, GIL contention) shows up as lag.
+    """
+
+    def __init__(self, interval=0.25, window=1200, report_interval=60, label=""):
+        """
+        Args:
+            interval: Seconds between lag probes
+            window: Number of recent samples kept for percentiles
+            report_interval: Seconds between log reports (0 disables reporting)
+            label: Extra text included in each report
+        """
+        self.interval = interval
+        self.report_interval = report_interval
+        self.label = label
+        self.samples = deque(maxlen=window)
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            self.samples.append(max(0.0, now - start - self.interval))
+
+            if self.report_interval and now - last_report >= self.report_interval:
+                last_report = now
+                stats = self.snapshot()
+                log(
+                    f"[LOOP LAG] p50={stats['p50_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms "
+                    f"max={stats['max_ms']:.1f}ms {self.label}".rstrip(),
+                    Fore.LIGHTBLACK_EX
+                )
+
+    def start(self):
+        """Start probing on the running event loop (no-op if already running)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stop probing."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def snapshot(self):
+        """
+        Get loop lag statistics over the recent window.
+
+        Returns:
+            Dictionary with p50_ms, p99_ms, max_ms and samples
+        """
+        samples = list(self.samples)
+        return {
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+            "max_ms": max(samples, default=0.0) * 1000,
+            "samples": len(samples),
+        }
+
+
+class ReplyModeStats:
+    """
+    A/B counters comparing the two-call and combined reply modes.
+    Tracks latency, token usage and reply rate per mode.
+    """
+
+    def __init__(self, report_every=50):
+        """
+        Args:
+            report_every: Log a comparison after this many recorded decisions (0 disables)
+        """
+        self.report_every = report_every
+        self.modes = {}
+        self.fallbacks = 0
+        self._recorded = 0
+
+    def record(self, mode, latency, usage, replied):
+        """
+        Record one decided message.
+
+        Args:
+            mode: "two_call" or "combined"
+            latency: Seconds from the start of the decision to the reply being ready
+            usage: Dict with prompt_tokens, output_tokens, cached_tokens and calls
+            replied: Whether the bot replied
+        """
+        stats = self.modes.setdefault(mode, {
+            "messages": 0, "replies": 0, "calls": 0,
+            "prompt_tokens": 0, "output_tokens": 0, "cached_tokens": 0,
+            "latencies": deque(maxlen=1000),
+        })
+        stats["messages"] += 1
+        stats["replies"] += int(bool(replied))
+        stats["calls"] += usage.get("calls", 0)
+        stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        stats["output_tokens"] += usage.get("output_tokens", 0)
+        stats["cached_tokens"] += usage.get("cached_tokens", 0)
+        stats["latencies"].append(latency)
+
+        self._recorded += 1
+        if self.report_every and self._recorded % self.report_every == 0:
+            for line in self.summary_lines():
+                log(line, Fore.LIGHTBLACK_EX)
+
+    def record_fallback(self):
+        """
+        Record a combined call that fell back to the two-call path. The message
+        itself is still recorded under "combined", with the usage of both paths.
+        """
+        self.fallbacks += 1
+
+    def snapshot(self):
+        """
+        Get the comparison between modes.
+
+        Returns:
+            Dictionary mapping mode to messages, reply_rate, latency percentiles
+            and average tokens per message
+        """
+        result = {}
+        for mode, stats in self.modes.items():
+            messages = stats["messages"]
+            latencies = list(stats["latencies"])
+            result[mode] = {
+                "messages": messages,
+                "reply_rate": stats["replies"] / messages,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "calls_per_message": stats["calls"] / messages,
+                "prompt_tokens_per_message": stats["prompt_tokens"] / messages,
+                "output_tokens_per_message": stats["output_tokens"] / messages,
+                "cached_tokens_per_message": stats["cached_tokens"] / messages,
+            }
+        return result
+
+    def summary_lines(self):
+        """Format the comparison as log lines."""
+        lines = []
+        for mode, stats in sorted(self.snapshot().items()):
+            lines.append(
+                f"[REPLY MODE] {mode}: n={stats['messages']} reply_rate={stats['reply_rate']:.0%} "
+                f"p50={stats['p50_ms']:.0f}ms p99={stats['p99_ms']:.0f}ms "
+                f"tokens in/out={stats['prompt_tokens_per_message']:.0f}/{stats['output_tokens_per_message']:.0f}"
+                + (f" cached={stats['cached_tokens_per_message']:.0f}" if stats['cached_tokens_per_message'] else "")
+            )
+        if self.fallbacks:
+            lines.append(f"[REPLY MODE] combined fallbacks to two calls: {self.fallbacks} (counted under combined)")
+        return lines
+
+
+class DeadlineStats:
+    """
+    Counters for the per-message latency SLO: stage budget misses,
+    degradations taken to stay within budget, and end-to-end latency.
+    """
+
+    def __init__(self, report_every=100):
+        """
+        Args:
+            report_every: Log a summary after this many recorded messages (0 disables)
+        """
+        self.report_every = report_every
+        self.stages = {}
+        self.degradations = {}
+        self.messages = 0
+        self.slo_misses = 0
+        self.latencies = deque(maxlen=1000)
+
+    def record_stage(self, stage, elapsed, budget):
+        """
+        Record one run of a pipeline stage against its budget.
+
+        Args:
+            stage: "retrieval", "decision" or "generation"
+            elapsed: Seconds the stage took
+            budget: Seconds the stage was allowed
+        """
+        stats = self.stages.setdefault(stage, {"runs": 0, "missed": 0})
+        stats["runs"] += 1
+        # Small tolerance so a stage cut off exactly at its budget still counts as a miss
+        if elapsed >= budget - 0.001:
+            stats["missed"] += 1
+
+    def record_degradation(self, kind):
+        """Record a fallback taken to stay within budget (e.g. "cached_memories")."""
+        self.degradations[kind] = self.degradations.get(kind, 0) + 1
+
+    def record_message(self, latency, slo_seconds):
+        """
+        Record a message that went through the reply pipeline.
+
+        Args:
+            latency: Seconds from arrival until the reply was sent or declined
+            slo_seconds: The end-to-end budget it had
+        """
+        self.messages += 1
+        self.slo_misses += int(latency > slo_seconds)
+        self.latencies.append(latency)
+
+        if self.report_every and self.messages % self.report_every == 0:
+            for line in self.summary_lines():
+                log(line, Fore.LIGHTBLACK_EX)
+
+    def snapshot(self):
+        """
+        Get the deadline statistics.
+
+        Returns:
+            Dictionary with message and SLO miss counts, latency percentiles,
+            per-stage runs and misses, and degradation counts
+        """
+        latencies = list(self.latencies)
+        return {
+            "messages": self.messages,
+            "slo_misses": self.slo_misses,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "stages": {stage: dict(stats) for stage, stats in self.stages.items()},
+            "degradations": dict(self.degradations),
+        }
+
+    def summary_lines(self):
+        """Format the statistics as log lines."""
+        stats = self.snapshot()
+        lines = [
+            f"[DEADLINE] messages={stats['messages']} slo_misses={stats['slo_misses']} "
+            f"p50={stats['p50_ms']:.0f}ms p99={stats['p99_ms']:.0f}ms"
+        ]
+        for stage, counts in sorted(stats["stages"].items()):
+            lines.append(f"[DEADLINE] {stage}: missed {counts['missed']}/{counts['runs']}")
+        if stats["degradations"]:
+            degraded = " ".join(f"{kind}={count}" for kind, count in sorted(stats["degradations"].items()))
+            lines.append(f"[DEADLINE] degraded: {degraded}")
+        return lines
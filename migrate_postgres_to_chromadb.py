@@ -1,9 +1,19 @@
 """
 Migration script to transfer message embeddings from PostgreSQL to ChromaDB.
-This is a one-time migration to move your existing data to local file-based storage.
+Streams rows with a server-side cursor, converts vectors with NumPy, and writes
+to ChromaDB from a pool of writer threads, so memory use stays constant no
+matter how large the table is. Progress is checkpointed by primary key, so an
+interrupted migration resumes where it stopped.
+
+Usage:
+    python migrate_postgres_to_chromadb.py [--reset] [--batch-size 1000] [--workers 2]
 """
 
+import argparse
+import json
 import os
+import queue
+import threading
 import psycopg2
 from pgvector.psycopg2 import register_vector
 import numpy as np
@@ -11,132 +21,204 @@ from chromadb_storage import add_messages, get_collection_count, reset_collectio
 import hashlib
 
 DATABASE_URL = os.getenv('DATABASE_URL')
+DEFAULT_CHECKPOINT_FILE = 'migration_checkpoint.json'
+
+
+def load_checkpoint(checkpoint_file):
+    """
+    Load the last fully migrated primary key.
+
+    Returns:
+        Tuple (last_id, migrated_count); last_id is None when starting fresh
+    """
+    if not os.path.exists(checkpoint_file):
+        return None, 0
+    with open(checkpoint_file, 'r') as f:
+        checkpoint = json.load(f)
+    return checkpoint.get('last_id'), checkpoint.get('migrated', 0)
+
+
+def save_checkpoint(checkpoint_file, last_id, migrated):
+    """Atomically record the last fully migrated primary key."""
+    tmp_file = f"{checkpoint_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump({'last_id': last_id, 'migrated': migrated}, f)
+    os.replace(tmp_file, checkpoint_file)
 
 
-def migrate_postgres_to_chromadb():
+def rows_to_batch(rows):
+    """
+    Convert fetched rows into a batch ready for ChromaDB.
+    pgvector already returns float32 NumPy arrays, which are stacked into one
+    matrix and handed to ChromaDB without converting to Python lists.
+
+    Args:
+        rows: List of (primary_key, content, embedding) tuples
+
+    Returns:
+        Tuple (messages, embeddings_matrix, message_ids)
+    """
+    messages = []
+    vectors = []
+    for _, content, embedding in rows:
+        messages.append(content)
+        if isinstance(embedding, str):
+            # Parse string format if the vector type wasn't registered
+            embedding = np.array(embedding.strip('[]').split(','), dtype=np.float32)
+        vectors.append(np.asarray(embedding, dtype=np.float32))
+
+    # Generate ID from content hash
+    message_ids = [hashlib.sha256(content.encode('utf-8')).hexdigest() for content in messages]
+    return messages, np.stack(vectors), message_ids
+
+
+def migrate_postgres_to_chromadb(batch_size=1000, workers=2, reset=False,
+                                 checkpoint_file=DEFAULT_CHECKPOINT_FILE, resume=True,
+                                 pk_column='id'):
     """
     Migrate all message embeddings from PostgreSQL to ChromaDB.
+
+    Args:
+        batch_size: Rows fetched from PostgreSQL and written to ChromaDB at a time
+        workers: Number of threads writing batches to ChromaDB in parallel
+        reset: Reset the ChromaDB collection before migrating
+        checkpoint_file: File recording the last fully migrated primary key
+        resume: Continue from the checkpoint if one exists
+        pk_column: Primary key column used for ordering and checkpoints
     """
     print("Starting migration from PostgreSQL to ChromaDB...")
     print("=" * 60)
-    
+
     if not DATABASE_URL:
         print("ERROR: DATABASE_URL not found in environment variables")
         print("Make sure PostgreSQL database is available")
         return
-    
+
+    if reset:
+        reset_collection()
+        print("   ChromaDB collection reset")
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+
+    last_id, migrated_count = load_checkpoint(checkpoint_file) if resume else (None, 0)
+    if last_id is not None:
+        print(f"   Resuming after {pk_column} {last_id} ({migrated_count} messages already migrated)")
+    elif get_collection_count() > 0:
+        print(f"   ChromaDB already contains {get_collection_count()} messages; duplicates will be skipped")
+
     # Connect to PostgreSQL
     print("\n1. Connecting to PostgreSQL...")
     conn = psycopg2.connect(DATABASE_URL)
     register_vector(conn)
-    cursor = conn.cursor()
-    
-    # Get total count
-    cursor.execute("SELECT COUNT(*) FROM message_embeddings WHERE embedding IS NOT NULL")
-    total_count = cursor.fetchone()[0]
-    print(f"   Found {total_count} messages in PostgreSQL")
-    
-    # Fetch all messages and embeddings
-    print("\n2. Fetching messages and embeddings...")
-    cursor.execute("""
-        SELECT content, embedding 
-        FROM message_embeddings 
-        WHERE embedding IS NOT NULL
-    """)
-    
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    print(f"   Retrieved {len(rows)} messages")
-    
-    if not rows:
-        print("\n   No data to migrate!")
-        return
-    
-    # Prepare data for ChromaDB
-    print("\n3. Preparing data for ChromaDB...")
-    messages = []
-    embeddings = []
-    message_ids = []
-    
-    for content, embedding in rows:
-        messages.append(content)
-        # Convert pgvector to list
-        if isinstance(embedding, str):
-            # Parse string format if needed
-            embedding = [float(x) for x in embedding.strip('[]').split(',')]
-        elif hasattr(embedding, 'tolist'):
-            embedding = embedding.tolist()
-        elif not isinstance(embedding, list):
-            embedding = list(embedding)
-        
-        embeddings.append(embedding)
-        
-        # Generate ID from content hash
-        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
-        message_ids.append(content_hash)
-    
-    print(f"   Prepared {len(messages)} messages for migration")
-    
-    # Check if ChromaDB already has data
-    existing_count = get_collection_count()
-    if existing_count > 0:
-        print(f"\n   WARNING: ChromaDB already contains {existing_count} messages")
-        response = input("   Do you want to reset ChromaDB before migration? (yes/no): ")
-        if response.lower() == 'yes':
-            reset_collection()
-            print("   ChromaDB collection reset")
-    
-    # Migrate to ChromaDB in batches
-    print("\n4. Migrating to ChromaDB...")
-    batch_size = 100
-    migrated_count = 0
-    
-    for i in range(0, len(messages), batch_size):
-        batch_messages = messages[i:i+batch_size]
-        batch_embeddings = embeddings[i:i+batch_size]
-        batch_ids = message_ids[i:i+batch_size]
-        
-        # Deduplicate within the batch itself
-        seen_ids = {}
-        dedup_messages = []
-        dedup_embeddings = []
-        dedup_ids = []
-        
-        for j, msg_id in enumerate(batch_ids):
-            if msg_id not in seen_ids:
-                seen_ids[msg_id] = True
-                dedup_messages.append(batch_messages[j])
-                dedup_embeddings.append(batch_embeddings[j])
-                dedup_ids.append(msg_id)
-        
-        if dedup_messages:
+
+    where = "embedding IS NOT NULL"
+    params = ()
+    if last_id is not None:
+        where += f" AND {pk_column} > %s"
+        params = (last_id,)
+
+    with conn.cursor() as count_cursor:
+        count_cursor.execute(f"SELECT COUNT(*) FROM message_embeddings WHERE {where}", params)
+        total_count = count_cursor.fetchone()[0]
+    print(f"   Found {total_count} messages left to migrate")
+
+    # Writer stage: threads pull converted batches off a bounded queue, so the
+    # reader never gets more than a few batches ahead
+    print("\n2. Streaming messages into ChromaDB...")
+    batches = queue.Queue(maxsize=workers * 2)
+    lock = threading.Lock()
+    completed = {}
+    state = {'next_seq': 0, 'last_id': last_id, 'migrated': migrated_count, 'errors': 0}
+
+    def writer():
+        while True:
+            item = batches.get()
+            if item is None:
+                return
+            seq, batch_last_id, rows = item
             try:
-                added = add_messages(dedup_messages, dedup_embeddings, dedup_ids)
-                migrated_count += added
-                print(f"   Migrated {migrated_count} unique messages so far...")
+                messages, embeddings, message_ids = rows_to_batch(rows)
+                # add_messages raises when ChromaDB fails to store the batch,
+                # so 0 here only means every message was already migrated
+                added = add_messages(messages, embeddings, message_ids)
             except Exception as e:
-                print(f"   Error migrating batch: {e}")
-                continue
-    
+                print(f"   Error migrating batch ending at {pk_column} {batch_last_id}: {e}")
+                with lock:
+                    state['errors'] += 1
+                added = None
+
+            with lock:
+                completed[seq] = (batch_last_id, added)
+                # Advance the checkpoint only over a contiguous run of finished
+                # batches, and stop at the first failed one so it is retried
+                while state['next_seq'] in completed and completed[state['next_seq']][1] is not None:
+                    done_last_id, done_added = completed.pop(state['next_seq'])
+                    state['next_seq'] += 1
+                    state['last_id'] = done_last_id
+                    state['migrated'] += done_added
+                    save_checkpoint(checkpoint_file, state['last_id'], state['migrated'])
+                print(f"   Migrated {state['migrated']} unique messages so far (checkpoint {pk_column} {state['last_id']})")
+
+    threads = [threading.Thread(target=writer, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    # Reader stage: a named cursor keeps the result set on the server
+    try:
+        with conn.cursor(name='message_embeddings_migration') as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(
+                f"SELECT {pk_column}, content, embedding FROM message_embeddings "
+                f"WHERE {where} ORDER BY {pk_column}",
+                params
+            )
+            seq = 0
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batches.put((seq, rows[-1][0], rows))
+                seq += 1
+    finally:
+        for _ in threads:
+            batches.put(None)
+        for thread in threads:
+            thread.join()
+        conn.close()
+
     # Verify migration
-    print("\n5. Verifying migration...")
+    print("\n3. Verifying migration...")
     final_count = get_collection_count()
     print(f"   ChromaDB now contains {final_count} messages")
-    
+
     print("\n" + "=" * 60)
     print(f"MIGRATION COMPLETE!")
-    print(f"  PostgreSQL: {total_count} messages")
+    print(f"  Rows read this run: {total_count}")
+    print(f"  Unique messages migrated (all runs): {state['migrated']}")
     print(f"  ChromaDB:   {final_count} messages")
     print("=" * 60)
-    
-    if final_count == total_count:
-        print("\n✓ All messages migrated successfully!")
+
+    if state['errors']:
+        print(f"\n⚠ {state['errors']} batches failed; run again to resume from {pk_column} {state['last_id']}")
     else:
-        print(f"\n⚠ Warning: Migrated {final_count}/{total_count} messages")
-        print("  Some duplicates may have been skipped")
+        print("\n✓ All messages migrated successfully! Duplicates were skipped.")
 
 
 if __name__ == '__main__':
-    migrate_postgres_to_chromadb()
+    parser = argparse.ArgumentParser(description="Migrate message embeddings from PostgreSQL to ChromaDB")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Rows fetched and written per batch")
+    parser.add_argument('--workers', type=int, default=2, help="Parallel ChromaDB writer threads")
+    parser.add_argument('--reset', action='store_true', help="Reset the ChromaDB collection and checkpoint first")
+    parser.add_argument('--no-resume', dest='resume', action='store_false', help="Ignore an existing checkpoint")
+    parser.add_argument('--checkpoint-file', default=DEFAULT_CHECKPOINT_FILE, help="Where progress is recorded")
+    parser.add_argument('--pk-column', default='id', help="Primary key column of message_embeddings")
+    args = parser.parse_args()
+
+    migrate_postgres_to_chromadb(
+        batch_size=args.batch_size,
+        workers=args.workers,
+        reset=args.reset,
+        checkpoint_file=args.checkpoint_file,
+        resume=args.resume,
+        pk_column=args.pk_column
+    )
@@ -0,0 +1,316 @@
+"""
+Near-duplicate filter for ingestion.
+Each message gets a MinHash signature of its character 3-grams, and
+signatures are indexed with locality-sensitive hashing (bands of the
+signature hashed into buckets) in a SQLite file next to the vector store.
+Ingestion checks new messages against the index before embedding them, and
+skips any whose estimated Jaccard similarity to a stored message of the same
+namespace reaches NEAR_DUP_THRESHOLD: variants like "lmaooo"/"lmaoooo",
+repeated copypasta with small edits, and the same short reply sent many times.
+add_messages records the signatures of everything it stores.
+
+Usage:
+    python near_duplicates.py build                 # index messages already in ChromaDB
+    python near_duplicates.py check "lmaoooo" [--namespace g123]
+"""
+
+import argparse
+import hashlib
+import re
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+import numpy as np
+
+from config import NEAR_DUP_INDEX_DB, NEAR_DUP_THRESHOLD, NEAR_DUP_NUM_PERM
+
+SHINGLE_SIZE = 3
+
+# Modulus of the universal hash family the MinHash permutations are drawn from
+MERSENNE_PRIME = (1 << 61) - 1
+
+# Seed of the permutations; signatures from different seeds can't be compared
+PERMUTATION_SEED = 1
+
+# Rough characters per token, used to estimate the embedding input saved
+CHARS_PER_TOKEN = 4
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+_index = None
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    Character n-grams of a message, lowercased with whitespace collapsed.
+    Runs of a repeated character produce the same n-grams however long they
+    are, so "lmaooo" and "lmaoooooo" have identical sets.
+
+    Returns:
+        set of strings (the whole text if it is shorter than size)
+    """
+    normalized = WHITESPACE_PATTERN.sub(" ", text.lower()).strip()
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def choose_bands(num_perm, threshold, recall=0.95):
+    """
+    Split a signature into bands for LSH.
+    Two signatures with similarity s share a bucket (all rows of some band
+    match) with probability 1 - (1 - s ** rows) ** bands. Picks the most
+    selective split (fewest candidates) that still finds a pair at exactly the
+    threshold with the given probability; candidates are then checked against
+    the threshold.
+
+    Returns:
+        Tuple (bands, rows)
+    """
+    splits = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    eligible = [(bands, rows) for bands, rows in splits if 1 - (1 - threshold ** rows) ** bands >= recall]
+    return max(eligible, key=lambda split: split[1]) if eligible else splits[0]
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures and LSH buckets stored in SQLite.
+
+    Like the lexical index, several processes may write to the same file, and
+    documents record their memory namespace so duplicates are only looked for
+    among messages searches would return alongside them.
+    """
+
+    def __init__(self, db_path, threshold=NEAR_DUP_THRESHOLD, num_perm=NEAR_DUP_NUM_PERM):
+        """
+        Args:
+            db_path: SQLite file holding the index
+            threshold: Estimated Jaccard similarity at which a message counts as a duplicate
+            num_perm: MinHash signature length (fixed when the index is created)
+
+        Raises:
+            ValueError: If the index was created with a different signature length
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        rng = np.random.default_rng(PERMUTATION_SEED)
+        self._a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.stats = Counter()
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "doc_id TEXT PRIMARY KEY, namespace TEXT, signature BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "bucket INTEGER NOT NULL, doc_id TEXT NOT NULL, PRIMARY KEY (bucket, doc_id)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+        )
+        # The banding is chosen for the threshold the index is created with and
+        # kept afterwards; a changed threshold only changes the final check
+        bands, _ = choose_bands(num_perm, threshold)
+        self._db.execute("INSERT OR IGNORE INTO settings VALUES ('num_perm', ?), ('bands', ?)", (num_perm, bands))
+        self._db.commit()
+
+        settings = dict(self._db.execute("SELECT name, value FROM settings"))
+        if settings["num_perm"] != num_perm:
+            raise ValueError(
+                f"{db_path} was built with {settings['num_perm']}-value signatures, not {num_perm}; "
+                "delete it and run `python near_duplicates.py build`"
+            )
+        self.bands = settings["bands"]
+        self.rows = num_perm // self.bands
+
+    def signature(self, text):
+        """MinHash signature of a message as a uint32 array of num_perm values."""
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)], dtype=np.uint64)
+        # Products wrap modulo 2**64 before the reduction, as in common MinHash implementations
+        permuted = (np.outer(hashes, self._a) + self._b) % np.uint64(MERSENNE_PRIME)
+        return (permuted & np.uint64(0xFFFFFFFF)).min(axis=0).astype(np.uint32)
+
+    def _buckets(self, signature):
+        buckets = []
+        for band in range(self.bands):
+            digest = hashlib.blake2b(
+                signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8, person=band.to_bytes(8, "little")
+            ).digest()
+            buckets.append(int.from_bytes(digest, "little", signed=True))
+        return buckets
+
+    def similarity(self, first, second):
+        """Estimated Jaccard similarity of two signatures."""
+        return float(np.count_nonzero(first == second)) / self.num_perm
+
+    def _best_stored_match(self, doc_id, namespace, signature, buckets):
+        placeholders = ", ".join("?" * len(buckets))
+        best_id, best_similarity = None, 0.0
+        for candidate_id, blob in self._db.execute(
+            "SELECT DISTINCT s.doc_id, s.signature FROM buckets b JOIN signatures s ON s.doc_id = b.doc_id "
+            f"WHERE b.bucket IN ({placeholders}) AND s.namespace IS ? AND s.doc_id IS NOT ?",
+            (*buckets, namespace, doc_id)
+        ):
+            similarity = self.similarity(signature, np.frombuffer(blob, dtype=np.uint32))
+            if similarity > best_similarity:
+                best_id, best_similarity = candidate_id, similarity
+        return best_id, best_similarity
+
+    def find_duplicates(self, doc_ids, texts, namespaces=None):
+        """
+        Check messages against the index and against each other.
+        Nothing is recorded; add_messages indexes the messages that get stored.
+
+        Args:
+            doc_ids: List of message IDs (a stored message never matches itself)
+            texts: List of message texts
+            namespaces: Optional list with the namespace of each message
+
+        Returns:
+            List with, per message, the ID of the message it duplicates, or None to store it
+        """
+        namespaces = namespaces or [None] * len(doc_ids)
+        results = []
+        batch_buckets = {}
+        with self._lock:
+            for doc_id, text, namespace in zip(doc_ids, texts, namespaces):
+                signature = self.signature(text)
+                buckets = self._buckets(signature)
+                match, similarity = self._best_stored_match(doc_id, namespace, signature, buckets)
+
+                # Earlier messages of this batch aren't stored yet
+                for bucket in buckets:
+                    for other_id, other_signature in batch_buckets.get((namespace, bucket), []):
+                        other_similarity = self.similarity(signature, other_signature)
+                        if other_id != doc_id and other_similarity > similarity:
+                            match, similarity = other_id, other_similarity
+
+                self.stats["checked"] += 1
+                if match is not None and similarity >= self.threshold:
+                    self.stats["duplicates"] += 1
+                    self.stats["duplicate_chars"] += len(text)
+                    results.append(match)
+                    continue
+                for bucket in buckets:
+                    batch_buckets.setdefault((namespace, bucket), []).append((doc_id, signature))
+                results.append(None)
+        return results
+
+    def add(self, doc_ids, texts, namespace=None):
+        """
+        Index stored messages. Messages already in the index are skipped.
+
+        Returns:
+            int: Number of messages indexed
+        """
+        added = 0
+        with self._lock, self._db:
+            for doc_id, text in zip(doc_ids, texts):
+                signature = self.signature(text)
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO signatures VALUES (?, ?, ?)", (doc_id, namespace, signature.tobytes())
+                )
+                if not cursor.rowcount:
+                    continue
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO buckets VALUES (?, ?)",
+                    [(bucket, doc_id) for bucket in self._buckets(signature)]
+                )
+                added += 1
+        return added
+
+    def set_namespace(self, doc_ids, namespace):
+        """Record that messages moved to another namespace."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE signatures SET namespace = ? WHERE doc_id = ?",
+                [(namespace, doc_id) for doc_id in doc_ids]
+            )
+
+    def count(self):
+        """Number of indexed messages."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def savings_summary(self):
+        """
+        Describe what the filter saved since the process started.
+
+        Returns:
+            str, e.g. "skipped 120 of 2000 messages (6.0%) as near-duplicates, ~1500 embedding tokens saved"
+        """
+        checked = self.stats["checked"]
+        duplicates = self.stats["duplicates"]
+        share = duplicates / checked if checked else 0.0
+        return (
+            f"skipped {duplicates} of {checked} messages ({share:.1%}) as near-duplicates, "
+            f"~{self.stats['duplicate_chars'] // CHARS_PER_TOKEN} embedding tokens saved"
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def get_near_duplicate_index():
+    """
+    Get the process-wide near-duplicate index.
+
+    Returns:
+        NearDuplicateIndex, or None when NEAR_DUP_INDEX_DB is empty (filter disabled)
+    """
+    global _index
+    if _index is None and NEAR_DUP_INDEX_DB:
+        _index = NearDuplicateIndex(NEAR_DUP_INDEX_DB)
+    return _index
+
+
+def build_from_collection(page_size=1000):
+    """
+    Index every message already stored in ChromaDB.
+
+    Returns:
+        int: Number of messages newly indexed
+    """
+    from chroma_maintenance import iter_pages
+    from chromadb_storage import get_or_create_collection, list_namespaces
+
+    index = get_near_duplicate_index()
+    added = 0
+    for namespace in [None] + list_namespaces():
+        for page in iter_pages(get_or_create_collection(namespace), ["documents"], page_size):
+            added += index.add(page['ids'], [document or "" for document in page['documents']], namespace)
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the near-duplicate index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="Index messages already stored in ChromaDB")
+    check_parser = subparsers.add_parser('check', help="Check whether a message would be skipped")
+    check_parser.add_argument('text')
+    check_parser.add_argument('--namespace', default=None, help="Namespace to check in (default: shared collection)")
+    args = parser.parse_args()
+
+    index = get_near_duplicate_index()
+    if index is None:
+        print("ERROR: NEAR_DUP_INDEX_DB is empty, the near-duplicate filter is disabled")
+        return 1
+
+    if args.command == 'build':
+        print("Indexing stored messages...")
+        print(f"   Indexed {build_from_collection()} new messages ({index.count()} total)")
+    elif args.command == 'check':
+        signature = index.signature(args.text)
+        match, similarity = index._best_stored_match(None, args.namespace, signature, index._buckets(signature))
+        if match is not None and similarity >= index.threshold:
+            print(f"Near-duplicate of {match} (estimated similarity {similarity:.2f} >= {index.threshold})")
+        else:
+            print(f"Would be stored (closest candidate: {similarity:.2f}, threshold {index.threshold})")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
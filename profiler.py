@@ -0,0 +1,340 @@
+"""
+On-demand runtime profiling, started by admins with the /profile slash command.
+A session runs for a number of seconds or handled messages and records:
+- where time goes, with either a statistical stack sampler (a background
+  thread reading every thread's stack) or cProfile on the event loop thread
+- asyncio task traces: how many tasks are alive and where they are waiting
+- event loop lag
+
+Results are written to PROFILE_OUTPUT_DIR: collapsed stacks (.folded, for
+flamegraph.pl or speedscope) or a pstats dump (.prof, for snakeviz), a
+top-functions summary (-top.txt) and the task and lag traces (-trace.json).
+
+Nothing is installed while no session is active: no sampler thread, no profile
+hook and no probes. The only cost is bot.py checking active_session per message.
+"""
+
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from config import PROFILE_OUTPUT_DIR, PROFILE_SAMPLE_INTERVAL_MS, PROFILE_MAX_SECONDS
+from metrics import LoopLagMonitor, percentile
+
+PROFILE_MODES = ("sampler", "cprofile")
+
+# Seconds between asyncio task snapshots
+TASK_TRACE_INTERVAL = 1.0
+
+# Seconds between loop lag probes while profiling
+LAG_PROBE_INTERVAL = 0.05
+
+TOP_FUNCTIONS = 25
+
+# The running session, if any
+active_session = None
+
+
+def frame_label(frame):
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    # ";" separates frames in the collapsed stack format
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def frame_stack(frame):
+    """Labels of a frame and its callers, outermost first."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+
+def describe_task(task):
+    """Name a task by its coroutine and the innermost coroutine it is waiting in."""
+    coro = task.get_coro()
+    outer = getattr(coro, "__qualname__", type(coro).__name__)
+    inner = coro
+    while hasattr(getattr(inner, "cr_await", None), "cr_frame"):
+        inner = inner.cr_await
+    frame = getattr(inner, "cr_frame", None)
+    if inner is coro or frame is None:
+        return outer
+    return f"{outer} @ {inner.__qualname__}:{frame.f_lineno}"
+
+
+class StackSampler:
+    """
+    Background thread that periodically records the Python stack of every
+    other thread. Sampling from outside means the profiled code runs unmodified,
+    and blocking calls show up as time spent in them.
+    """
+
+    def __init__(self, interval):
+        """
+        Args:
+            interval: Seconds between samples
+        """
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.stacks[(names.get(thread_id, str(thread_id)),) + frame_stack(frame)] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write_folded(self, path):
+        """Write collapsed stacks: one "thread;outer;...;inner count" line per stack."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+    def top_functions(self, thread_name, limit=TOP_FUNCTIONS):
+        """
+        Rank functions on one thread by samples.
+
+        Returns:
+            Tuple (thread_samples, rows) where rows are (label, self_samples,
+            total_samples) tuples, busiest first by own samples
+        """
+        own = Counter()
+        total = Counter()
+        thread_samples = 0
+        for stack, count in self.stacks.items():
+            if stack[0] != thread_name or len(stack) < 2:
+                continue
+            thread_samples += count
+            own[stack[-1]] += count
+            for label in set(stack[1:]):
+                total[label] += count
+        return thread_samples, [(label, count, total[label]) for label, count in own.most_common(limit)]
+
+
+class ProfileSession:
+    """One profiling run, stopped by a timer, a message count or stop()."""
+
+    def __init__(self, mode="sampler", seconds=30, messages=0,
+                 output_dir=PROFILE_OUTPUT_DIR, sample_interval=PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        """
+        Args:
+            mode: "sampler" (statistical, all threads) or "cprofile" (deterministic, event loop thread)
+            seconds: Maximum duration
+            messages: Stop after this many handled messages (0 = duration only)
+            output_dir: Directory the results are written to
+            sample_interval: Seconds between stack samples in sampler mode
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}, expected one of {PROFILE_MODES}")
+        self.mode = mode
+        self.seconds = seconds
+        self.message_limit = messages
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.messages = 0
+        self.started_at = datetime.now()
+        self._started = None
+        self._loop_thread_name = None
+        self._sampler = None
+        self._profile = None
+        self._lag_monitor = None
+        self._task_tracer = None
+        self._task_samples = []
+        self._done = asyncio.Event()
+
+    def start(self):
+        """Install the profiler and probes. Must be called on the event loop thread."""
+        self._started = time.monotonic()
+        self._loop_thread_name = threading.current_thread().name
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler(self.sample_interval)
+            self._sampler.start()
+        self._lag_monitor = LoopLagMonitor(
+            interval=LAG_PROBE_INTERVAL,
+            window=int(self.seconds / LAG_PROBE_INTERVAL) + 1,
+            report_interval=0
+        )
+        self._lag_monitor.start()
+        self._task_tracer = asyncio.create_task(self._trace_tasks())
+
+    def record_message(self):
+        """Count a handled message, ending the session once the limit is reached."""
+        self.messages += 1
+        if self.message_limit and self.messages >= self.message_limit:
+            self._done.set()
+
+    def stop(self):
+        """End the session early."""
+        self._done.set()
+
+    def close(self):
+        """
+        Uninstall the profiler and probes without writing results, e.g. when
+        run() was cancelled or never awaited. Safe to call after run().
+        """
+        global active_session
+        if self._profile is not None:
+            self._profile.disable()
+        if self._task_tracer is not None:
+            self._task_tracer.cancel()
+        if self._lag_monitor is not None:
+            self._lag_monitor.stop()
+        if self._sampler is not None:
+            self._sampler.stop()
+        if active_session is self:
+            active_session = None
+
+    async def _trace_tasks(self):
+        while True:
+            tasks = asyncio.all_tasks()
+            waiting = Counter(describe_task(task) for task in tasks)
+            self._task_samples.append({
+                "t": round(time.monotonic() - self._started, 3),
+                "tasks": len(tasks),
+                "waiting": dict(waiting.most_common(10)),
+            })
+            await asyncio.sleep(TASK_TRACE_INTERVAL)
+
+    async def run(self):
+        """
+        Wait for the session to end, then uninstall everything and write the results.
+
+        Returns:
+            Dictionary with duration, messages, output file paths and summary lines
+        """
+        try:
+            await asyncio.wait_for(self._done.wait(), self.seconds)
+        except asyncio.TimeoutError:
+            pass
+
+        duration = time.monotonic() - self._started
+        if self._profile is not None:
+            self._profile.disable()
+        self._task_tracer.cancel()
+        self._lag_monitor.stop()
+        loop = asyncio.get_running_loop()
+        if self._sampler is not None:
+            await loop.run_in_executor(None, self._sampler.stop)
+
+        try:
+            return await loop.run_in_executor(None, self._write_results, duration)
+        finally:
+            global active_session
+            if active_session is self:
+                active_session = None
+
+    def _summary_lines(self, duration):
+        lag = self._lag_monitor.snapshot()
+        lines = [
+            f"Profile started {self.started_at:%Y-%m-%d %H:%M:%S}: {self.mode}, {duration:.1f}s, "
+            f"{self.messages} messages handled",
+            f"Loop lag: p50={lag['p50_ms']:.1f}ms p99={lag['p99_ms']:.1f}ms max={lag['max_ms']:.1f}ms",
+        ]
+        if self._task_samples:
+            counts = [sample["tasks"] for sample in self._task_samples]
+            waiting = Counter()
+            for sample in self._task_samples:
+                waiting.update(sample["waiting"])
+            lines.append(f"Tasks: p50={percentile(counts, 50):.0f} max={max(counts)}")
+            lines.extend(
+                f"   {count / len(self._task_samples):6.1f} avg  {label}"
+                for label, count in waiting.most_common(5)
+            )
+        return lines
+
+    def _write_results(self, duration):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"profile-{self.started_at:%Y%m%d-%H%M%S}")
+        lines = self._summary_lines(duration)
+        files = []
+
+        if self._sampler is not None:
+            files.append(f"{base}.folded")
+            self._sampler.write_folded(files[-1])
+            thread_samples, rows = self._sampler.top_functions(self._loop_thread_name)
+            lines.append(
+                f"Event loop thread ({self._loop_thread_name}): {thread_samples} samples "
+                f"every {self.sample_interval * 1000:g}ms; top functions by own time"
+            )
+            lines.append(f"{'own%':>6} {'total%':>7}  function")
+            lines.extend(
+                f"{own / max(thread_samples, 1):>6.1%} {total / max(thread_samples, 1):>7.1%}  {label}"
+                for label, own, total in rows
+            )
+        else:
+            files.append(f"{base}.prof")
+            self._profile.dump_stats(files[-1])
+            stream = io.StringIO()
+            pstats.Stats(self._profile, stream=stream).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            lines.append("Event loop thread: top functions by cumulative time")
+            lines.append(stream.getvalue().rstrip())
+
+        files.append(f"{base}-top.txt")
+        with open(files[-1], "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+        files.append(f"{base}-trace.json")
+        with open(files[-1], "w", encoding="utf-8") as f:
+            json.dump({
+                "mode": self.mode,
+                "duration_seconds": duration,
+                "messages": self.messages,
+                "loop_lag_interval_seconds": LAG_PROBE_INTERVAL,
+                "loop_lag_ms": [round(sample * 1000, 2) for sample in self._lag_monitor.samples],
+                "tasks": self._task_samples,
+            }, f)
+
+        return {"duration": duration, "messages": self.messages, "files": files, "summary": lines}
+
+
+def start_session(mode="sampler", seconds=30, messages=0):
+    """
+    Start profiling. Must be called on the event loop thread.
+
+    Args:
+        mode: "sampler" or "cprofile"
+        seconds: Maximum duration (capped at PROFILE_MAX_SECONDS)
+        messages: Stop after this many handled messages (0 = duration only)
+
+    Returns:
+        The started ProfileSession; await its run() for the results, and
+        close() it if run() may not complete
+
+    Raises:
+        RuntimeError: If a session is already running
+    """
+    global active_session
+    if active_session is not None:
+        raise RuntimeError("A profile is already running")
+    session = ProfileSession(mode, min(seconds, PROFILE_MAX_SECONDS), messages)
+    session.start()
+    active_session = session
+    return session
@@ -0,0 +1,283 @@
+"""
+Shared resilience layer for outbound API calls.
+Provides decorrelated-jitter retries that respect Retry-After, per-call
+deadlines, and a circuit breaker per endpoint that fails fast while the
+API is unhealthy.
+"""
+
+import asyncio
+import email.utils
+import json
+import random
+import re
+import time
+import aiohttp
+from colorama import Fore
+
+from config import BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS
+from utils import log
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the endpoint's breaker is open."""
+
+
+class HTTPStatusError(Exception):
+    """Raised when an API call returns a non-200 status."""
+
+    def __init__(self, status, body, retry_after=None):
+        super().__init__(f"API returned status {status}: {body[:500]}")
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status in RETRYABLE_STATUSES
+
+
+def parse_retry_after(header_value, body=None):
+    """
+    Work out how long the server asked us to wait.
+
+    Args:
+        header_value: Value of the Retry-After header (seconds or HTTP date), or None
+        body: Response body, checked for a Gemini RetryInfo "retryDelay" when
+            the header is missing
+
+    Returns:
+        float seconds, or None if the server gave no hint
+    """
+    if header_value:
+        try:
+            return max(0.0, float(header_value))
+        except ValueError:
+            try:
+                retry_at = email.utils.parsedate_to_datetime(header_value)
+                return max(0.0, retry_at.timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    if body:
+        match = re.search(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"', body)
+        if match:
+            return float(match.group(1))
+
+    return None
+
+
+class CircuitBreaker:
+    """
+    Classic three-state circuit breaker.
+
+    closed: calls flow normally; consecutive failures are counted.
+    open: calls are rejected until reset_timeout has passed.
+    half_open: a single probe call is let through; success closes the
+    breaker, failure opens it again.
+
+    Every call allow() lets through must end in record_success,
+    record_failure or release.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.total_failures = 0
+        self.total_rejections = 0
+        self._probe_in_flight = False
+
+    def _set_state(self, state):
+        if state != self.state:
+            color = Fore.GREEN if state == "closed" else Fore.YELLOW if state == "half_open" else Fore.RED
+            log(f"[BREAKER] {self.name}: {self.state} -> {state}", color)
+            self.state = state
+
+    def allow(self):
+        """
+        Check whether a call may go through right now.
+
+        Returns:
+            bool: False if the call should fail fast
+        """
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.total_rejections += 1
+                return False
+            self._set_state("half_open")
+            self._probe_in_flight = False
+
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                self.total_rejections += 1
+                return False
+            self._probe_in_flight = True
+
+        return True
+
+    def record_success(self):
+        """Record a successful call."""
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+        self._set_state("closed")
+
+    def record_failure(self):
+        """Record a failed call, opening the breaker if needed."""
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state("open")
+
+    def release(self):
+        """
+        End a call without recording an outcome (it was cancelled, or failed in
+        a way that says nothing about the endpoint), so a probe that never
+        finished doesn't keep the breaker half open forever.
+        """
+        self._probe_in_flight = False
+
+    def snapshot(self):
+        """
+        Get the breaker state for monitoring.
+
+        Returns:
+            Dictionary with state, failure counts and seconds until retry
+        """
+        retry_in = None
+        if self.state == "open":
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "total_rejections": self.total_rejections,
+            "retry_in_seconds": retry_in,
+        }
+
+
+_breakers = {}
+
+
+def get_breaker(endpoint):
+    """Get or create the circuit breaker for an endpoint."""
+    if endpoint not in _breakers:
+        _breakers[endpoint] = CircuitBreaker(endpoint, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+    return _breakers[endpoint]
+
+
+def breaker_states():
+    """
+    Get the state of every circuit breaker, for monitoring.
+
+    Returns:
+        Dictionary mapping endpoint name to its breaker snapshot
+    """
+    return {endpoint: breaker.snapshot() for endpoint, breaker in _breakers.items()}
+
+
+async def post_json(session, url, payload):
+    """
+    POST a JSON payload and return the decoded JSON response.
+
+    Raises:
+        HTTPStatusError: If the response status is not 200
+    """
+    return await request_json(session, "POST", url, payload)
+
+
+async def request_json(session, method, url, payload):
+    """
+    Send a JSON payload with the given HTTP method and return the decoded JSON response.
+
+    Raises:
+        HTTPStatusError: If the response status is not 200
+    """
+    async with session.request(method, url, headers={"Content-Type": "application/json"}, data=json.dumps(payload)) as resp:
+        if resp.status != 200:
+            body = await resp.text()
+            raise HTTPStatusError(resp.status, body, parse_retry_after(resp.headers.get("Retry-After"), body))
+        return await resp.json()
+
+
+async def call_with_retries(endpoint, request, max_attempts=3, base_delay=0.5, max_delay=8.0, deadline=None):
+    """
+    Run an outbound call with retries, a deadline and the endpoint's circuit breaker.
+
+    Retries use decorrelated jitter (each delay is drawn between base_delay and
+    three times the previous delay, capped at max_delay) and never wait less than
+    the server's Retry-After. Retries stop early if the next attempt could not
+    start before the deadline or another call opened the breaker. The breaker
+    records one outcome per call, not one per attempt.
+
+    Args:
+        endpoint: Name of the endpoint, used to pick the circuit breaker
+        request: Async callable with no arguments performing one attempt
+        max_attempts: Maximum number of attempts
+        base_delay: Minimum delay between attempts in seconds
+        max_delay: Maximum delay between attempts in seconds
+        deadline: Total seconds allowed across all attempts (None for no limit)
+
+    Returns:
+        Whatever request returns
+
+    Raises:
+        CircuitOpenError: If the breaker is open
+        HTTPStatusError: If the API returned a non-retryable status, or retries ran out
+        asyncio.TimeoutError: If the deadline passed
+    """
+    breaker = get_breaker(endpoint)
+    if not breaker.allow():
+        raise CircuitOpenError(f"{endpoint} circuit breaker is open")
+
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + deadline if deadline else None
+    delay = base_delay
+    recorded = False
+
+    try:
+        for attempt in range(1, max_attempts + 1):
+            retry_after = None
+            try:
+                remaining = give_up_at - loop.time() if give_up_at else None
+                result = await asyncio.wait_for(request(), remaining)
+                breaker.record_success()
+                recorded = True
+                return result
+            except HTTPStatusError as e:
+                if not e.retryable:
+                    # The API answered; the request itself was bad
+                    breaker.record_success()
+                    recorded = True
+                    raise
+                error = e
+                retry_after = e.retry_after
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+
+            if attempt >= max_attempts or breaker.state == "open":
+                break
+
+            delay = min(max_delay, random.uniform(base_delay, delay * 3))
+            sleep_for = max(delay, retry_after or 0.0)
+            if give_up_at and loop.time() + sleep_for >= give_up_at:
+                break
+
+            log(f"[RETRY] {endpoint}: {type(error).__name__}, retrying in {sleep_for:.1f}s (attempt {attempt}/{max_attempts})", Fore.YELLOW)
+            await asyncio.sleep(sleep_for)
+
+        breaker.record_failure()
+        recorded = True
+        raise error
+    finally:
+        # Cancelled (e.g. a speculative search or an outer wait_for budget) or
+        # an unexpected error: free the probe slot without judging the endpoint
+        if not recorded:
+            breaker.release()
@@ -0,0 +1,189 @@
+"""
+Out-of-process vector search worker pool.
+Runs ChromaDB queries (HNSW search and SQLite reads) in dedicated worker
+processes so they don't contend for the GIL with the Discord gateway loop.
+Query vectors are sent to the workers over the pool's pipe. Live ingestion
+writes go through a separate single-process pool, so they never queue ahead
+of searches and a search timeout (which restarts the search pool) never kills
+a write in progress.
+"""
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from colorama import Fore
+
+from config import MEMORY_SNAPSHOT, SEARCH_WORKER_PROCESSES, SEARCH_WORKER_TIMEOUT_SECONDS
+from utils import log
+
+_pool = None
+_write_pool = None
+
+
+def _init_worker():
+    """Open the collection (or snapshot) once per worker so queries don't pay for it."""
+    if MEMORY_SNAPSHOT:
+        from memory_snapshot import get_snapshot
+        get_snapshot()
+        return
+    from chromadb_storage import get_or_create_collection
+    get_or_create_collection()
+
+
+def _run_search_batch(query_embeddings, limit, recency=None, projection_version=None, namespace=None,
+                      global_fallback=False):
+    """Run a batch of searches inside a worker process."""
+    from chromadb_storage import search_similar_messages_batch
+    return search_similar_messages_batch(query_embeddings, limit, recency, projection_version, namespace, global_fallback)
+
+
+def _run_add(messages, embeddings, message_ids, authors, metadatas):
+    """Store messages inside a worker process so its index sees them."""
+    from chromadb_storage import add_messages
+    return add_messages(messages, embeddings, message_ids, authors, metadatas)
+
+
+def get_pool():
+    """Get or create the bounded search worker pool."""
+    global _pool
+    if _pool is None:
+        # Spawn fresh interpreters rather than forking a process that has
+        # running threads and open sockets
+        _pool = ProcessPoolExecutor(
+            max_workers=SEARCH_WORKER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+    return _pool
+
+
+def get_write_pool():
+    """Get or create the single-process pool that stores new messages."""
+    global _write_pool
+    if _write_pool is None:
+        _write_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _write_pool
+
+
+def restart_pool():
+    """Tear down the current pool, killing any hung or crashed workers."""
+    global _pool
+    if _pool is None:
+        return
+
+    # ProcessPoolExecutor can't cancel a running call, so a hung worker has to
+    # be terminated directly before the pool is replaced
+    for process in list(getattr(_pool, "_processes", {}).values()):
+        if process.is_alive():
+            process.terminate()
+    _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+
+async def search_batch_in_worker(query_embeddings, limit=8, timeout=None, recency=None, projection_version=None,
+                                 namespace=None, global_fallback=False):
+    """
+    Search for messages similar to several embeddings in a worker process.
+
+    Args:
+        query_embeddings: List of embedding vectors to search for
+        limit: Maximum number of results to return per query
+        timeout: Seconds to wait before giving up (defaults to SEARCH_WORKER_TIMEOUT_SECONDS)
+        recency: Optional recency settings, see chromadb_storage.search_similar_messages_batch
+        projection_version: Search this projection's reduced collection instead
+        namespace: Memory namespace to search (None for the shared collection)
+        global_fallback: Also search other guilds' messages left in the shared collection
+
+    Returns:
+        List with one list of (message_content, similarity_score, author) tuples per query
+    """
+    timeout = timeout or SEARCH_WORKER_TIMEOUT_SECONDS
+    loop = asyncio.get_running_loop()
+
+    query_embeddings = [
+        embedding.tolist() if hasattr(embedding, 'tolist') else embedding
+        for embedding in query_embeddings
+    ]
+
+    # One retry after a crash; the second failure is reported to the caller
+    for attempt in range(2):
+        try:
+            future = loop.run_in_executor(
+                get_pool(), _run_search_batch, query_embeddings, limit, recency, projection_version,
+                namespace, global_fallback
+            )
+            return await asyncio.wait_for(future, timeout)
+        except BrokenProcessPool:
+            log(f"[SEARCH WORKER] Worker crashed, restarting pool (attempt {attempt + 1}/2)", Fore.YELLOW)
+            restart_pool()
+        except asyncio.TimeoutError:
+            log(f"[SEARCH WORKER] Search timed out after {timeout}s, restarting pool", Fore.YELLOW)
+            restart_pool()
+            raise
+
+    raise RuntimeError("Search worker pool crashed twice in a row")
+
+
+async def search_in_worker(query_embedding, limit=8, timeout=None):
+    """
+    Search for similar messages in a worker process.
+
+    Args:
+        query_embedding: The embedding vector to search for
+        limit: Maximum number of results to return
+        timeout: Seconds to wait before giving up (defaults to SEARCH_WORKER_TIMEOUT_SECONDS)
+
+    Returns:
+        List of tuples (message_content, similarity_score, author)
+    """
+    results = await search_batch_in_worker([query_embedding], limit, timeout)
+    return results[0]
+
+
+async def add_in_worker(messages, embeddings, message_ids, authors=None, metadatas=None):
+    """
+    Store new messages in the write pool's process.
+    Each search worker holds its own copy of the HNSW index, so searches only
+    see these messages once the search pool restarts.
+
+    Returns:
+        int: Number of messages added (excludes duplicates)
+
+    Raises:
+        Exception: If storing failed (the caller keeps the messages to retry)
+    """
+    global _write_pool
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            get_write_pool(), _run_add, messages, embeddings, message_ids, authors, metadatas
+        )
+    except BrokenProcessPool:
+        _write_pool = None
+        raise
+
+
+def _ping():
+    """No-op used to make sure a worker has started and run its initializer."""
+    return True
+
+
+async def warm_up():
+    """Start every worker process ahead of the first search."""
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    await asyncio.gather(*[
+        loop.run_in_executor(pool, _ping) for _ in range(SEARCH_WORKER_PROCESSES)
+    ])
+
+
+def shutdown():
+    """Shut the worker pools down cleanly, letting a write in progress finish."""
+    global _pool, _write_pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+    if _write_pool is not None:
+        _write_pool.shutdown(wait=True)
+        _write_pool = None
@@ -0,0 +1,103 @@
+"""
+Multi-process shard launcher.
+Starts the shared memory service and one bot process per group of shards, so
+the bot can use more than one core and split guilds across processes.
+
+Usage:
+    python shard_launcher.py --shards 4 --processes 2
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from memory_service import DEFAULT_SERVICE_ADDRESS, parse_service_address
+
+
+def split_shards(shard_count, process_count):
+    """
+    Split shard IDs round-robin into one group per process: shard N goes to
+    process N % process_count, so group sizes differ by at most one.
+
+    Args:
+        shard_count: Total number of shards
+        process_count: Number of bot processes
+
+    Returns:
+        List of lists of shard IDs
+    """
+    process_count = max(1, min(process_count, shard_count))
+    groups = [[] for _ in range(process_count)]
+    for shard_id in range(shard_count):
+        groups[shard_id % process_count].append(shard_id)
+    return groups
+
+
+def wait_for_service(address, timeout=60):
+    """Wait until the memory service is accepting connections."""
+    import socket
+
+    kind, target = parse_service_address(address)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if kind == "unix":
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(target)
+            else:
+                sock = socket.create_connection(target, timeout=1)
+            sock.close()
+            return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Blevitron as several shard processes")
+    parser.add_argument("--shards", type=int, required=True, help="Total number of Discord shards")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Number of bot processes")
+    parser.add_argument("--memory-address", default=os.environ.get("MEMORY_SERVICE_ADDRESS") or DEFAULT_SERVICE_ADDRESS,
+                        help="Address for the shared memory service")
+    args = parser.parse_args()
+
+    print(f"Starting memory service on {args.memory_address}...")
+    service_env = dict(os.environ, MEMORY_SERVICE_ADDRESS=args.memory_address)
+    service = subprocess.Popen([sys.executable, "memory_service.py"], env=service_env)
+    if not wait_for_service(args.memory_address):
+        print("ERROR: Memory service did not start in time")
+        service.terminate()
+        sys.exit(1)
+
+    processes = [service]
+    for index, shard_ids in enumerate(split_shards(args.shards, args.processes)):
+        env = dict(
+            os.environ,
+            SHARD_COUNT=str(args.shards),
+            SHARD_IDS=",".join(str(shard_id) for shard_id in shard_ids),
+            MEMORY_SERVICE_ADDRESS=args.memory_address,
+            # Each process tracks and spools the messages of its own guilds
+            PROCESSED_MESSAGES_DB=f"processed_messages.shard{index}.db",
+            LIVE_INGEST_SPOOL=f"ingest_spool.shard{index}.db",
+        )
+        print(f"Starting bot process {index} for shards {shard_ids}...")
+        processes.append(subprocess.Popen([sys.executable, "bot.py"], env=env))
+
+    try:
+        # Stop everything as soon as any process exits
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Speculative reply generation helpers.
+Scores how likely the bot is to reply to a message using cheap local signals,
+and caps how much speculative generation each channel may waste.
+"""
+
+import re
+import time
+from collections import deque
+
+# Names the bot answers to besides its full name
+BOT_NAME_PATTERN = re.compile(r'\b(blevitron|botlivia)\b', re.IGNORECASE)
+SECOND_PERSON_PATTERN = re.compile(r'\b(you|u|ur|your)\b', re.IGNORECASE)
+
+
+def reply_likelihood(message, history, bot_name):
+    """
+    Estimate how likely the reply decision is to come back YES.
+
+    Args:
+        message: The incoming Discord message
+        history: Recent conversation history for the channel
+        bot_name: String form of the bot user, as stored in history
+
+    Returns:
+        float: Score between 0 and 1
+    """
+    content = message.content
+    score = 0.0
+
+    if BOT_NAME_PATTERN.search(content):
+        score += 0.5
+    if content.rstrip().endswith('?'):
+        score += 0.3
+    if SECOND_PERSON_PATTERN.search(content):
+        score += 0.1
+
+    # The bot is already part of an active conversation in this channel
+    recent_authors = [entry['author'] for entry in history[-4:-1]]
+    if bot_name in recent_authors:
+        score += 0.3
+
+    if len(content.split()) < 3:
+        score -= 0.1
+
+    return max(0.0, min(1.0, score))
+
+
+class SpeculationBudget:
+    """
+    Per-channel cap on wasted speculative generations.
+    A channel may waste at most max_wasted speculations per rolling window.
+    """
+
+    def __init__(self, threshold=0.5, max_wasted=5, window_seconds=600):
+        """
+        Args:
+            threshold: Minimum likelihood score needed to speculate
+            max_wasted: Wasted speculations allowed per channel per window
+            window_seconds: Length of the rolling window
+        """
+        self.threshold = threshold
+        self.max_wasted = max_wasted
+        self.window_seconds = window_seconds
+        self._wasted = {}
+        self.started = 0
+        self.used = 0
+        self.wasted = 0
+
+    def _recent_waste(self, channel_id, now):
+        wasted = self._wasted.setdefault(channel_id, deque())
+        while wasted and wasted[0] <= now - self.window_seconds:
+            wasted.popleft()
+        return wasted
+
+    def should_speculate(self, channel_id, likelihood):
+        """
+        Decide whether to start a speculative generation.
+
+        Args:
+            channel_id: ID of the channel the message came from
+            likelihood: Score from reply_likelihood
+
+        Returns:
+            bool: True if speculation should start
+        """
+        if likelihood < self.threshold:
+            return False
+        if len(self._recent_waste(channel_id, time.monotonic())) >= self.max_wasted:
+            return False
+        self.started += 1
+        return True
+
+    def record_used(self, channel_id):
+        """Record that a speculative generation was sent as the reply."""
+        self.used += 1
+
+    def record_wasted(self, channel_id):
+        """Record that a speculative generation was cancelled and discarded."""
+        self.wasted += 1
+        self._recent_waste(channel_id, time.monotonic()).append(time.monotonic())
+
+    def stats(self):
+        """
+        Get speculation counters.
+
+        Returns:
+            Dictionary with started, used and wasted counts
+        """
+        return {"started": self.started, "used": self.used, "wasted": self.wasted}
@@ -0,0 +1,97 @@
+"""
+Startup profiling for `python bot.py --startup-profile`.
+Times top-level imports and background initialization steps, and prints a
+breakdown once the gateway is ready and background init has finished.
+Nothing is measured unless enable() is called.
+"""
+
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_started_at = time.perf_counter()
+_enabled = False
+_imports = []
+_init_steps = []
+_milestones = {}
+_reported = False
+_local = threading.local()
+_original_import = builtins.__import__
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Only the outermost import of a not-yet-loaded module is timed; nested
+    # imports are counted as part of the module that triggered them
+    if getattr(_local, "depth", 0) or level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+
+    _local.depth = 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _local.depth = 0
+        _imports.append((name, time.perf_counter() - start))
+
+
+def enable():
+    """Start timing imports. Call before the imports you want measured."""
+    global _enabled
+    if not _enabled:
+        _enabled = True
+        builtins.__import__ = _timed_import
+
+
+def is_enabled():
+    return _enabled
+
+
+@contextmanager
+def init_step(label):
+    """Time a background initialization step."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _enabled:
+            _init_steps.append((label, time.perf_counter() - start))
+
+
+def milestone(label):
+    """
+    Record a startup milestone (seconds since process start).
+    The report is printed once both "gateway ready" and "background init done"
+    have been recorded.
+    """
+    if not _enabled:
+        return
+    _milestones[label] = time.perf_counter() - _started_at
+    if "gateway ready" in _milestones and "background init done" in _milestones:
+        report()
+
+
+def report():
+    """Print the import-time and init-time breakdown."""
+    global _reported
+    if _reported:
+        return
+    _reported = True
+    builtins.__import__ = _original_import
+
+    lines = ["", "=" * 60, "STARTUP PROFILE", "=" * 60, "Imports (outermost, slowest first):"]
+    for name, seconds in sorted(_imports, key=lambda item: item[1], reverse=True)[:15]:
+        lines.append(f"  {seconds * 1000:8.1f} ms  {name}")
+    lines.append(f"  {sum(seconds for _, seconds in _imports) * 1000:8.1f} ms  total")
+
+    lines.append("Background init:")
+    for label, seconds in _init_steps:
+        lines.append(f"  {seconds * 1000:8.1f} ms  {label}")
+
+    lines.append("Milestones (since process start):")
+    for label, seconds in sorted(_milestones.items(), key=lambda item: item[1]):
+        lines.append(f"  {seconds * 1000:8.1f} ms  {label}")
+    lines.append("=" * 60)
+
+    print("\n".join(lines), flush=True)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def memory_store(tmp_path, monkeypatch):
+    """Empty ChromaDB store (and lexical/near-duplicate indexes) in a temporary directory."""
+    import chromadb_storage
+    import lexical_index
+    import near_duplicates
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(chromadb_storage, "CHROMA_DATA_DIR", str(tmp_path / "chroma_data"))
+    monkeypatch.setattr(chromadb_storage, "MEMORY_SNAPSHOT", "")
+    monkeypatch.setattr(chromadb_storage, "_client", None)
+    monkeypatch.setattr(chromadb_storage, "_collection", None)
+    monkeypatch.setattr(chromadb_storage, "_namespace_collections", {})
+    monkeypatch.setattr(chromadb_storage, "_reduced_collections", {})
+    monkeypatch.setattr(lexical_index, "_index", None)
+    monkeypatch.setattr(near_duplicates, "_index", None)
+    return chromadb_storage
@@ -0,0 +1,56 @@
+from chromadb_storage import namespace_for
+
+
+def store(memory_store, texts, embeddings, metadatas):
+    added = memory_store.add_messages(
+        texts, embeddings, message_ids=[f"id-{i}" for i in range(len(texts))],
+        authors=["alice"] * len(texts), metadatas=metadatas
+    )
+    assert added == len(texts)
+
+
+def test_namespaced_search_finds_shared_records_without_guild(memory_store):
+    store(memory_store, ["exported message"], [[1.0, 0.0, 0.0]], [{"timestamp": 1.0}])
+
+    results = memory_store.search_similar_messages_batch([[1.0, 0.0, 0.0]], limit=5, namespace=namespace_for("123"))
+
+    assert [content for content, _, _ in results[0]] == ["exported message"]
+
+
+def test_namespaced_search_ranks_namespace_and_shared_records_together(memory_store):
+    store(
+        memory_store,
+        ["guild message", "exported message"],
+        [[0.6, 0.8, 0.0], [1.0, 0.0, 0.0]],
+        [{"guild_id": "123"}, None]
+    )
+
+    results = memory_store.search_similar_messages_batch([[1.0, 0.0, 0.0]], limit=5, namespace=namespace_for("123"))
+
+    assert [content for content, _, _ in results[0]] == ["exported message", "guild message"]
+
+
+def test_other_guilds_shared_records_need_global_fallback(memory_store):
+    # Guild messages stored before namespaces were enabled sit in the shared collection
+    shared = memory_store.get_or_create_collection()
+    shared.add(
+        ids=["legacy-123", "legacy-456"],
+        embeddings=[[1.0, 0.0, 0.0], [0.9, 0.1, 0.0]],
+        documents=["our old message", "their old message"],
+        metadatas=[{"guild_id": "123"}, {"guild_id": "456"}]
+    )
+    query = [[1.0, 0.0, 0.0]]
+
+    scoped = memory_store.search_similar_messages_batch(query, limit=5, namespace=namespace_for("123"))
+    unscoped = memory_store.search_similar_messages_batch(
+        query, limit=5, namespace=namespace_for("123"), global_fallback=True
+    )
+
+    assert [content for content, _, _ in scoped[0]] == ["our old message"]
+    assert [content for content, _, _ in unscoped[0]] == ["our old message", "their old message"]
+
+
+def test_dm_guild_id_zero_has_no_namespace():
+    assert namespace_for("0", "42") is None
+    assert namespace_for(0, "42", mode="channel") is None
+    assert namespace_for("123", "42") == "g123"
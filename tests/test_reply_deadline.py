@@ -0,0 +1,44 @@
+import asyncio
+from types import SimpleNamespace
+
+from load_test import BOT_USER_ID, BOT_USER_NAME, FakeChannel, FakeMessage, FakeUser
+
+
+def test_decision_deadline_miss_still_replies(tmp_path, monkeypatch):
+    import bot as bot_module
+    import config
+    import llm
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "REPLY_SLO_SECONDS", 1.0)
+    monkeypatch.setattr(config, "DECISION_BUDGET_SHARE", 0.2)
+    monkeypatch.setattr(config, "REPLY_MODE", "two_call")
+    monkeypatch.setattr(config, "SPECULATIVE_GENERATION", False)
+    monkeypatch.setattr(config, "LIVE_INGEST", False)
+
+    async def no_memories(*args):
+        return []
+
+    async def post_generate(payload):
+        system_text = payload.get("systemInstruction", {}).get("parts", [{}])[0].get("text", "")
+        if "Respond with only YES or NO" in system_text:
+            # The decision takes far longer than its budget
+            await asyncio.sleep(10)
+        return {"candidates": [{"content": {"parts": [{"text": "hi"}]}}]}
+
+    monkeypatch.setattr(bot_module, "retrieve_memories", no_memories)
+    monkeypatch.setattr(llm, "post_generate", post_generate)
+
+    bot_module.init_bot()
+    bot_module.bot._connection.user = FakeUser(BOT_USER_ID, BOT_USER_NAME, bot=True)
+    replies = []
+    report = SimpleNamespace(record_reply=replies.append)
+    guild = SimpleNamespace(id=1, name="test", me=bot_module.bot.user)
+    channel = FakeChannel(10, "general", guild, report, send_latency=0)
+    message = FakeMessage(1, FakeUser(2, "alice"), "anyone seen the new trailer", channel)
+
+    before = bot_module.deadline_stats.degradations.get("decision_timeout", 0)
+    asyncio.run(asyncio.wait_for(bot_module.on_message(message), 5))
+
+    assert len(replies) == 1
+    assert bot_module.deadline_stats.degradations["decision_timeout"] == before + 1
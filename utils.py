@@ -1,20 +1,146 @@
+import atexit
 import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
 import re
+import sys
 from colorama import Fore, Style, init
-from config import BAGGINS_ID, SNAZZYDADDY_ID, PHROGSLEG_ID, CORN_ID, PUGMONKEY_ID, MEATBRO_ID, RESTORT_ID, TBL_ID, EVAN_ID, DROID_ID
+import config
 
 # Initialize Colorama
 init(autoreset=True)
 
 # -------- Logger with Timestamps --------
-def log(message, color=Fore.WHITE):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"{Fore.LIGHTBLACK_EX}[{timestamp}]{Style.RESET_ALL} {color}{message}{Style.RESET_ALL}")
+# log() only builds a record and puts it on a queue; a background listener
+# thread formats it and writes it to the configured sinks.
+_CATEGORY_PATTERN = re.compile(r"^\[([A-Za-z][A-Za-z0-9 _-]*)\]")
+
+# Log level implied by the color existing call sites already pass
+_COLOR_LEVELS = {
+    Fore.RED: logging.ERROR,
+    Fore.YELLOW: logging.WARNING,
+}
+
+_logger = None
+_listener = None
+
+
+class CategorySampler(logging.Filter):
+    """
+    Keep only a share of the records in some categories.
+    Warnings and errors always pass. Runs before records are queued, so
+    dropped records cost almost nothing.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.dropped = {}
+
+    def filter(self, record):
+        rate = self.rates.get(record.category)
+        if rate is None or record.levelno >= logging.WARNING or random.random() < rate:
+            return True
+        self.dropped[record.category] = self.dropped.get(record.category, 0) + 1
+        return False
+
+
+class ConsoleFormatter(logging.Formatter):
+    """The original colored "[timestamp] message" console format."""
+
+    def format(self, record):
+        timestamp = datetime.datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
+        color = getattr(record, "color", Fore.WHITE)
+        return f"{Fore.LIGHTBLACK_EX}[{timestamp}]{Style.RESET_ALL} {color}{record.getMessage()}{Style.RESET_ALL}"
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with timestamp, level, category, message and extra fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "category": record.category,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _get_logger():
+    """Create the queue-backed logger and start its listener on first use."""
+    global _logger, _listener
+    if _logger is not None:
+        return _logger
+
+    sinks = []
+    if config.LOG_CONSOLE:
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(ConsoleFormatter())
+        sinks.append(console)
+    if config.LOG_JSON_FILE:
+        json_sink = (
+            logging.StreamHandler(sys.stdout) if config.LOG_JSON_FILE == "-"
+            else logging.FileHandler(config.LOG_JSON_FILE, encoding="utf-8")
+        )
+        json_sink.setFormatter(JSONFormatter())
+        sinks.append(json_sink)
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, *sinks)
+    _listener.start()
+    atexit.register(_listener.stop)  # flush what's still queued on exit
+
+    _logger = logging.getLogger("blevitron")
+    _logger.propagate = False
+    _logger.setLevel(getattr(logging, config.LOG_LEVEL, logging.INFO))
+    handler = logging.handlers.QueueHandler(log_queue)
+    if config.LOG_SAMPLE_RATES:
+        handler.addFilter(CategorySampler(config.LOG_SAMPLE_RATES))
+    _logger.addHandler(handler)
+    return _logger
+
+
+def log_enabled(level):
+    """Check whether records at this level are logged, to skip building costly messages."""
+    return _get_logger().isEnabledFor(level)
+
+
+def log(message, color=Fore.WHITE, level=None, category=None, **fields):
+    """
+    Queue a log line for the background writer.
+
+    Args:
+        message: Text to log; a leading "[TAG]" is used as its category
+        color: Console color; also implies the level when none is given
+            (red = error, yellow = warning, anything else = info)
+        level: Optional logging level overriding the one implied by color
+        category: Optional category overriding the one parsed from the message
+        **fields: Extra structured fields included in JSON output
+    """
+    logger = _get_logger()
+    level = level if level is not None else _COLOR_LEVELS.get(color, logging.INFO)
+    if not logger.isEnabledFor(level):
+        return
+    if category is None:
+        match = _CATEGORY_PATTERN.match(message)
+        category = match.group(1).upper() if match else "GENERAL"
+    logger.log(level, message, extra={"color": color, "category": category, "fields": fields})
 
 # -------- Replace with Mentions --------
 def replace_with_mentions(text):
     """Replace username mentions with Discord mentions using word boundaries to avoid partial matches"""
     
+    # User IDs are loaded from users.json on first use
+    BAGGINS_ID, SNAZZYDADDY_ID, PHROGSLEG_ID = config.BAGGINS_ID, config.SNAZZYDADDY_ID, config.PHROGSLEG_ID
+    CORN_ID, PUGMONKEY_ID, MEATBRO_ID = config.CORN_ID, config.PUGMONKEY_ID, config.MEATBRO_ID
+    RESTORT_ID, TBL_ID, EVAN_ID, DROID_ID = config.RESTORT_ID, config.TBL_ID, config.EVAN_ID, config.DROID_ID
+    
     # Define replacements as (pattern, mention) tuples
     # Using word boundaries (\b) to match whole words only
     replacements = [